@@ -4,6 +4,7 @@
 
 from ncsa_log import NCSALogFormat, NCSALogRecord, FieldNotDefinedException
 from m.utilities import mergeDictionaries
+import httpd_log_agent
 import re
 
 class ApacheLogFormat(NCSALogFormat):
@@ -87,6 +88,36 @@ class ApacheLogFormat(NCSALogFormat):
     }
 
     fieldPatterns = mergeDictionaries(NCSALogFormat.fieldPatterns, ourFieldPatterns)
+
+    ourFieldAliases = {
+        "durationUsecAsStr": ["durationUsec"],
+        "durationSecAsStr": ["durationSec"],
+        "duration": ["durationUsec", "durationSec"],
+        "keepaliveNumAsStr": ["keepaliveNum"],
+        "portAsStr": ["port"],
+        "workerPidAsStr": ["workerPid"],
+        "receivedBytesAsStr": ["receivedBytes"],
+        "sentBytesAsStr": ["sentBytes"],
+        "userAgent": ["_User_agent_i"],
+        "userAgentInfo": ["_User_agent_i"],
+        "browser": ["_User_agent_i"],
+        "browserVersion": ["_User_agent_i"],
+        "operatingSystem": ["_User_agent_i"],
+        "deviceType": ["_User_agent_i"],
+        "isBot": ["_User_agent_i"],
+        "referer": ["_Referer_i"],
+        "contentType": ["_Content_type_o"],
+        "contentLength": ["_Content_length_o"],
+        "contentLengthAsStr": ["_Content_length_o"],
+        "queryString": ["requestQueryString", "queryString"],
+        "queryArgs": ["requestQueryString", "queryString"],
+        "urlPath": ["requestUrlPath", "urlPath"],
+        "method": ["requestMethod", "method"],
+        "protocol": ["requestProtocol", "protocol"],
+        "numbytes": ["bytes", "bytesZero"],
+        "numbytesAsStr": ["bytes", "bytesZero"],
+    }
+    fieldAliases = mergeDictionaries(NCSALogFormat.fieldAliases, ourFieldAliases)
     # exceptional fields have both direct access  and  access via corresponding container
     exceptionalFields = set(["{User-agent}i", "{Referer}i", "{Content-type}o", "{Content-length}o"])
     
@@ -97,20 +128,32 @@ class ApacheLogFormat(NCSALogFormat):
         "combined": "%h %l %u %t \"%r\" %>s %b \"%{Referer}i\" \"%{User-agent}i\"",
     }
     
-    def __init__(self, formatStr):
+    def __init__(self, formatStr, fields=None):
         self.inputHdrFields = {}
         self.outputHdrFields = {}
         self.envFields = {}
         self.cookieFields = {}
-        resolved = ApacheLogFormat.predefinedFormats.get(formatStr)
-        if resolved:
-            formatStr = resolved
-        NCSALogFormat.__init__(self, formatStr)
+        NCSALogFormat.__init__(self, self.resolveFormat(formatStr), fields)
+
+    @classmethod
+    def resolveFormat(cls, formatStr):
+        return ApacheLogFormat.predefinedFormats.get(formatStr) or formatStr
     
     fieldSubRE = re.compile("[-{}]")
     def getCollectionFieldGroupName(self, field):
         return ApacheLogFormat.fieldSubRE.sub("_", field)
     
+    # header fields may be requested either as "{Header}i" or by group name "_Header_i"
+    def isCollectionField(self, name):
+        return name.startswith("{") or name.startswith("_")
+
+    def isGroupRequired(self, groupName):
+        if self.requiredFieldIds is not None:
+            for name in self.requiredFields:
+                if name.startswith("{") and self.getCollectionFieldGroupName(name) == groupName:
+                    return True
+        return NCSALogFormat.isGroupRequired(self, groupName)
+
     def getPattern(self, field, default):
         if field.startswith("{"):
             if field in self.__class__.exceptionalFields:
@@ -126,7 +169,7 @@ class ApacheLogFormat(NCSALogFormat):
 
     def registerFieldReferences(self, field):
         NCSALogFormat.registerFieldReferences(self, field)
-        if len(field)>3:
+        if len(field)>3 and self.isGroupRequired(self.getCollectionFieldGroupName(field)):
             if field[-2:] == "}i":
                 self.addReference(self.getCollectionFieldGroupName(field), self.inputHdrFields, field[1:-2])
             elif field[-2:] == "}o":
@@ -138,7 +181,7 @@ class ApacheLogFormat(NCSALogFormat):
             
     def getInputHdrField(self, fieldName, matchObj):
         groupId = self.inputHdrFields.get(fieldName)
-        if fieldName is None:
+        if groupId is None:
             raise FieldNotDefinedException(fieldName)
         else:
             return matchObj.group(groupId)
@@ -147,7 +190,7 @@ class ApacheLogFormat(NCSALogFormat):
 
     def getOutputHdrField(self, fieldName, matchObj):
         groupId = self.outputHdrFields.get(fieldName)
-        if fieldName is None:
+        if groupId is None:
             raise FieldNotDefinedException(fieldName)
         else:
             return matchObj.group(groupId)
@@ -156,7 +199,7 @@ class ApacheLogFormat(NCSALogFormat):
 
     def getEnvHdrField(self, fieldName, matchObj):
         groupId = self.envHdrFields.get(fieldName)
-        if fieldName is None:
+        if groupId is None:
             raise FieldNotDefinedException(fieldName)
         else:
             return matchObj.group(groupId)
@@ -165,7 +208,7 @@ class ApacheLogFormat(NCSALogFormat):
 
     def getCookieHdrField(self, fieldName, matchObj):
         groupId = self.cookieHdrFields.get(fieldName)
-        if fieldName is None:
+        if groupId is None:
             raise FieldNotDefinedException(fieldName)
         else:
             return matchObj.group(groupId)
@@ -174,6 +217,9 @@ class ApacheLogFormat(NCSALogFormat):
 
 
 class ApacheLogRecord(NCSALogRecord):
+    derivedFields = mergeDictionaries(NCSALogRecord.derivedFields,
+        dict((name, "userAgent") for name in ["userAgentInfo", "browser", "browserVersion", "operatingSystem", "deviceType", "isBot"]))
+
     def __init__(self, format, line, match=None):
         NCSALogRecord.__init__(self, format, line, match)
     
@@ -281,6 +327,25 @@ class ApacheLogRecord(NCSALogRecord):
     @property
     def userAgent(self):
         return self._format.getField(ApacheLogFormat.FLD_USER_AGENT, self._match)
+    # classification of the user agent, shared by records with the same user agent (see httpd_log_agent)
+    @property
+    def userAgentInfo(self):
+        return httpd_log_agent.agentCache.get(self.userAgent)
+    @property
+    def browser(self):
+        return self.userAgentInfo.browser
+    @property
+    def browserVersion(self):
+        return self.userAgentInfo.browserVersion
+    @property
+    def operatingSystem(self):
+        return self.userAgentInfo.os
+    @property
+    def deviceType(self):
+        return self.userAgentInfo.device
+    @property
+    def isBot(self):
+        return self.userAgentInfo.isBot
 
     @property
     def referer(self):
@@ -334,4 +399,31 @@ def test():
     ut.EXPECT_EQ("Mozilla/5.0 (Windows NT 6.1; WOW64; rv:29.0) Gecko/20100101 Firefox/29.0", "record.userAgent")
     ut.EXPECT_EQ("text/html; charset=ISO-8859-4", "record.contentType")
     ut.EXPECT_EQ(1000, "record.contentLength")
-    ut.END_TEST()
\ No newline at end of file
+    ut.END_TEST()
+
+    ut.START_TEST("apache_log_projection")
+    full = getTestCustomApacheRecord()
+    alf = ApacheLogFormat(full._format.template, fields=["status", "durationUsec", "urlPath", "{User-agent}i"])
+    record = ApacheLogRecord(alf, full.line)
+    ut.EXPECT_EQ(4, "alf.regexp.groups")
+    ut.EXPECT_EQ(full.status, "record.status")
+    ut.EXPECT_EQ(full.durationUsec, "record.durationUsec")
+    ut.EXPECT_EQ(full.urlPath, "record.urlPath")
+    ut.EXPECT_EQ(full.userAgent, "record.inputHdrField('User-agent')")
+    for name in ["remoteHost", "gmtime", "referer", "queryString"]:
+        try:
+            getattr(record, name)
+            notDefined = None
+        except FieldNotDefinedException:
+            notDefined = name
+        ut.EXPECT_EQ(name, "notDefined")
+    ut.END_TEST()
+
+    ut.START_TEST("apache_log_format_cache")
+    alf = ApacheLogFormat.getCached("combined", "status,urlPath")
+    ut.EXPECT_EQ(True, "alf is ApacheLogFormat.getCached(ApacheLogFormat.predefinedFormats['combined'], ['urlPath', 'status'])")
+    ut.EXPECT_EQ(False, "alf is ApacheLogFormat.getCached('combined', 'status')")
+    ut.EXPECT_EQ(False, "alf is ApacheLogFormat.getCached('combined')")
+    ut.EXPECT_EQ(False, "NCSALogFormat.getCached('%h %l %u %t \"%r\" %>s %b') is ApacheLogFormat.getCached('common')")
+    ut.EXPECT_EQ(200, "ApacheLogRecord(alf, getTestApacheRecord().line).status")
+    ut.END_TEST()
@@ -0,0 +1,177 @@
+#
+# Copyright Michael Groys, 2014
+#
+# Classification of user agents (%{User-agent}i) to browser, operating system, device type and bots.
+# Rules are kept in tables ordered by priority, every rule has literal tokens and optional pattern that captures
+# version by (?P<version>...) group, bot rules are matched in lower case.
+# Every table is compiled once to matcher that checks rules in order: pattern is searched only if one of the rule tokens
+# is substring of the agent, so the string is scanned by fast substring search for most of the rules
+# (alternation of all rule patterns in single expression is few times slower with python re, it tries every
+# alternative at every position).
+# There are few thousands distinct user agents per day, so classifications are cached in bounded LRU cache
+# by the raw user agent string (see httpd_log_url), records share UserAgentInfo tuples.
+#
+import re
+import collections
+import httpd_log_url
+
+DEFAULT_AGENT_CACHE_SIZE = 10000
+UNKNOWN = "Unknown"
+OTHER = "Other"
+
+# (name, literal token or tuple of them, pattern or None), bot tokens and patterns are lower case
+BOT_RULES = [
+    ("Googlebot", "googlebot", r"googlebot(?:-\w+)?/(?P<version>[\d.]+)"),
+    ("Googlebot", ("google-read-aloud", "googleother", "google-inspectiontool"), None),
+    ("Bingbot", "bingbot", r"bingbot/(?P<version>[\d.]+)"),
+    ("Yahoo Slurp", "yahoo! slurp", None),
+    ("Baiduspider", "baiduspider", r"baiduspider(?:-\w+)?/(?P<version>[\d.]+)"),
+    ("YandexBot", "yandex", r"yandex\w*/(?P<version>[\d.]+)"),
+    ("DuckDuckBot", "duckduckbot", r"duckduckbot(?:-\w+)?/(?P<version>[\d.]+)"),
+    ("Facebook", "facebookexternalhit", r"facebookexternalhit/(?P<version>[\d.]+)"),
+    ("AhrefsBot", "ahrefsbot", r"ahrefsbot/(?P<version>[\d.]+)"),
+    ("SemrushBot", "semrushbot", r"semrushbot(?:/(?P<version>[\d.]+))?"),
+    ("curl", "curl/", r"^curl/(?P<version>[\d.]+)"),
+    ("Wget", "wget/", r"^wget/(?P<version>[\d.]+)"),
+    ("Python", ("python", "aiohttp"), r"^(?:python-requests|python-urllib|aiohttp)/(?P<version>[\d.]+)"),
+    ("Java", ("java/", "apache-httpclient/", "okhttp/"), r"^(?:java|apache-httpclient|okhttp)/(?P<version>[\d.]+)"),
+    ("Go", "go-http-client/", r"^go-http-client/(?P<version>[\d.]+)"),
+    ("libwww-perl", "libwww-perl/", r"^libwww-perl/(?P<version>[\d.]+)"),
+    ("Other bot", ("bot", "crawl", "spider", "slurp", "scan", "monitor", "preview", "headless"),
+     r"bot\b|crawl|spider|slurp|scan|monitor|preview|headless"),
+]
+
+BROWSER_RULES = [
+    ("Edge", "Edg", r"Edg(?:e|A|iOS)?/(?P<version>[\d.]+)"),
+    ("Opera", ("OPR/", "Opera"), r"(?:OPR|Opera)/(?P<version>[\d.]+)"),
+    ("Samsung Internet", "SamsungBrowser/", r"SamsungBrowser/(?P<version>[\d.]+)"),
+    ("Yandex Browser", "YaBrowser/", r"YaBrowser/(?P<version>[\d.]+)"),
+    ("UC Browser", "Browser/", r"UC ?Browser/(?P<version>[\d.]+)"),
+    ("Chrome", ("Chrome/", "CriOS/"), r"(?:Chrome|CriOS)/(?P<version>[\d.]+)"),
+    ("Firefox", ("Firefox/", "FxiOS/"), r"(?:Firefox|FxiOS)/(?P<version>[\d.]+)"),
+    ("IE", "MSIE ", r"MSIE (?P<version>[\d.]+)"),
+    ("IE", "Trident/", r"Trident/.*?rv:(?P<version>[\d.]+)"),
+    ("Safari", "Version/", r"Version/(?P<version>[\d.]+).*?Safari/"),
+    ("Safari", "Mobile/", r"AppleWebKit/.*?Mobile/"),
+]
+
+OS_RULES = [
+    ("Windows Phone", "Windows Phone", r"Windows Phone(?: OS)? (?P<version>[\d.]+)"),
+    ("Windows", "Windows NT ", r"Windows NT (?P<version>[\d.]+)"),
+    ("Windows", ("Windows 9", "Windows XP", "Windows CE"), None),
+    ("iOS", ("iPhone", "iPad", "iPod"), r"(?:iPhone|iPad|iPod).*? OS (?P<version>\d+(?:_\d+)*)"),
+    ("Android", "Android", r"Android(?: (?P<version>[\d.]+))?"),
+    ("Chrome OS", "CrOS ", r"CrOS \w+ (?P<version>[\d.]+)"),
+    ("Mac OS X", "Mac OS X", r"Mac OS X(?: (?P<version>\d+(?:[_.]\d+)*))?"),
+    ("Linux", ("Linux", "X11"), None),
+]
+
+MOBILE_OS = set(["iOS", "Android", "Windows Phone"])
+DESKTOP_OS = set(["Windows", "Mac OS X", "Linux", "Chrome OS"])
+
+UserAgentInfo = collections.namedtuple("UserAgentInfo", "browser browserVersion os osVersion device isBot")
+
+class RuleMatcher(object):
+    # compiled rule table, match returns (name, version) of the first matching rule,
+    # lowerCase - value is matched in lower case
+    def __init__(self, rules, lowerCase=False):
+        self.lowerCase = lowerCase
+        self.rules = []
+        for name, tokens, pattern in rules:
+            if isinstance(tokens, basestring):
+                tokens = (tokens,)
+            self.rules.append((name, tokens, re.compile(pattern) if pattern else None))
+
+    def match(self, value):
+        if self.lowerCase:
+            value = value.lower()
+        for name, tokens, regexp in self.rules:
+            for token in tokens:
+                if token in value:
+                    break
+            else:
+                continue
+            if regexp is None:
+                return name, ""
+            mo = regexp.search(value)
+            if mo:
+                version = mo.groupdict().get("version")
+                return name, (version or "").replace("_", ".")
+        return None, ""
+
+_matchers = None
+
+def _getMatchers():
+    global _matchers
+    if _matchers is None:
+        _matchers = (RuleMatcher(BOT_RULES, lowerCase=True), RuleMatcher(BROWSER_RULES), RuleMatcher(OS_RULES))
+    return _matchers
+
+def getDevice(agent, os, isBot):
+    if isBot:
+        return "bot"
+    if "iPad" in agent or "Tablet" in agent or (os == "Android" and "Mobile" not in agent):
+        return "tablet"
+    if os in MOBILE_OS or "Mobile" in agent:
+        return "mobile"
+    if os in DESKTOP_OS:
+        return "desktop"
+    return OTHER
+
+UNKNOWN_AGENT = UserAgentInfo(UNKNOWN, "", UNKNOWN, "", OTHER, False)
+
+def classifyUserAgent(agent):
+    if not agent or agent == "-":
+        return UNKNOWN_AGENT
+    botMatcher, browserMatcher, osMatcher = _getMatchers()
+    bot, botVersion = botMatcher.match(agent)
+    os, osVersion = osMatcher.match(agent)
+    os = os or OTHER
+    if bot:
+        return UserAgentInfo(bot, botVersion, os, osVersion, "bot", True)
+    browser, browserVersion = browserMatcher.match(agent)
+    return UserAgentInfo(browser or OTHER, browserVersion, os, osVersion, getDevice(agent, os, False), False)
+
+agentCache = httpd_log_url.LRUCache(classifyUserAgent, DEFAULT_AGENT_CACHE_SIZE)
+httpd_log_url.caches["userAgent"] = agentCache
+
+def test():
+    import m.ut_utils as ut
+    ut.START_TEST("httpd_log_agent")
+    agents = [
+        ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/38.0.2125.111 Safari/537.36",
+         ("Chrome", "38.0.2125.111", "Windows", "10.0", "desktop", False)),
+        ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36 Edg/91.0.864.59",
+         ("Edge", "91.0.864.59", "Windows", "10.0", "desktop", False)),
+        ("Mozilla/5.0 (iPhone; CPU iPhone OS 8_1 like Mac OS X) AppleWebKit/600.1.4 (KHTML, like Gecko) Version/8.0 Mobile/12B411 Safari/600.1.4",
+         ("Safari", "8.0", "iOS", "8.1", "mobile", False)),
+        ("Mozilla/5.0 (iPad; CPU OS 7_0 like Mac OS X) AppleWebKit/537.51.1 (KHTML, like Gecko) CriOS/30.0.1599.12 Mobile/11A465 Safari/8536.25",
+         ("Chrome", "30.0.1599.12", "iOS", "7.0", "tablet", False)),
+        ("Mozilla/5.0 (Linux; Android 4.4.2; SM-G900F Build/KOT49H) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/38.0.2125.102 Mobile Safari/537.36",
+         ("Chrome", "38.0.2125.102", "Android", "4.4.2", "mobile", False)),
+        ("Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/600.2.5 (KHTML, like Gecko) Version/8.0.2 Safari/600.2.5",
+         ("Safari", "8.0.2", "Mac OS X", "10.10.1", "desktop", False)),
+        ("Mozilla/5.0 (Windows NT 6.1; WOW64; rv:33.0) Gecko/20100101 Firefox/33.0", ("Firefox", "33.0", "Windows", "6.1", "desktop", False)),
+        ("Mozilla/5.0 (compatible; MSIE 9.0; Windows NT 6.1; Trident/5.0)", ("IE", "9.0", "Windows", "6.1", "desktop", False)),
+        ("Mozilla/5.0 (Windows NT 6.3; Trident/7.0; rv:11.0) like Gecko", ("IE", "11.0", "Windows", "6.3", "desktop", False)),
+        ("Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)", ("Googlebot", "2.1", OTHER, "", "bot", True)),
+        ("Mozilla/5.0 (compatible; MJ12bot/v1.4.5; http://www.majestic12.co.uk/bot.php?+)", ("Other bot", "", OTHER, "", "bot", True)),
+        ("curl/7.38.0", ("curl", "7.38.0", OTHER, "", "bot", True)),
+        ("SomeApp 1.0", (OTHER, "", OTHER, "", OTHER, False)),
+        ("-", tuple(UNKNOWN_AGENT)),
+    ]
+    for agent, expected in agents:
+        ut.EXPECT_EQ(expected, "tuple(classifyUserAgent(agent))", msg=agent)
+    agentCache.clear()
+    from apache_log import ApacheLogFormat, ApacheLogRecord
+    alf = ApacheLogFormat("combined")
+    line = '10.0.0.1 - - [10/Oct/2000:13:55:36 +0000] "GET / HTTP/1.1" 200 1 "-" "%s"' % agents[2][0]
+    record = ApacheLogRecord(alf, line)
+    ut.EXPECT_EQ(("Safari", "8.0", "iOS", "mobile", False), "(record.browser, record.browserVersion, record.operatingSystem, record.deviceType, record.isBot)")
+    ut.EXPECT_EQ(True, "record.userAgentInfo is ApacheLogRecord(alf, line).userAgentInfo")
+    ut.EXPECT_EQ(1, "agentCache.getStats()['misses']")
+    ut.EXPECT_EQ(True, "'userAgent' in httpd_log_url.getCacheStats()")
+    # projection of classification fields parses only the user agent
+    alf = ApacheLogFormat("combined", fields=["isBot"])
+    ut.EXPECT_EQ(False, "ApacheLogRecord(alf, line).isBot")
+    ut.END_TEST()
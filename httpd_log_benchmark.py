@@ -0,0 +1,367 @@
+#
+# Copyright Michael Groys, 2014
+#
+# Parsing benchmarks on synthetic logs.
+# Lines are generated deterministically (seeded random) for every benchmark format, with skewed (zipf like)
+# distributions of urls, user agents, statuses and response sizes, malformedFraction of lines are broken.
+# Measured for every format:
+#   stream - lines/sec and MB/sec of iHttpdLogStream reading all records
+#   record size - bytes held per parsed record (record, its dictionary, match object)
+#   properties - nanoseconds per access of every record property (gmtime included)
+#   user agents - nanoseconds per classification of user agent corpus (distinct agents generated from USER_AGENT_TEMPLATES
+#       with random versions, drawn with zipf like popularity), without cache and through the cache
+# Results are saved as json with environment description, compare() reports measurements that became slower.
+# Usage: python httpd_log_benchmark.py [-n lines] [-s seed] [-m malformedFraction] [-o results.json] [-c baseline.json]
+#
+import sys
+import time
+import json
+import random
+import platform
+import StringIO
+
+BENCHMARK_FORMATS = [
+    "common",
+    "vcommon",
+    "combined",
+    "%h %l %u %t \"%r\" %>s %b %D \"%{Referer}i\" \"%{User-agent}i\" \"%{Content-type}o\" %{Content-length}o",
+    "%v %h %t %m %U%q %H %>s %B %D \"%{Host}i\" \"%{X-Forwarded-For}i\" \"%{Cache-Control}o\"",
+]
+DEFAULT_LINES = 100000
+DEFAULT_SEED = 16
+DEFAULT_MALFORMED_FRACTION = 0.01
+# measurement is considered regression if it is slower by this fraction
+DEFAULT_THRESHOLD = 0.1
+RESULTS_VERSION = 1
+
+AGENTS = [
+    ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/38.0.2125.111 Safari/537.36", 40),
+    ("Mozilla/5.0 (Windows NT 6.1; WOW64; rv:33.0) Gecko/20100101 Firefox/33.0", 15),
+    ("Mozilla/5.0 (iPhone; CPU iPhone OS 8_1 like Mac OS X) AppleWebKit/600.1.4 (KHTML, like Gecko) Version/8.0 Mobile/12B411 Safari/600.1.4", 15),
+    ("Mozilla/5.0 (Linux; Android 4.4.2; SM-G900F Build/KOT49H) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/38.0.2125.102 Mobile Safari/537.36", 10),
+    ("Mozilla/5.0 (compatible; MSIE 9.0; Windows NT 6.1; Trident/5.0)", 5),
+    ("Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)", 8),
+    ("curl/7.38.0", 4),
+    ("-", 3),
+]
+# (template, weight), version placeholders are filled by random numbers
+USER_AGENT_TEMPLATES = [
+    ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/%(major)d.0.%(build)d.%(patch)d Safari/537.36", 30),
+    ("Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/%(major)d.0.%(build)d.%(patch)d Safari/537.36", 10),
+    ("Mozilla/5.0 (Macintosh; Intel Mac OS X 10_%(minor)d_%(patch)d) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/%(major)d.0.%(build)d.%(patch)d Safari/537.36", 8),
+    ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/%(major)d.0.%(build)d.%(patch)d Safari/537.36 Edg/%(major)d.0.%(build)d.%(patch)d", 5),
+    ("Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:%(major)d.0) Gecko/20100101 Firefox/%(major)d.0", 6),
+    ("Mozilla/5.0 (X11; Linux x86_64; rv:%(major)d.0) Gecko/20100101 Firefox/%(major)d.0", 2),
+    ("Mozilla/5.0 (Macintosh; Intel Mac OS X 10_%(minor)d_%(patch)d) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/%(minor)d.%(patch)d Safari/605.1.15", 5),
+    ("Mozilla/5.0 (iPhone; CPU iPhone OS %(minor)d_%(patch)d like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/%(minor)d.0 Mobile/15E148 Safari/604.1", 12),
+    ("Mozilla/5.0 (iPad; CPU OS %(minor)d_%(patch)d like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/%(minor)d.0 Mobile/15E148 Safari/604.1", 3),
+    ("Mozilla/5.0 (Linux; Android %(minor)d; SM-G%(build)d) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/%(major)d.0.%(build)d.%(patch)d Mobile Safari/537.36", 12),
+    ("Mozilla/5.0 (Linux; Android %(minor)d; SM-G%(build)d) AppleWebKit/537.36 (KHTML, like Gecko) SamsungBrowser/%(minor)d.0 Chrome/%(major)d.0.%(build)d.%(patch)d Mobile Safari/537.36", 2),
+    ("Mozilla/5.0 (compatible; MSIE %(minor)d.0; Windows NT 6.1; Trident/5.0)", 1),
+    ("Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)", 4),
+    ("Mozilla/5.0 (compatible; bingbot/2.0; +http://www.bing.com/bingbot.htm)", 2),
+    ("Mozilla/5.0 (compatible; AhrefsBot/%(minor)d.0; +http://ahrefs.com/robot/)", 1),
+    ("curl/7.%(major)d.%(patch)d", 1),
+    ("python-requests/2.%(minor)d.%(patch)d", 1),
+    ("-", 1),
+]
+DEFAULT_USER_AGENTS = 100000
+DEFAULT_DISTINCT_USER_AGENTS = 3000
+STATUSES = [(200, 80), (304, 8), (302, 4), (404, 4), (301, 2), (500, 1), (503, 1)]
+METHODS = [("GET", 90), ("POST", 8), ("HEAD", 2)]
+CONTENT_TYPES = [("text/html; charset=UTF-8", 30), ("image/png", 25), ("application/javascript", 20), ("text/css", 15), ("application/json", 10)]
+REFERERS = [("-", 40), ("http://www.example.com/", 30), ("https://www.google.com/search?q=example", 20), ("http://www.example.com/news/index.html", 10)]
+DIRECTORIES = ["", "/static", "/static/img", "/api/v1", "/news", "/blog/2014/10", "/shop/cart"]
+EXTENSIONS = [".html", ".png", ".js", ".css", "", ".php"]
+
+class WeightedChoice(object):
+    def __init__(self, values):
+        self.values = [value for value, weight in values]
+        self.cumulative = []
+        total = 0
+        for value, weight in values:
+            total += weight
+            self.cumulative.append(total)
+        self.total = total
+
+    def __call__(self, rnd):
+        import bisect
+        return self.values[bisect.bisect_right(self.cumulative, rnd.random() * self.total)]
+
+class LogGenerator(object):
+    # Generates lines of Apache log format, same seed produces same lines
+    def __init__(self, format, seed=DEFAULT_SEED, malformedFraction=DEFAULT_MALFORMED_FRACTION, numUrls=5000):
+        from httpd_log_render import RenderTemplate
+        self.items = RenderTemplate(format).items
+        self.rnd = random.Random(seed)
+        self.malformedFraction = malformedFraction
+        self.agent = WeightedChoice(AGENTS)
+        self.status = WeightedChoice(STATUSES)
+        self.method = WeightedChoice(METHODS)
+        self.contentType = WeightedChoice(CONTENT_TYPES)
+        self.referer = WeightedChoice(REFERERS)
+        # zipf like popularity: url of rank k has weight 1/k
+        urls = []
+        rnd = random.Random(seed)
+        for k in range(numUrls):
+            url = "%s/%s%d%s" % (rnd.choice(DIRECTORIES), rnd.choice(["index", "item", "page", "img"]), k, rnd.choice(EXTENSIONS))
+            if rnd.random() < 0.2:
+                url += "?id=%d&ref=%s" % (rnd.randint(1, 100000), rnd.choice(["home", "mail", "ad"]))
+            urls.append((url, 1.0 / (k + 1)))
+        self.url = WeightedChoice(urls)
+        self.time = 1412121600  # 2014-10-01
+        self.generators = {
+            "h": lambda r: "10.%d.%d.%d" % (r.randint(0, 3), r.randint(0, 255), r.randint(1, 254)),
+            "a": lambda r: "10.%d.%d.%d" % (r.randint(0, 3), r.randint(0, 255), r.randint(1, 254)),
+            "l": lambda r: "-",
+            "u": lambda r: "-" if r.random() < 0.95 else "user%d" % r.randint(1, 100),
+            "v": lambda r: "www%d.example.com" % r.randint(1, 3),
+            "t": self.genTime,
+            "r": lambda r: "%s %s HTTP/1.1" % (self.method(r), self.url(r)),
+            "m": self.method,
+            "U": lambda r: self.url(r).split("?")[0],
+            "q": lambda r: "?id=%d" % r.randint(1, 1000) if r.random() < 0.2 else "",
+            "H": lambda r: "HTTP/1.1",
+            ">s": self.status,
+            "s": self.status,
+            "b": lambda r: "-" if r.random() < 0.05 else str(self.genBytes(r)),
+            "B": self.genBytes,
+            "O": self.genBytes,
+            "I": self.genBytes,
+            "p": lambda r: r.choice(["80", "443"]),
+            "D": lambda r: int(r.expovariate(1 / 20000.)),
+            "T": lambda r: int(r.expovariate(1 / 0.02)),
+            "{Referer}i": self.referer,
+            "{User-agent}i": self.agent,
+            "{Content-type}o": self.contentType,
+            "{Content-length}o": self.genBytes,
+            "{Host}i": lambda r: "www.example.com",
+            "{X-Forwarded-For}i": lambda r: "-" if r.random() < 0.7 else "192.168.%d.%d" % (r.randint(0, 255), r.randint(1, 254)),
+            "{Cache-Control}o": lambda r: r.choice(["no-cache", "max-age=3600", "-"]),
+        }
+
+    def genTime(self, rnd):
+        self.time += rnd.randint(0, 1)
+        return "[%s +0000]" % time.strftime("%d/%b/%Y:%H:%M:%S", time.gmtime(self.time - rnd.randint(0, 5)))
+
+    def genBytes(self, rnd):
+        return int(rnd.lognormvariate(8, 1.5))
+
+    def generateLine(self):
+        rnd = self.rnd
+        parts = []
+        for literal, directive in self.items:
+            parts.append(literal)
+            if directive is not None:
+                parts.append(str(self.generators.get(directive, lambda r: "-")(rnd)))
+        line = "".join(parts)
+        if rnd.random() < self.malformedFraction:
+            # truncated line or garbage
+            line = line[:rnd.randint(0, len(line) - 1)] if rnd.random() < 0.5 else "\x00garbage %d" % rnd.randint(0, 1000)
+        return line
+
+    def generate(self, count):
+        return [self.generateLine() for i in xrange(count)]
+
+# "common" is read by ncsa_log stream, other formats by apache_log stream
+def createStream(format, fileHandler, **kwargs):
+    import httpd_log_stream
+    if format == "common":
+        return httpd_log_stream.iNCSALogStream(fileHandler, **kwargs)
+    return httpd_log_stream.iApacheLogStream(fileHandler, format, **kwargs)
+
+# Returns best time of repeat runs of function
+def bestTime(function, repeat=3):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        function()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def getRecordSize(record):
+    size = sys.getsizeof(record)
+    d = getattr(record, "__dict__", None)
+    if d is not None:
+        size += sys.getsizeof(d) + sum(sys.getsizeof(value) for key, value in d.iteritems() if key != "_format")
+    return size
+
+def getRecordProperties(recordClass):
+    names = []
+    for cls in recordClass.__mro__:
+        for name, value in cls.__dict__.iteritems():
+            if isinstance(value, property) and name not in names:
+                names.append(name)
+    return sorted(names)
+
+def benchmarkFormat(format, lines, repeat=3):
+    data = "".join(line + "\n" for line in lines)
+    result = {"lines": len(lines), "bytes": len(data)}
+    holder = {}
+    def parse():
+        stream = createStream(format, StringIO.StringIO(data))
+        holder["records"] = [record for record, in stream]
+        holder["failed"] = stream.getFailedCount()
+    elapsed = bestTime(parse, repeat)
+    records = holder["records"]
+    result["records"] = len(records)
+    result["failed"] = holder["failed"]
+    result["linesPerSec"] = len(lines) / elapsed
+    result["mbPerSec"] = len(data) / elapsed / (1024*1024)
+    result["bytesPerRecord"] = sum(getRecordSize(record) for record in records) / float(len(records)) if records else 0
+    from httpd_log_format import FieldNotDefinedException
+    properties = {}
+    sample = records[:20000]
+    for name in getRecordProperties(records[0].__class__) if records else []:
+        try:
+            getattr(sample[0], name)
+        except (FieldNotDefinedException, AttributeError, ValueError, TypeError):
+            continue
+        def access():
+            for record in sample:
+                getattr(record, name)
+        properties[name] = bestTime(access, repeat) / len(sample) * 1e9
+    result["propertyNs"] = properties
+    return result
+
+# Returns count user agents drawn from distinct ones with zipf like popularity
+def generateUserAgents(count=DEFAULT_USER_AGENTS, seed=DEFAULT_SEED, distinct=DEFAULT_DISTINCT_USER_AGENTS):
+    rnd = random.Random(seed)
+    template = WeightedChoice(USER_AGENT_TEMPLATES)
+    agents = []
+    for k in range(distinct):
+        versions = {"major": rnd.randint(30, 120), "minor": rnd.randint(4, 15), "build": rnd.randint(1000, 5000), "patch": rnd.randint(0, 200)}
+        agents.append((template(rnd) % versions, 1.0 / (k + 1)))
+    agent = WeightedChoice(agents)
+    return [agent(rnd) for i in range(count)]
+
+def benchmarkUserAgents(agents, repeat=3):
+    import httpd_log_agent
+    import httpd_log_url
+    result = {"agents": len(agents), "distinct": len(set(agents))}
+    classify = httpd_log_agent.classifyUserAgent
+    result["classifyNs"] = bestTime(lambda: [classify(agent) for agent in agents], repeat) / len(agents) * 1e9
+    cache = httpd_log_url.LRUCache(classify, httpd_log_agent.DEFAULT_AGENT_CACHE_SIZE)
+    def cached():
+        cache.clear()
+        for agent in agents:
+            cache.get(agent)
+    result["cachedNs"] = bestTime(cached, repeat) / len(agents) * 1e9
+    result["hitRate"] = cache.getStats()["hitRate"]
+    return result
+
+def getEnvironment():
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+def runBenchmarks(numLines=DEFAULT_LINES, seed=DEFAULT_SEED, malformedFraction=DEFAULT_MALFORMED_FRACTION, formats=BENCHMARK_FORMATS, repeat=3, verbose=False):
+    results = {"version": RESULTS_VERSION, "environment": getEnvironment(),
+               "parameters": {"lines": numLines, "seed": seed, "malformedFraction": malformedFraction},
+               "formats": {}}
+    for format in formats:
+        lines = LogGenerator(format, seed, malformedFraction).generate(numLines)
+        result = benchmarkFormat(format, lines, repeat)
+        results["formats"][format] = result
+        if verbose:
+            print "%-20.20s %10.0f lines/sec %7.2f MB/sec %7.0f bytes/record gmtime %6.0f ns" % (
+                format, result["linesPerSec"], result["mbPerSec"], result["bytesPerRecord"], result["propertyNs"].get("gmtime", 0))
+    result = results["userAgents"] = benchmarkUserAgents(generateUserAgents(numLines, seed), repeat)
+    if verbose:
+        print "%-20.20s %10.0f ns classify %10.0f ns cached (%d distinct of %d, hit rate %.3f)" % (
+            "user agents", result["classifyNs"], result["cachedNs"], result["distinct"], result["agents"], result["hitRate"])
+    return results
+
+def saveResults(results, fileName):
+    f = open(fileName, "w")
+    try:
+        json.dump(results, f, indent=1, sort_keys=True)
+    finally:
+        f.close()
+
+def loadResults(fileName):
+    f = open(fileName)
+    try:
+        return json.load(f)
+    finally:
+        f.close()
+
+# Returns list of (format, measurement, baseline value, current value) that are worse than baseline by threshold
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    regressions = []
+    for format, result in sorted(current["formats"].iteritems()):
+        base = baseline["formats"].get(format)
+        if not base:
+            continue
+        measurements = [(key, base[key], result[key], True) for key in ("linesPerSec", "mbPerSec") if key in base]
+        measurements += [("bytesPerRecord", base["bytesPerRecord"], result["bytesPerRecord"], False)] if "bytesPerRecord" in base else []
+        for name, value in sorted(result["propertyNs"].iteritems()):
+            if name in base.get("propertyNs", {}):
+                measurements.append(("propertyNs." + name, base["propertyNs"][name], value, False))
+        for key, old, new, higherIsBetter in measurements:
+            if (new < old * (1 - threshold)) if higherIsBetter else (new > old * (1 + threshold)):
+                regressions.append((format, key, old, new))
+    base = baseline.get("userAgents")
+    result = current.get("userAgents")
+    if base and result:
+        for key in ("classifyNs", "cachedNs"):
+            if result[key] > base[key] * (1 + threshold):
+                regressions.append(("userAgents", key, base[key], result[key]))
+    return regressions
+
+def main(args):
+    import optparse
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("-n", "--lines", type="int", default=DEFAULT_LINES, help="lines per format")
+    parser.add_option("-s", "--seed", type="int", default=DEFAULT_SEED)
+    parser.add_option("-m", "--malformed", type="float", default=DEFAULT_MALFORMED_FRACTION, help="fraction of malformed lines")
+    parser.add_option("-r", "--repeat", type="int", default=3)
+    parser.add_option("-o", "--output", help="save results to json file")
+    parser.add_option("-c", "--compare", help="compare results to saved json file")
+    parser.add_option("-t", "--threshold", type="float", default=DEFAULT_THRESHOLD)
+    options, rest = parser.parse_args(args)
+    results = runBenchmarks(options.lines, options.seed, options.malformed, repeat=options.repeat, verbose=True)
+    if options.output:
+        saveResults(results, options.output)
+    if options.compare:
+        regressions = compare(loadResults(options.compare), results, options.threshold)
+        for format, key, old, new in regressions:
+            print "REGRESSION %s %s: %.1f -> %.1f" % (format, key, old, new)
+        return 1 if regressions else 0
+    return 0
+
+def test():
+    import m.ut_utils as ut
+    ut.START_TEST("httpd_log_benchmark")
+    from apache_log import ApacheLogFormat
+    for format in BENCHMARK_FORMATS:
+        lines = LogGenerator(format, 7, 0).generate(200)
+        ut.EXPECT_EQ(lines, "LogGenerator(format, 7, 0).generate(200)", msg=format)
+        alf = ApacheLogFormat(format)
+        ut.EXPECT_EQ([], "[line for line in lines if not alf.match(line)]", msg=format)
+    alf = ApacheLogFormat("combined")
+    lines = LogGenerator("combined", 7, 0.5).generate(1000)
+    ut.EXPECT_EQ(True, "300 < len([line for line in lines if not alf.match(line)]) < 700")
+    results = runBenchmarks(300, formats=["common", "combined"], repeat=1)
+    # timings are compared only by compare(), tests check structure and counters
+    ut.EXPECT_EQ(True, "'linesPerSec' in results['formats']['combined']")
+    ut.EXPECT_EQ(True, "'gmtime' in results['formats']['combined']['propertyNs']")
+    ut.EXPECT_EQ(True, "'userAgent' in results['formats']['combined']['propertyNs']")
+    ut.EXPECT_EQ(300, "results['formats']['common']['records'] + results['formats']['common']['failed']")
+    ut.EXPECT_EQ(True, "'cachedNs' in results['userAgents'] and 'classifyNs' in results['userAgents']")
+    ut.EXPECT_EQ(True, "results['userAgents']['hitRate'] > 0.1")
+    ut.EXPECT_EQ(True, "100 < len(set(generateUserAgents(10000))) <= DEFAULT_DISTINCT_USER_AGENTS")
+    ut.EXPECT_EQ([], "compare(results, results)")
+    slower = json.loads(json.dumps(results))
+    slower["formats"]["common"]["linesPerSec"] /= 2
+    slower["formats"]["common"]["propertyNs"]["gmtime"] *= 2
+    ut.EXPECT_EQ([("common", "linesPerSec"), ("common", "propertyNs.gmtime")], "[r[:2] for r in compare(results, slower)]")
+    ut.END_TEST()
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,530 @@
+#
+# Copyright Michael Groys, 2014
+#
+# Persistent columnar cache of parsed log files.
+# Log file is parsed once and record fields are stored in the cache file as columns:
+#   integer and float fields as arrays of machine values,
+#   other fields (strings, None, time structs) as int32 codes into list of distinct values,
+#   plus offset of every matched line in the log file, so record.line is read from the source on demand.
+# Compressed sources can't be read at offset without decompressing from the start, so their matched lines
+# are stored in the cache file and record.line is read from the cache.
+# Cache file name is hash of the source path, format string and record class, the cache is stale
+# if size or modification time of the source has changed, or if requested fields are not cached.
+# Stale cache is rebuilt with union of cached and requested fields.
+# Columns are read from memory mapped cache file: numpy arrays are views of the map,
+# without numpy columns are copied to arrays. Records are created by windows of READ_WINDOW_SIZE rows,
+# so only values of the current window are held in python objects.
+#
+import os
+import mmap
+import array
+import struct
+import hashlib
+import operator
+import cPickle
+from m.common import MiningError
+from httpd_log_format import FieldNotDefinedException
+from httpd_log_record import MaterializedRecord
+from httpd_log_columns import StringDictionary
+from httpd_log_readahead import isCompressed
+
+CACHE_VERSION = 2
+MAGIC = "HTTPD_LOG_CACHE\n"
+CACHE_DIR_ENV = "HTTPD_LOG_CACHE_DIR"
+DEFAULT_CACHE_DIR = "~/.httpd_log_cache"
+CACHE_EXTENSION = ".hlc"
+BUILD_CHUNK_SIZE = 65536
+READ_WINDOW_SIZE = 65536
+
+INT_KIND = "int"
+FLOAT_KIND = "float"
+DICT_KIND = "dict"
+_typecodes = {INT_KIND: "l", FLOAT_KIND: "d", DICT_KIND: "i"}
+
+def _numpy():
+    try:
+        import numpy
+        return numpy
+    except ImportError:
+        return None
+
+def _openSource(fileName):
+    if fileName.endswith(".gz"):
+        import gzip
+        return gzip.open(fileName, "rb")
+    elif fileName.endswith(".bz2"):
+        import bz2
+        return bz2.BZ2File(fileName, "rb")
+    return open(fileName, "rb")
+
+# cache argument of the streams: True means default directory, string is cache directory
+def getCacheDir(cache):
+    if cache is True:
+        return os.path.expanduser(os.environ.get(CACHE_DIR_ENV, DEFAULT_CACHE_DIR))
+    return str(cache)
+
+def getCacheFileName(cacheDir, fileName, formatStr, recordClass):
+    key = "\0".join([os.path.abspath(fileName), formatStr, recordClass.__name__])
+    return os.path.join(cacheDir, hashlib.sha1(key).hexdigest()[:20] + CACHE_EXTENSION)
+
+# all properties of record class except the line and fields derived from other fields
+def getRecordFields(recordClass):
+    derivedFields = getattr(recordClass, "derivedFields", {})
+    return sorted(name for name in dir(recordClass)
+                  if isinstance(getattr(recordClass, name), property) and name not in derivedFields)
+
+# cached fields that hold required fields, derived fields are replaced by their sources
+def getStoredFields(recordClass, requiredFields):
+    derivedFields = getattr(recordClass, "derivedFields", {})
+    recordFields = set(getRecordFields(recordClass))
+    return sorted(set(derivedFields.get(f, f) for f in requiredFields) & recordFields)
+
+class ColumnBuilder(object):
+    # kind is chosen by the first chunk of values, column is converted to dictionary codes
+    # if later values don't fit
+    def __init__(self, field):
+        self.field = field
+        self.kind = None
+        self.data = None
+        self.dictionary = None
+
+    def extend(self, values):
+        if self.kind is None:
+            types = set(type(v) for v in values)
+            if types <= set([int, long]):
+                self.kind = INT_KIND
+            elif types == set([float]):
+                self.kind = FLOAT_KIND
+            else:
+                self.kind = DICT_KIND
+                self.dictionary = StringDictionary()
+            self.data = array.array(_typecodes[self.kind])
+        if self.kind != DICT_KIND:
+            try:
+                self.data.extend(values)
+                return
+            except (TypeError, OverflowError):
+                self.toDictionary()
+        try:
+            self.data.extend(map(self.dictionary.encode, values))
+        except TypeError:
+            raise MiningError("Field '%s' can't be cached: values are not hashable" % self.field)
+
+    def toDictionary(self):
+        values = self.data.tolist()
+        self.kind = DICT_KIND
+        self.dictionary = StringDictionary()
+        self.data = array.array(_typecodes[DICT_KIND], map(self.dictionary.encode, values))
+
+# Parses the log file and writes the cache, returns number of records
+def buildCache(cacheFile, fileName, formatObj, recordClass, fields=None):
+    allFields = fields is None
+    source = _openSource(fileName)
+    try:
+        stat = os.fstat(source.fileno()) if hasattr(source, "fileno") else os.stat(fileName)
+        match = formatObj.match
+        offsets = array.array("l")
+        # text of matched lines of compressed source
+        lineText = array.array("c") if isCompressed(fileName) else None
+        builders = None
+        rows = []
+        total = 0
+        failed = 0
+        offset = 0
+        for line in source:
+            lineOffset = offset
+            offset += len(line)
+            total += 1
+            line = line.rstrip("\n")
+            m = match(line)
+            if not m:
+                failed += 1
+                continue
+            record = recordClass(formatObj, line, m)
+            if builders is None:
+                if fields is None:
+                    # fields not defined by the format are skipped
+                    fields = []
+                    for field in getRecordFields(recordClass):
+                        try:
+                            getattr(record, field)
+                            fields.append(field)
+                        except FieldNotDefinedException:
+                            pass
+                fields = [f for f in fields if f != "line"]
+                getter = operator.attrgetter(*(fields + ["line"]))
+                builders = [ColumnBuilder(field) for field in fields]
+            if lineText is not None:
+                offsets.append(len(lineText))
+                lineText.fromstring(line + "\n")
+            else:
+                offsets.append(lineOffset)
+            rows.append(getter(record))
+            if len(rows) == BUILD_CHUNK_SIZE:
+                _extendColumns(builders, rows)
+                rows = []
+        if builders is None:
+            fields = [f for f in fields or [] if f != "line"]
+            builders = [ColumnBuilder(field) for field in fields]
+        _extendColumns(builders, rows)
+    finally:
+        source.close()
+    header = {
+        "version": CACHE_VERSION,
+        "source": os.path.abspath(fileName),
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "format": formatObj.template,
+        "recordClass": recordClass.__name__,
+        "fields": fields,
+        "allFields": allFields,
+        "records": len(offsets),
+        "total": total,
+        "failed": failed,
+        "columns": {},
+        "dictionaries": {},
+        "lineText": None,
+    }
+    blocks = [("line", INT_KIND, offsets)] + [(builder.field, builder.kind, builder.data) for builder in builders]
+    position = 0
+    for field, kind, data in blocks:
+        header["columns"][field] = (kind, data.typecode, data.itemsize, position)
+        position += _align(data.itemsize * len(data))
+    if lineText is not None:
+        # (position, size) of lines text block after the columns
+        header["lineText"] = (position, len(lineText))
+        blocks.append(("lineText", None, lineText))
+    for builder in builders:
+        if builder.dictionary:
+            header["dictionaries"][builder.field] = builder.dictionary.values
+    _writeCache(cacheFile, header, blocks)
+    return len(offsets)
+
+def _extendColumns(builders, rows):
+    if not rows:
+        for builder in builders:
+            if builder.kind is None:
+                builder.extend([])
+        return
+    for builder, values in zip(builders, zip(*rows)):
+        builder.extend(values)
+
+def _align(size):
+    return (size + 7) & ~7
+
+def _writeCache(cacheFile, header, blocks):
+    cacheDir = os.path.dirname(cacheFile)
+    if cacheDir and not os.path.isdir(cacheDir):
+        os.makedirs(cacheDir)
+    headerStr = cPickle.dumps(header, cPickle.HIGHEST_PROTOCOL)
+    tmpFile = "%s.%d.tmp" % (cacheFile, os.getpid())
+    f = open(tmpFile, "wb")
+    try:
+        prefix = MAGIC + struct.pack("<Q", len(headerStr)) + headerStr
+        f.write(prefix)
+        f.write("\0" * (_align(len(prefix)) - len(prefix)))
+        for field, kind, data in blocks:
+            size = data.itemsize * len(data)
+            data.tofile(f)
+            f.write("\0" * (_align(size) - size))
+    finally:
+        f.close()
+    # readers of the old cache keep their map
+    os.rename(tmpFile, cacheFile)
+
+# Reads line at offset of uncompressed file, base is position of the lines in the file
+class LineSource(object):
+    def __init__(self, fileName, base=0):
+        self.fileName = fileName
+        self.base = base
+        self.file = None
+
+    def readLine(self, offset):
+        if self.file is None:
+            self.file = open(self.fileName, "rb")
+        self.file.seek(self.base + offset)
+        return self.file.readline().rstrip("\n")
+
+class CachedRecord(MaterializedRecord):
+    __slots__ = ("lineOffset", "lineSource")
+
+    @property
+    def line(self):
+        return self.lineSource.readLine(self.lineOffset)
+
+_cachedClasses = {}
+
+def getCachedRecordClass(recordClass, fields):
+    fields = tuple(fields)
+    key = (recordClass, fields)
+    cls = _cachedClasses.get(key)
+    if cls is None:
+        attributes = {"__slots__": fields, "fields": fields}
+        # derived fields are computed by record class properties from cached fields
+        for derived, source in getattr(recordClass, "derivedFields", {}).iteritems():
+            if source in fields:
+                attributes[derived] = getattr(recordClass, derived)
+        cls = type("Cached" + recordClass.__name__, (CachedRecord,), attributes)
+        _cachedClasses[key] = cls
+    return cls
+
+class CacheError(Exception):
+    pass
+
+class CacheReader(object):
+    def __init__(self, cacheFile):
+        self.cacheFile = cacheFile
+        f = open(cacheFile, "rb")
+        try:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise CacheError("bad magic")
+            lengthStr = f.read(8)
+            if len(lengthStr) != 8:
+                raise CacheError("truncated header")
+            try:
+                self.header = cPickle.loads(f.read(struct.unpack("<Q", lengthStr)[0]))
+            except Exception, e:
+                raise CacheError(str(e))
+            if not isinstance(self.header, dict) or self.header.get("version") != CACHE_VERSION:
+                raise CacheError("unsupported version")
+            self.dataOffset = _align(f.tell())
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        expected = self.dataOffset + sum(_align(itemsize*self.records) for kind, typecode, itemsize, offset in self.header["columns"].itervalues())
+        if self.header["lineText"]:
+            expected += _align(self.header["lineText"][1])
+        if len(self.map) != expected:
+            self.close()
+            raise CacheError("truncated data")
+        self.fields = self.header["fields"]
+        self.failed = self.header["failed"]
+        self.total = self.header["total"]
+
+    @property
+    def records(self):
+        return self.header["records"]
+
+    def isValid(self, fileName, formatStr, recordClass, fields):
+        header = self.header
+        if header["source"] != os.path.abspath(fileName) or header["format"] != formatStr or header["recordClass"] != recordClass.__name__:
+            return False
+        stat = os.stat(fileName)
+        if header["size"] != stat.st_size or header["mtime"] != stat.st_mtime:
+            return False
+        if fields is None:
+            return header["allFields"]
+        return set(fields) <= set(self.fields)
+
+    def getKind(self, field):
+        return self.header["columns"][field][0]
+
+    def getDictionary(self, field):
+        return self.header["dictionaries"].get(field)
+
+    # returns column (or its rows from start till end) as numpy array mapped to the cache file
+    # or as array.array if numpy is not available, dictionary columns are returned as codes
+    def getArray(self, field, start=0, end=None):
+        try:
+            kind, typecode, itemsize, offset = self.header["columns"][field]
+        except KeyError:
+            raise FieldNotDefinedException(field)
+        end = self.records if end is None else min(end, self.records)
+        count = max(end - start, 0)
+        position = self.dataOffset + offset + itemsize*start
+        numpy = _numpy()
+        if numpy:
+            dtype = {"l": "i%d" % itemsize, "d": "f8", "i": "i%d" % itemsize}[typecode]
+            return numpy.frombuffer(self.map, dtype, count, position)
+        data = array.array(typecode)
+        data.fromstring(self.map[position:position+itemsize*count])
+        return data
+
+    # returns column (or its rows from start till end) as list of values
+    def getValues(self, field, start=0, end=None):
+        data = self.getArray(field, start, end).tolist()
+        dictionary = self.getDictionary(field)
+        if dictionary is not None:
+            data = [dictionary[code] if code >= 0 else None for code in data]
+        return data
+
+    # iterates over records holding given fields (all cached fields if None),
+    # values are decoded by windows of windowSize rows
+    def iterRecords(self, recordClass, fields=None, fileName=None, windowSize=READ_WINDOW_SIZE):
+        if fields is None:
+            fields = self.fields
+        fields = [f for f in fields if f != "line"]
+        for field in fields:
+            if field not in self.header["columns"]:
+                raise FieldNotDefinedException(field)
+        cls = getCachedRecordClass(recordClass, fields)
+        if self.header["lineText"]:
+            lineSource = LineSource(self.cacheFile, self.dataOffset + self.header["lineText"][0])
+        else:
+            lineSource = LineSource(fileName or self.header["source"])
+        setters = [cls.__dict__[field].__set__ for field in fields]
+        new = cls.__new__
+        for start in xrange(0, self.records, windowSize):
+            end = start + windowSize
+            columns = [self.getValues(field, start, end) for field in fields]
+            offsets = self.getArray("line", start, end).tolist()
+            for i, lineOffset in enumerate(offsets):
+                obj = new(cls)
+                obj.lineOffset = lineOffset
+                obj.lineSource = lineSource
+                for setter, column in zip(setters, columns):
+                    setter(obj, column[i])
+                yield obj
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+# Returns CacheReader of valid cache of the file, stale or missing cache is (re)built.
+# If fields is None, all fields defined by the format are cached.
+def openCache(cache, fileName, formatClass, formatArgs, recordClass, fields=None):
+    if not fileName or not os.path.isfile(fileName):
+        raise MiningError("Cache requires regular file, got '%s'" % fileName)
+    if fields is not None:
+        fields = [f for f in fields if f != "line"]
+    # format object that captures all fields
+    formatObj = formatClass(*formatArgs[:1])
+    cacheFile = getCacheFileName(getCacheDir(cache), fileName, formatObj.template, recordClass)
+    buildFields = fields
+    if os.path.exists(cacheFile):
+        try:
+            reader = CacheReader(cacheFile)
+        except (CacheError, IOError, EnvironmentError, ValueError):
+            reader = None
+        if reader:
+            if reader.isValid(fileName, formatObj.template, recordClass, fields):
+                return reader
+            if fields is not None:
+                buildFields = sorted(set(fields) | set(reader.fields))
+            reader.close()
+    buildCache(cacheFile, fileName, formatObj, recordClass, buildFields)
+    return CacheReader(cacheFile)
+
+def test():
+    import m.ut_utils as ut
+    import tempfile
+    import shutil
+    import time
+    from apache_log import ApacheLogFormat, ApacheLogRecord
+    ut.START_TEST("httpd_log_cache")
+    lines = []
+    for i in range(100):
+        if i % 13 == 5:
+            lines.append("garbage %d" % i)
+        else:
+            lines.append('10.0.0.%d - - [10/Oct/2000:13:55:%02d +0000] "GET /path/%d HTTP/1.1" %d %s "-" "agent %d"' %
+                         (i%7, i%60, i%5, 200 + i%4*100, i if i%3 else "-", i))
+    cacheDir = tempfile.mkdtemp()
+    fd, fileName = tempfile.mkstemp(suffix=".log")
+    os.write(fd, "\n".join(lines) + "\n")
+    os.close(fd)
+    try:
+        alf = ApacheLogFormat("combined")
+        expected = [ApacheLogRecord(alf, line) for line in lines if alf.match(line)]
+        fields = ["status", "numbytes", "urlPath", "gmtime", "localtimeAsStruct"]
+        reader = openCache(cacheDir, fileName, ApacheLogFormat, ("combined",), ApacheLogRecord, fields)
+        ut.EXPECT_EQ(len(expected), "reader.records")
+        ut.EXPECT_EQ(len(lines) - len(expected), "reader.failed")
+        ut.EXPECT_EQ("int", "reader.getKind('status')")
+        ut.EXPECT_EQ("dict", "reader.getKind('urlPath')")
+        records = list(reader.iterRecords(ApacheLogRecord, fields))
+        for field in fields + ["line"]:
+            ut.EXPECT_EQ([getattr(r, field) for r in expected], "[getattr(r, field) for r in records]", msg=field)
+        # windows don't divide the column
+        records = list(reader.iterRecords(ApacheLogRecord, fields, windowSize=7))
+        for field in fields + ["line"]:
+            ut.EXPECT_EQ([getattr(r, field) for r in expected], "[getattr(r, field) for r in records]", msg=field)
+        ut.EXPECT_EQ([r.urlPath for r in expected[10:20]], "reader.getValues('urlPath', 10, 20)")
+        ut.EXPECT_EQ([r.status for r in expected[-3:]], "reader.getValues('status', len(expected) - 3, len(expected) + 10)")
+        cacheFile = reader.cacheFile
+        mtime = os.stat(cacheFile).st_mtime
+        reader.close()
+        # valid cache is reused
+        reader = openCache(cacheDir, fileName, ApacheLogFormat, ("combined",), ApacheLogRecord, ["status"])
+        ut.EXPECT_EQ(mtime, "os.stat(cacheFile).st_mtime")
+        ut.EXPECT_EQ(sorted(fields), "sorted(reader.fields)")
+        reader.close()
+        # missing field triggers rebuild with union of fields
+        reader = openCache(cacheDir, fileName, ApacheLogFormat, ("combined",), ApacheLogRecord, ["userAgent"])
+        ut.EXPECT_EQ(sorted(fields + ["userAgent"]), "sorted(reader.fields)")
+        ut.EXPECT_EQ([r.userAgent for r in expected], "reader.getValues('userAgent')")
+        reader.close()
+        # modified source makes cache stale
+        f = open(fileName, "ab")
+        f.write(lines[0] + "\n")
+        f.close()
+        os.utime(fileName, (time.time() + 10, time.time() + 10))
+        reader = openCache(cacheDir, fileName, ApacheLogFormat, ("combined",), ApacheLogRecord, ["status"])
+        ut.EXPECT_EQ(len(expected) + 1, "reader.records")
+        reader.close()
+        # all fields defined by the format
+        reader = openCache(cacheDir, fileName, ApacheLogFormat, ("combined",), ApacheLogRecord)
+        ut.EXPECT_EQ(True, "'referer' in reader.fields and 'duration' not in reader.fields")
+        reader.close()
+        # corrupted cache is rebuilt
+        f = open(cacheFile, "r+b")
+        f.truncate(100)
+        f.close()
+        reader = openCache(cacheDir, fileName, ApacheLogFormat, ("combined",), ApacheLogRecord, ["status"])
+        ut.EXPECT_EQ(len(expected) + 1, "reader.records")
+        reader.close()
+        # streams read the cache transparently
+        from httpd_log_stream import iApacheLogStream
+        def readStream(**kwargs):
+            stream = iApacheLogStream(open(fileName), "combined", fields="urlPath", where="status>=400", materialize="urlPath,line", **kwargs)
+            return [(r.urlPath, r.line) for r, in stream]
+        ut.EXPECT_EQ(readStream(), "readStream(cache=cacheDir)")
+        stream = iApacheLogStream(open(fileName), "combined", cache=cacheDir)
+        batches = list(stream.iterBatches(40, "status,numbytes,urlPath"))
+        ut.EXPECT_EQ([40, 40, len(expected) + 1 - 80], "[len(b) for b in batches]")
+        ut.EXPECT_EQ([r.urlPath for r in expected[40:80]], "batches[1].decode('urlPath')")
+        ut.EXPECT_EQ(sum(r.numbytes for r in expected) + expected[0].numbytes, "sum(int(b['numbytes'].sum()) for b in batches)")
+        ut.EXPECT_EQ(len(lines) - len(expected), "stream.failed")
+        ut.EXPECT_EQ([len(lines) - len(expected), 0, 0], "[b.failed for b in batches]")
+        # failures are reported by empty batch if no line matched
+        f = open(fileName + ".bad", "wb")
+        f.write("garbage\n" * 3)
+        f.close()
+        try:
+            stream = iApacheLogStream(open(fileName + ".bad"), "combined", fields="status", cache=cacheDir)
+            ut.EXPECT_EQ(True, "stream.cacheReader is not None")
+            batches = list(stream.iterBatches(40, "status"))
+            ut.EXPECT_EQ(None, "stream.cacheReader")
+            ut.EXPECT_EQ([(0, 3)], "[(len(b), b.failed) for b in batches]")
+        finally:
+            os.unlink(fileName + ".bad")
+        # derived fields are computed from cached source fields
+        stream = iApacheLogStream(open(fileName), "combined", fields="queryArgs", cache=cacheDir)
+        ut.EXPECT_EQ({}, "[r for r, in stream][0].queryArgs")
+        ut.EXPECT_EQ(None, "stream.cacheReader.map")
+        # abandoned stream releases the cache map
+        stream = iApacheLogStream(open(fileName), "combined", fields="status", cache=cacheDir)
+        stream.nextRecord()
+        stream.close()
+        ut.EXPECT_EQ(None, "stream.cacheReader.map")
+        # lines of compressed source are stored in the cache
+        import gzip
+        gzName = fileName + ".gz"
+        f = gzip.open(gzName, "wb")
+        f.write("\n".join(lines) + "\n")
+        f.close()
+        try:
+            reader = openCache(cacheDir, gzName, ApacheLogFormat, ("combined",), ApacheLogRecord, ["status"])
+            ut.EXPECT_EQ(True, "reader.header['lineText'] is not None")
+            records = list(reader.iterRecords(ApacheLogRecord, ["status"], windowSize=7))
+            ut.EXPECT_EQ([r.line for r in expected], "[r.line for r in records]")
+            ut.EXPECT_EQ(expected[3].line, "records[3].line")
+            reader.close()
+            ut.EXPECT_EQ(expected[-1].line, "records[-1].line")
+        finally:
+            os.unlink(gzName)
+    finally:
+        os.unlink(fileName)
+        shutil.rmtree(cacheDir)
+    ut.END_TEST()
@@ -0,0 +1,168 @@
+#
+# Copyright Michael Groys, 2014
+#
+# Columnar batches of httpd log records for vectorized aggregations with numpy.
+# Every batch holds one array per field:
+#   int64 for numeric fields (status, numbytes, durations, ...) and for gmtime (epoch seconds),
+#   float64 for duration,
+#   int32 codes for string fields, codes are shared by all batches of the stream
+#   and decoded by batch.dictionaries[field], None is encoded as -1
+# Lines that fail to match are reported by the batch they were read in.
+#
+import operator
+from m.common import MiningError
+
+INT_FIELDS = set(["status", "numbytes", "gmtime", "gmtoffset", "durationUsec", "durationSec", "keepaliveNum",
+                  "port", "workerPid", "receivedBytes", "sentBytes", "contentLength"])
+FLOAT_FIELDS = set(["duration"])
+
+def _importNumpy():
+    try:
+        import numpy
+    except ImportError:
+        raise MiningError("numpy is required for columnar batches")
+    return numpy
+
+class StringDictionary(object):
+    def __init__(self):
+        self.codes = {None: -1}
+        self.values = []
+
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.values.append(value)
+            self.codes[value] = code
+        return code
+
+class ColumnBatch(object):
+    def __init__(self, size, columns, dictionaries, failed, failedLines):
+        self.size = size                 # number of records
+        self.columns = columns           # field -> numpy array
+        self.dictionaries = dictionaries # field -> list of values of string field codes
+        self.failed = failed             # number of lines failed to match while reading this batch
+        self.failedLines = failedLines   # these lines (not available in parallel and cached modes)
+
+    def __getitem__(self, field):
+        return self.columns[field]
+
+    def __len__(self):
+        return self.size
+
+    # returns values of the string field
+    def decode(self, field):
+        values = self.dictionaries[field]
+        return [values[code] if code >= 0 else None for code in self.columns[field]]
+
+def iterBatches(stream, batchSize=65536, fields=None):
+    numpy = _importNumpy()
+    if fields is None:
+        if not stream.materializedClass:
+            raise MiningError("Fields of columnar batches are not defined")
+        fields = [f for f in stream.materializedClass.fields if f != "line"]
+    elif isinstance(fields, basestring):
+        fields = [f.strip() for f in fields.split(",") if f.strip()]
+    else:
+        fields = list(fields)
+    if not fields:
+        raise MiningError("Fields of columnar batches are not defined")
+    reader = getattr(stream, "cacheReader", None)
+    if reader and not stream.lineFilter and isCacheCompatible(reader, fields):
+        # batches are views of the cache map, it's released with the last batch instead of closed by the stream
+        stream.cacheReader = None
+        return iterCachedBatches(stream, reader, int(batchSize), fields)
+    return iterRecordBatches(stream, numpy, int(batchSize), fields)
+
+def _columnKind(field):
+    if field in INT_FIELDS:
+        return "int"
+    elif field in FLOAT_FIELDS:
+        return "float"
+    return "dict"
+
+# columns of httpd_log_cache.CacheReader can be sliced only if they have the same types as batch columns
+def isCacheCompatible(reader, fields):
+    for field in fields:
+        if field not in reader.fields or reader.getKind(field) != _columnKind(field):
+            return False
+        if reader.getArray(field).dtype.itemsize != (4 if _columnKind(field) == "dict" else 8):
+            return False
+    return True
+
+# batches are slices of arrays mapped to the cache file
+def iterCachedBatches(stream, reader, batchSize, fields):
+    arrays = dict((field, reader.getArray(field)) for field in fields)
+    dictionaries = dict((field, reader.getDictionary(field)) for field in fields if _columnKind(field) == "dict")
+    # failed lines are counted by the cache, their text isn't kept: all failures are reported by the first batch,
+    # empty batch carries them when there are no matched records
+    failed = reader.failed
+    for start in xrange(0, max(reader.records, 1 if failed else 0), batchSize):
+        end = min(start + batchSize, reader.records)
+        yield ColumnBatch(end - start, dict((f, a[start:end]) for f, a in arrays.iteritems()), dictionaries, failed, [])
+        failed = 0
+    stream.failed = reader.failed
+    stream.total = reader.total
+
+def iterRecordBatches(stream, numpy, batchSize, fields):
+    dictionaries = dict((f, StringDictionary()) for f in fields if f not in INT_FIELDS and f not in FLOAT_FIELDS)
+    # single field attrgetter returns value instead of tuple
+    getter = operator.attrgetter(*(fields + [fields[0]]))
+    while True:
+        rows = []
+        append = rows.append
+        failedBefore = stream.getFailedCount()
+        stream.failedLines = []
+        nextRecord = stream.nextRecord
+        try:
+            for i in xrange(batchSize):
+                append(getter(nextRecord()))
+        except StopIteration:
+            pass
+        size = len(rows)
+        failed = stream.getFailedCount() - failedBefore
+        failedLines = stream.failedLines
+        stream.failedLines = None
+        if not size and not failed:
+            return
+        columns = zip(*rows) if rows else [()]*len(fields)
+        arrays = {}
+        for field, column in zip(fields, columns):
+            if field in INT_FIELDS:
+                arrays[field] = numpy.array(column, dtype=numpy.int64)
+            elif field in FLOAT_FIELDS:
+                arrays[field] = numpy.array(column, dtype=numpy.float64)
+            else:
+                arrays[field] = numpy.array(map(dictionaries[field].encode, column), dtype=numpy.int32)
+        yield ColumnBatch(size, arrays, dict((f, d.values) for f, d in dictionaries.iteritems()), failed, failedLines)
+        if size < batchSize:
+            return
+
+def test():
+    import m.ut_utils as ut
+    import StringIO
+    from httpd_log_stream import iApacheLogStream
+    ut.START_TEST("httpd_log_columns")
+    lines = [
+        '127.0.0.1 - frank [10/Oct/2000:13:55:36 -0700] "GET /a.gif HTTP/1.0" 200 2326 "-" "curl/7.0"',
+        '10.0.0.1 - - [10/Oct/2000:13:55:36 +0000] "POST /api?x=1 HTTP/1.1" 503 - "-" "curl/7.0"',
+        'garbage',
+        '10.0.0.2 - - [10/Oct/2000:13:56:36 +0000] "GET http://h.com/a.gif HTTP/1.1" 404 15 "-" "curl/7.0"',
+        '10.0.0.1 - - [10/Oct/2000:13:57:36 +0000] "GET /api HTTP/1.1" 200 100 "-" "curl/7.0"',
+    ]
+    stream = iApacheLogStream(StringIO.StringIO("\n".join(lines) + "\n"), "combined")
+    batches = list(stream.iterBatches(3, ["status", "numbytes", "gmtime", "method", "urlPath", "urlRoot"]))
+    ut.EXPECT_EQ(2, "len(batches)")
+    ut.EXPECT_EQ([3, 1], "[len(b) for b in batches]")
+    ut.EXPECT_EQ([1, 0], "[b.failed for b in batches]")
+    ut.EXPECT_EQ(["garbage"], "batches[0].failedLines")
+    ut.EXPECT_EQ("int64", "str(batches[0]['status'].dtype)")
+    ut.EXPECT_EQ([200, 503, 404], "batches[0]['status'].tolist()")
+    ut.EXPECT_EQ(2326+0+15+100, "sum(int(b['numbytes'].sum()) for b in batches)")
+    ut.EXPECT_EQ([971211336, 971186136, 971186196], "batches[0]['gmtime'].tolist()")
+    ut.EXPECT_EQ(["GET", "POST", "GET"], "batches[0].decode('method')")
+    ut.EXPECT_EQ([None, None, "http://h.com"], "batches[0].decode('urlRoot')")
+    ut.EXPECT_EQ("int32", "str(batches[1]['urlPath'].dtype)")
+    ut.EXPECT_EQ(["/api"], "batches[1].decode('urlPath')")
+    ut.EXPECT_EQ(batches[0]['urlPath'][1], "batches[1]['urlPath'][0]")
+    ut.END_TEST()
@@ -0,0 +1,281 @@
+#
+# Copyright Michael Groys, 2014
+#
+# Detection of Apache log format of the file (format="auto" of apache_log stream).
+# First SAMPLE_LINES lines are matched by every candidate format: predefined formats and library of common custom ones.
+# Format regular expressions are not anchored at the end, so candidate is scored by number of lines it matches
+# completely, then by lines it matches at all and then by number of groups (more specific format wins).
+# Detected format is saved in detection cache (next to the columnar cache, see httpd_log_cache) by file family:
+# file name without rotation suffixes (access.log.1.gz -> access.log), cached format is checked on the sample
+# and used without scoring other candidates if it matches enough lines.
+# If matching fails for many lines in the middle of the file (burst of failed lines with failure rate above
+# MAX_FAILURE_RATE), the format is detected again on these lines and, if another format matches them,
+# the stream switches to it and parses these lines again.
+#
+import os
+import re
+import json
+from apache_log import ApacheLogFormat
+from m.common import MiningError
+
+SAMPLE_LINES = 100
+# minimal fraction of sample lines cached or re-detected format should match
+MIN_MATCH_RATE = 0.9
+# burst of failed lines with higher failure rate triggers re-detection
+MAX_FAILURE_RATE = 0.5
+REDETECT_LINES = 20
+DETECTION_CACHE_FILE = "formats.json"
+MAX_CACHED_FAMILIES = 10000
+
+# formats that can't be told apart by the lines (like %b and %O, %D and %T) are represented by single one
+CUSTOM_FORMATS = [
+    # vhost_combined
+    "%v:%p %h %l %u %t \"%r\" %>s %O \"%{Referer}i\" \"%{User-agent}i\"",
+    # combined and common with request duration
+    "%h %l %u %t \"%r\" %>s %b \"%{Referer}i\" \"%{User-agent}i\" %D",
+    "%h %l %u %t \"%r\" %>s %b %D",
+    # combined behind proxy
+    "%h %l %u %t \"%r\" %>s %b \"%{Referer}i\" \"%{User-agent}i\" \"%{X-Forwarded-For}i\"",
+    # virtual host first
+    "%v %h %l %u %t \"%r\" %>s %b \"%{Referer}i\" \"%{User-agent}i\"",
+]
+
+def getCandidateFormats():
+    formats = []
+    for name in ["common", "vcommon", "combined"]:
+        formats.append(ApacheLogFormat.predefinedFormats[name])
+    return formats + [f for f in CUSTOM_FORMATS if f not in formats]
+
+# returns (complete matches, matches) of the format on the lines
+def scoreFormat(formatObj, lines):
+    complete = 0
+    matched = 0
+    match = formatObj.regexp.match
+    for line in lines:
+        mo = match(line)
+        if mo:
+            matched += 1
+            if mo.end() == len(line):
+                complete += 1
+    return complete, matched
+
+# returns (format, complete matches) of the best candidate, format is None if none of them matches any line
+def detectFormat(lines, candidates=None):
+    best = None
+    bestScore = None
+    for index, format in enumerate(candidates or getCandidateFormats()):
+        formatObj = ApacheLogFormat.getCached(format)
+        complete, matched = scoreFormat(formatObj, lines)
+        score = (complete, matched, formatObj.regexp.groups, -index)
+        if matched and (bestScore is None or score > bestScore):
+            best = format
+            bestScore = score
+    return best, bestScore[0] if bestScore else 0
+
+_rotationSuffix = re.compile(r"(\.(gz|bz2|zst|xz|\d+|\d{4}-?\d\d-?\d\d))+$")
+
+# file name without rotation and compression suffixes
+def getFileFamily(fileName):
+    return _rotationSuffix.sub("", os.path.abspath(fileName))
+
+def _getCacheFile(cacheDir):
+    import httpd_log_cache
+    return os.path.join(httpd_log_cache.getCacheDir(cacheDir), DETECTION_CACHE_FILE)
+
+def loadDetectionCache(cacheDir=True):
+    try:
+        f = open(_getCacheFile(cacheDir))
+        try:
+            cache = json.load(f)
+        finally:
+            f.close()
+        return cache if isinstance(cache, dict) else {}
+    except (IOError, ValueError):
+        return {}
+
+def saveDetectionCache(cache, cacheDir=True):
+    cacheFile = _getCacheFile(cacheDir)
+    try:
+        if not os.path.isdir(os.path.dirname(cacheFile)):
+            os.makedirs(os.path.dirname(cacheFile))
+        tmpFile = "%s.%d.tmp" % (cacheFile, os.getpid())
+        f = open(tmpFile, "w")
+        try:
+            json.dump(cache, f)
+        finally:
+            f.close()
+        os.rename(tmpFile, cacheFile)
+    except (IOError, OSError):
+        # cache directory is not writable, format is detected every time
+        pass
+
+def readSample(fileName, count=SAMPLE_LINES):
+    import httpd_log_cache
+    f = httpd_log_cache._openSource(fileName)
+    try:
+        lines = []
+        for line in f:
+            lines.append(line.rstrip("\r\n"))
+            if len(lines) >= count:
+                break
+        return lines
+    finally:
+        f.close()
+
+# Returns format of the sample lines of the file (fileName may be None), uses and updates detection cache
+# in cacheDir (True - default cache directory, None - don't cache)
+def detectFileFormat(fileName, lines, cacheDir=True):
+    if not lines:
+        raise MiningError("Can't detect log format of empty input")
+    family = getFileFamily(fileName) if fileName and cacheDir else None
+    cache = loadDetectionCache(cacheDir) if family else {}
+    cached = cache.get(family)
+    if cached:
+        complete, matched = scoreFormat(ApacheLogFormat.getCached(cached), lines)
+        if complete >= MIN_MATCH_RATE * len(lines):
+            return cached
+    format, complete = detectFormat(lines)
+    if format is None:
+        raise MiningError("Failed to detect log format%s" % (" of '%s'" % fileName if fileName else ""))
+    if family and format != cached:
+        if len(cache) >= MAX_CACHED_FAMILIES:
+            cache.clear()
+        cache[family] = format
+        saveDetectionCache(cache, cacheDir)
+    return format
+
+# Returns (fileHandler, format) for the stream, file is sampled by its name or by returned file handler
+def detectStreamFormat(fileHandler, cacheDir=True):
+    fileName = getattr(fileHandler, "name", None)
+    if fileName and os.path.isfile(fileName):
+        lines = readSample(fileName)
+    else:
+        fileHandler = SampledLines(fileHandler)
+        lines = fileHandler.sample
+        fileName = None
+    return fileHandler, detectFileFormat(fileName, lines, cacheDir)
+
+class FormatDetector(object):
+    # collects bursts of failed lines of the stream and detects new format for them
+    def __init__(self, format):
+        self.format = format
+        self.burst = []
+        self.burstStart = 0
+        self.required = REDETECT_LINES
+        self.switches = 0
+
+    # returns new format if lines should be parsed by it, total is number of lines read by the stream
+    def addFailure(self, line, total):
+        if self.burst and float(len(self.burst) + 1) / (total - self.burstStart + 1) < MAX_FAILURE_RATE:
+            self.burst = []
+        if not self.burst:
+            self.burstStart = total
+        self.burst.append(line)
+        if len(self.burst) < self.required:
+            return None
+        format, complete = detectFormat(self.burst)
+        if format is None or format == self.format or complete < MIN_MATCH_RATE * len(self.burst):
+            # lines are garbage, don't try to detect format again before twice as many lines fail
+            self.required *= 2
+            return None
+        self.format = format
+        self.required = REDETECT_LINES
+        self.switches += 1
+        return format
+
+    # returns failed lines of the burst that should be parsed again
+    def takeBurst(self):
+        burst = self.burst
+        self.burst = []
+        return burst
+
+class ReplayLines(object):
+    # Returns given lines and then lines of the stream file handler, restores the file handler of the stream
+    # when lines are exhausted, so parsing doesn't pay for replay afterwards
+    def __init__(self, stream, lines):
+        self.stream = stream
+        self.fileHandler = stream.myFileHandler
+        self.lines = list(reversed(lines))
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self.lines:
+            return self.lines.pop()
+        self.stream.myFileHandler = self.fileHandler
+        return self.fileHandler.next()
+
+    def __getattr__(self, name):
+        return getattr(self.fileHandler, name)
+
+class SampledLines(object):
+    # Reads sample of lines from file handler without name (like stdin) and returns them again before other lines
+    def __init__(self, fileHandler, count=SAMPLE_LINES):
+        self.fileHandler = fileHandler
+        self.sample = []
+        for line in fileHandler:
+            self.sample.append(line.rstrip("\r\n"))
+            if len(self.sample) >= count:
+                break
+        self.lines = list(reversed(self.sample))
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self.lines:
+            return self.lines.pop()
+        return self.fileHandler.next()
+
+    def __getattr__(self, name):
+        return getattr(self.fileHandler, name)
+
+def test():
+    import m.ut_utils as ut
+    import tempfile
+    import shutil
+    import StringIO
+    from httpd_log_benchmark import LogGenerator
+    ut.START_TEST("httpd_log_detect")
+    for format in getCandidateFormats():
+        lines = LogGenerator(format, 18, 0).generate(SAMPLE_LINES)
+        ut.EXPECT_EQ(format, "detectFormat(lines)[0]")
+    ut.EXPECT_EQ("access.log", "os.path.basename(getFileFamily('access.log.1.gz'))")
+    ut.EXPECT_EQ("access.log", "os.path.basename(getFileFamily('access.log.20141001'))")
+    directory = tempfile.mkdtemp()
+    try:
+        combined = ApacheLogFormat.predefinedFormats["combined"]
+        lines = LogGenerator(combined, 18, 0.02).generate(1000)
+        fileName = os.path.join(directory, "access.log.1")
+        f = open(fileName, "wb")
+        f.write("\n".join(lines) + "\n")
+        f.close()
+        from httpd_log_stream import iApacheLogStream
+        stream = iApacheLogStream(open(fileName), "auto", fields="status", cache=None, detectionCache=directory)
+        ut.EXPECT_EQ(combined, "stream.formatObj.template")
+        ut.EXPECT_EQ(len([line for line in lines if ApacheLogFormat.getCached(combined).match(line)]), "len([r.status for r, in stream])")
+        ut.EXPECT_EQ({getFileFamily(fileName): combined}, "loadDetectionCache(directory)")
+        # cached format is used for rotated file
+        ut.EXPECT_EQ(combined, "detectFileFormat(os.path.join(directory, 'access.log.2.gz'), lines[:SAMPLE_LINES], directory)")
+        # input without name, format changes in the middle
+        common = ApacheLogFormat.predefinedFormats["common"]
+        vhost = CUSTOM_FORMATS[0]
+        lines = LogGenerator(common, 19, 0).generate(500) + LogGenerator(vhost, 20, 0).generate(500)
+        stream = iApacheLogStream(StringIO.StringIO("\n".join(lines) + "\n"), "auto", fields="status,numbytes")
+        records = [r for r, in stream]
+        ut.EXPECT_EQ(1000, "len(records)")
+        ut.EXPECT_EQ(0, "stream.failed")
+        ut.EXPECT_EQ(1000, "stream.total")
+        ut.EXPECT_EQ(vhost, "stream.formatObj.template")
+        ut.EXPECT_EQ(1, "stream.detector.switches")
+        # garbage in the middle doesn't change the format
+        lines = LogGenerator(common, 19, 0).generate(500)
+        lines[200:260] = ["garbage %d" % i for i in range(60)]
+        stream = iApacheLogStream(StringIO.StringIO("\n".join(lines) + "\n"), "auto")
+        ut.EXPECT_EQ(440, "len([r for r, in stream])")
+        ut.EXPECT_EQ(common, "stream.formatObj.template")
+        ut.EXPECT_EQ(0, "stream.detector.switches")
+    finally:
+        shutil.rmtree(directory)
+    ut.END_TEST()
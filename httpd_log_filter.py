@@ -0,0 +1,396 @@
+#
+# Copyright Michael Groys, 2014
+#
+# Predicates on httpd log fields that are checked on the input stream.
+# Each predicate is checked exactly on the parsed record, in addition, when the field position in format
+# allows, it creates cheap prefilter on the raw line that rejects lines before regular expression match.
+# Prefilters are conservative: line rejected by prefilter never passes exact check.
+#
+import re
+import math
+import time
+import calendar
+import operator
+import sre_parse
+import sre_constants
+from m.common import MiningError
+from httpd_log_template import parseTemplate, _canMatchChar
+
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+# slack around time range, time zone offset "\d\d\d\d" can shift local date by up to 99:59 hours
+LOCALTIME_SLACK = 100*3600
+MAX_PREFILTER_DAYS = 400
+# record properties that are integer value of their group text ("-" is 0), numeric predicates on them get prefilters
+NUMBER_FIELDS = set(["status", "firstStatus", "numbytes", "durationUsec", "durationSec", "keepaliveNum", "port", "workerPid",
+                     "receivedBytes", "sentBytes"])
+# record properties with numeric values, predicates on them require numeric values
+NUMERIC_FIELDS = NUMBER_FIELDS | set(["gmtime", "gmtoffset", "duration", "contentLength"])
+# record properties that return their group text as is, text predicates on them get prefilters
+# (converted values like duration, contentLength or browser differ from the text in the line)
+TEXT_FIELDS = set(["remoteHost", "logname", "userid", "request", "method", "url", "protocol", "urlPath", "urlRoot",
+                   "queryString", "statusAsStr", "numbytesAsStr", "remoteIp", "localIp", "filename", "handler",
+                   "definedServerName", "serverName", "connectionStatus", "userAgent", "referer", "contentType",
+                   "contentLengthAsStr", "durationUsecAsStr", "durationSecAsStr", "keepaliveNumAsStr", "portAsStr",
+                   "workerPidAsStr", "receivedBytesAsStr", "sentBytesAsStr"])
+
+def _startsWith(value, prefix):
+    return value is not None and value.startswith(prefix)
+
+def _isIn(value, values):
+    return value in values
+
+OPERATORS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    ">=": operator.ge,
+    "<=": operator.le,
+    ">":  operator.gt,
+    "<":  operator.lt,
+    "^=": _startsWith,
+    "in": _isIn,
+}
+
+PREDICATE_RE = re.compile(r"^\s*(\w+)\s*(==|!=|>=|<=|\^=|>|<|\s+in\s)\s*(.*?)\s*$")
+
+def parseTime(value):
+    # accepts epoch seconds or UTC time "YYYY-mm-dd[ HH:MM:SS]"
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    for fmt in ["%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d"]:
+        try:
+            return calendar.timegm(time.strptime(value, fmt))
+        except ValueError:
+            pass
+    raise MiningError("Invalid time value '%s'" % value)
+
+def parseNumber(value):
+    try:
+        return int(value)
+    except ValueError:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+
+class Predicate(object):
+    # record field - one of record properties, like status, method, urlPath, remoteIp, gmtime
+    def __init__(self, field, op, value):
+        if op not in OPERATORS:
+            raise MiningError("Unknown operator '%s' in predicate on '%s'" % (op, field))
+        self.field = field
+        self.op = op
+        self.compare = OPERATORS[op]
+        if op == "in":
+            if isinstance(value, basestring):
+                value = [v.strip() for v in value.split(",")]
+            self.value = frozenset(str(v) for v in value)
+            numbers = [parseNumber(v) for v in self.value]
+            self.numValue = None if None in numbers else frozenset(numbers)
+        else:
+            self.value = str(value)
+            self.numValue = parseTime(self.value) if field == "gmtime" else parseNumber(self.value)
+        if field in NUMERIC_FIELDS:
+            if op == "^=":
+                raise MiningError("Operator '^=' is not supported on numeric field '%s'" % field)
+            if self.numValue is None:
+                raise MiningError("Numeric field '%s' is compared with non numeric value '%s'" % (field, value))
+
+    def check(self, record):
+        value = getattr(record, self.field)
+        if value is None or isinstance(value, basestring):
+            return self.compare(value, self.value)
+        return self.compare(value, self.numValue)
+
+    def __str__(self):
+        return "%s %s %s" % (self.field, self.op, ",".join(sorted(self.value)) if self.op == "in" else self.value)
+
+def parsePredicates(where):
+    # where is predicate string "status>=500; method==POST", or list of strings and Predicate objects
+    if isinstance(where, basestring):
+        where = [w for w in where.split(";") if w.strip()]
+    predicates = []
+    for item in where:
+        if isinstance(item, Predicate):
+            predicates.append(item)
+            continue
+        mo = PREDICATE_RE.match(item)
+        if not mo:
+            raise MiningError("Invalid predicate '%s', expected <field> <op> <value>" % item)
+        predicates.append(Predicate(mo.group(1), mo.group(2).strip(), mo.group(3)))
+    return predicates
+
+def _literalText(items):
+    chars = []
+    for op, av in items:
+        if op != sre_constants.LITERAL:
+            return None
+        chars.append(chr(av))
+    return "".join(chars)
+
+def _locateGroup(items, groupId):
+    # Returns (prefix, suffix, subpattern) when group starts after fixed prefix of the pattern,
+    # suffix is fixed text after the group till the end of pattern or None
+    prefix = []
+    for index, (op, av) in enumerate(items):
+        if op == sre_constants.SUBPATTERN:
+            rest = _literalText(items[index+1:])
+            if av[0] == groupId:
+                return "".join(prefix), rest, av[-1]
+            found = _locateGroup(av[-1], groupId)
+            if not found:
+                return None
+            groupPrefix, groupSuffix, subpattern = found
+            suffix = groupSuffix + rest if groupSuffix is not None and rest is not None else None
+            return "".join(prefix) + groupPrefix, suffix, subpattern
+        elif op == sre_constants.LITERAL:
+            prefix.append(chr(av))
+        else:
+            return None
+    return None
+
+class FieldLayout(object):
+    # Position of the field group in the format: literal text that always precedes
+    # and follows the field value in the line (after is None if field is followed by other fields)
+    def __init__(self, groupName, before="", after=None, atLineStart=False, numeric=False):
+        self.groupName = groupName
+        self.before = before
+        self.after = after
+        self.atLineStart = atLineStart
+        self.numeric = numeric
+
+class FormatLayout(object):
+    def __init__(self, formatObj):
+        self.formatObj = formatObj
+        self.groups = {} # group name -> FieldLayout
+        self.hasTime = False
+        items = parseTemplate(formatObj) or []
+        for i, item in enumerate(items):
+            if isinstance(item, basestring):
+                continue
+            if item.field == "t":
+                self.hasTime = True
+            before = items[i-1] if i > 0 and isinstance(items[i-1], basestring) else ""
+            after = items[i+1] if i+1 < len(items) and isinstance(items[i+1], basestring) else ""
+            parsed = sre_parse.parse(formatObj.getPattern(item.field, "(.*)"))
+            for groupName, groupId in parsed.pattern.groupdict.iteritems():
+                found = _locateGroup(parsed, groupId)
+                if not found:
+                    # position is not fixed, only value itself appears in the line
+                    self.groups[groupName] = FieldLayout(groupName)
+                    continue
+                prefix, suffix, subpattern = found
+                numeric = not [c for c in map(chr, range(32, 127)) if c not in "0123456789-" and _canMatchChar(subpattern, c, False)]
+                self.groups[groupName] = FieldLayout(groupName, before + prefix,
+                                                     suffix + after if suffix is not None else None,
+                                                     i == 0, numeric)
+
+    def getLayout(self, field):
+        # returns (isKnown, layout) for record property or group name
+        names = self.formatObj.__class__.fieldAliases.get(field, []) + [field]
+        present = [n for n in names if n in self.groups]
+        if not present:
+            return False, None
+        # field read from several groups (like urlPath from %r or %U) has no single layout
+        return True, self.groups[present[0]] if len(present) == 1 else None
+
+def _numberAtLeast(n):
+    # regular expression matching decimal numbers >= n (without leading zeros)
+    if n <= 0:
+        return r"\d+"
+    s = str(n)
+    alternatives = [r"[1-9]\d{%d,}" % len(s)]
+    for i in range(len(s)):
+        if s[i] != "9":
+            alternatives.append(r"%s[%d-9]\d{%d}" % (s[:i], int(s[i])+1, len(s)-i-1))
+    alternatives.append(s)
+    return "|".join(alternatives)
+
+def _numberAtMost(n):
+    # regular expression matching decimal numbers <= n (without leading zeros)
+    if n < 0:
+        return None
+    s = str(n)
+    alternatives = []
+    if len(s) > 1:
+        alternatives.append(r"\d{1,%d}" % (len(s)-1))
+    for i in range(len(s)):
+        if s[i] != "0":
+            alternatives.append(r"%s[0-%d]\d{%d}" % (s[:i], int(s[i])-1, len(s)-i-1))
+    alternatives.append(s)
+    return "|".join(alternatives)
+
+def _numberPattern(op, value):
+    if op == "in":
+        patterns = [p for p in [_numberPattern("==", v) for v in value] if p is not None]
+        return "|".join(patterns) if patterns else None
+    if value != int(value):
+        # fractional bound, compare with nearest integer inside the range
+        if op == "==":
+            return None
+        value = math.ceil(value) if op in (">", ">=") else math.floor(value)
+        op = {">": ">=", "<": "<="}.get(op, op)
+    value = int(value)
+    if op == "==":
+        return str(value) if value >= 0 else None
+    elif op == ">=":
+        return _numberAtLeast(value)
+    elif op == ">":
+        return _numberAtLeast(value+1)
+    elif op == "<=":
+        return _numberAtMost(value)
+    elif op == "<":
+        return _numberAtMost(value-1)
+    return None
+
+class LineFilter(object):
+    def __init__(self, formatObj, predicates):
+        self.predicates = parsePredicates(predicates)
+        self.prefilters = []
+        layout = FormatLayout(formatObj)
+        timeRange = [None, None]
+        for predicate in self.predicates:
+            known, fieldLayout = layout.getLayout(predicate.field)
+            if not known:
+                raise MiningError("Field '%s' is not present in log format" % predicate.field)
+            if predicate.field == "gmtime":
+                if predicate.op in (">", ">=", "=="):
+                    timeRange[0] = max(timeRange[0], predicate.numValue)
+                if predicate.op in ("<", "<=", "=="):
+                    timeRange[1] = predicate.numValue if timeRange[1] is None else min(timeRange[1], predicate.numValue)
+            elif fieldLayout:
+                prefilter = self.createPrefilter(predicate, fieldLayout)
+                if prefilter:
+                    self.prefilters.append(prefilter)
+        if layout.hasTime and timeRange[0] is not None and timeRange[1] is not None:
+            self.prefilters.append(self.createTimePrefilter(timeRange[0], timeRange[1]))
+        self.checks = [predicate.check for predicate in self.predicates]
+
+    # list of fields read by exact checks, used for projection
+    def getFields(self):
+        return [predicate.field for predicate in self.predicates]
+
+    def createPrefilter(self, predicate, layout):
+        before = layout.before
+        after = layout.after or ""
+        if predicate.field in NUMBER_FIELDS:
+            if not layout.numeric or predicate.numValue is None:
+                return None
+            numbers = _numberPattern(predicate.op, predicate.numValue)
+            if numbers is None:
+                if predicate.op in ("!=",):
+                    return None
+                return lambda line: False
+            if not before and not layout.atLineStart:
+                return None
+            # "-" is converted to 0 by record properties
+            regexp = re.compile("%s%s(?:0*(?:%s)|-)%s" % ("^" if layout.atLineStart else "", re.escape(before), numbers, re.escape(after[:1])))
+            return lambda line: regexp.search(line) is not None
+        if predicate.field not in TEXT_FIELDS:
+            return None
+        if predicate.op == "^=":
+            texts = [before + predicate.value]
+        elif predicate.op == "==":
+            texts = [before + predicate.value + (after if layout.after is not None else "")]
+        elif predicate.op == "in":
+            texts = [before + v + (after if layout.after is not None else "") for v in predicate.value]
+        else:
+            return None
+        if layout.atLineStart:
+            texts = tuple(texts)
+            return lambda line: line.startswith(texts)
+        if len(texts) == 1:
+            text = texts[0]
+            return lambda line: text in line
+        return lambda line: any(text in line for text in texts)
+
+    def createTimePrefilter(self, start, end):
+        # Checks day of every "[" in the line, lines with non canonical time format are passed to exact check
+        days = set()
+        if end - start <= MAX_PREFILTER_DAYS*86400:
+            day = int(start - LOCALTIME_SLACK) // 86400 * 86400
+            while day <= end + LOCALTIME_SLACK:
+                t = time.gmtime(day)
+                days.add("%02d/%s/%04d" % (t.tm_mday, MONTHS[t.tm_mon-1], t.tm_year))
+                day += 86400
+        else:
+            return lambda line: True
+        months = set(MONTHS)
+        def prefilter(line):
+            pos = line.find("[")
+            while pos >= 0:
+                day = line[pos+1:pos+12]
+                if day in days:
+                    return True
+                if not (day[2:3] == "/" and day[6:7] == "/" and day[3:6] in months and day[:2].isdigit() and day[7:].isdigit()):
+                    return True
+                pos = line.find("[", pos+1)
+            return False
+        return prefilter
+
+    def prefilter(self, line):
+        for prefilter in self.prefilters:
+            if not prefilter(line):
+                return False
+        return True
+
+    def check(self, record):
+        for check in self.checks:
+            if not check(record):
+                return False
+        return True
+
+def test():
+    import m.ut_utils as ut
+    from apache_log import ApacheLogFormat, ApacheLogRecord
+    ut.START_TEST("httpd_log_filter")
+    alf = ApacheLogFormat("combined")
+    lines = [
+        '127.0.0.1 - frank [10/Oct/2000:13:55:36 -0700] "GET /apache_pb.gif HTTP/1.0" 200 2326 "-" "curl/7.0"',
+        '10.0.0.1 - - [10/Oct/2000:13:55:36 +0000] "POST /api/v1?x=1 HTTP/1.1" 503 - "-" "curl/7.0"',
+        '10.0.0.2 - - [12/Oct/2000:23:55:36 +0000] "POST /api/v2 HTTP/1.1" 0500 15 "-" "curl/7.0"',
+        '10.0.0.3 - - [12/oct/2000:23:55:36 +0000] "GET /api/v2 HTTP/1.1" 404 15 "-" "curl/7.0"',
+        '10.0.0.3 - - [12/Oct/2000:23:55:36 +0000] "GET /apix HTTP/1.1" 1000 15 "-" "curl/7.0"',
+    ]
+    records = [ApacheLogRecord(alf, line) for line in lines]
+    for where in ["status>=500", "status<500", "status==500", "status in 404,503", "method==POST", "urlPath^=/api/",
+                  "remoteHost^=10.0.0.", "remoteHost==10.0.0.3", "numbytes>15; status!=404",
+                  "gmtime>=2000-10-11; gmtime<2000-10-13", "gmtime<=971185000"]:
+        lineFilter = LineFilter(alf, where)
+        for record in records:
+            expected = lineFilter.check(record)
+            actual = lineFilter.prefilter(record.line) and expected
+            ut.EXPECT_EQ(expected, "actual", msg="where=%s line=%s" % (where, record.line))
+    # converted values are not compared with the raw text
+    alf = ApacheLogFormat('%h %t "%r" %>s %b %D %{Content-length}o')
+    record = ApacheLogRecord(alf, '1.2.3.4 [10/Oct/2000:13:55:36 -0700] "GET /a HTTP/1.0" 200 5 134 -')
+    for where in ["duration<0.5", "duration<=0.001", "duration==0.000134", "contentLength<0", "contentLength==-1",
+                  "durationUsec==134", "durationUsec<=134", "durationUsecAsStr==134", "contentLengthAsStr==-"]:
+        lineFilter = LineFilter(alf, where)
+        ut.EXPECT_EQ(True, "lineFilter.check(record)", msg=where)
+        ut.EXPECT_EQ(True, "lineFilter.prefilter(record.line)", msg=where)
+    ut.EXPECT_EQ([], "LineFilter(alf, 'duration<0.5').prefilters")
+    ut.EXPECT_EQ(1, "len(LineFilter(alf, 'durationUsec>134').prefilters)")
+    alf = ApacheLogFormat("combined")
+    ut.EXPECT_EQ(False, "LineFilter(alf, 'status>=500').prefilter(lines[0])")
+    ut.EXPECT_EQ(False, "LineFilter(alf, 'method==POST').prefilter(lines[0])")
+    ut.EXPECT_EQ(False, "LineFilter(alf, 'gmtime>=2000-10-20; gmtime<2000-10-21').prefilter(lines[0])")
+    # fractional bounds are rounded towards the range
+    alf = ApacheLogFormat("%h %>s %b")
+    record = ApacheLogRecord(alf, "1.2.3.4 0 5")
+    for where in ["status>-0.5", "status>=-0.5", "status<0.5", "status<=0.5", "numbytes>4.5", "numbytes<5.5", "status!=0.5"]:
+        lineFilter = LineFilter(alf, where)
+        ut.EXPECT_EQ(True, "lineFilter.check(record)", msg=where)
+        ut.EXPECT_EQ(True, "lineFilter.prefilter(record.line)", msg=where)
+    for where in ["status<-0.5", "numbytes>5.5", "status==0.5"]:
+        ut.EXPECT_EQ(False, "LineFilter(alf, where).prefilter(record.line)", msg=where)
+    # invalid predicates on numeric fields are rejected when parsed
+    for where in ["status in 200,OK", "status^=2", "numbytes>large", "duration<=fast", "contentLength==-"]:
+        try:
+            parsePredicates(where)
+            error = None
+        except MiningError as error:
+            pass
+        ut.EXPECT_EQ(True, "error is not None", msg=where)
+    ut.END_TEST()
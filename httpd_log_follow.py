@@ -0,0 +1,347 @@
+#
+# Copyright Michael Groys, 2014
+#
+# Following of the log file that is written by running server (like "tail -F").
+# File is read by large chunks, only complete lines are returned, at the end of file the reader waits
+# for changes by inotify (Linux) or by polling, and checks for log rotation:
+#   rename - file name points to the new file, old one is read to the end and the new one is read from start
+#   copytruncate - file is shorter than read position, it is read from start
+# Lines written to the old file after rename was detected and lines written between copy and truncate are lost.
+# Lag metrics are collected for every parsed record:
+#   lag - parse time minus time of the record (%t is the time request was received, so lag includes request duration)
+#   readLag - parse time minus time the line was read from the file
+#
+import os
+import sys
+import time
+import errno
+import select
+from m.common import MiningError
+from httpd_log_timeindex import getLineTime
+
+READ_SIZE = 64*1024
+DEFAULT_POLL_INTERVAL = 0.25
+# inotify may miss events (e.g. directory of the file is replaced), file is checked at least this often
+MAX_WAIT = 1.0
+BACKENDS = ("auto", "inotify", "poll")
+
+class PollingWatcher(object):
+    def __init__(self, fileName, pollInterval=DEFAULT_POLL_INTERVAL):
+        self.pollInterval = pollInterval
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, self.pollInterval))
+
+    def close(self):
+        pass
+
+class InotifyWatcher(object):
+    IN_MODIFY = 0x002
+    IN_ATTRIB = 0x004
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_NONBLOCK = 0x800
+    IN_CLOEXEC = 0x80000
+    _libc = None
+
+    @classmethod
+    def getLibc(cls):
+        if cls._libc is None:
+            cls._libc = False
+            if sys.platform.startswith("linux"):
+                try:
+                    import ctypes
+                    import ctypes.util
+                    libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+                    libc.inotify_init1
+                    libc.inotify_add_watch
+                    cls._libc = libc
+                except (ImportError, OSError, AttributeError):
+                    pass
+        return cls._libc
+
+    @classmethod
+    def isAvailable(cls):
+        return bool(cls.getLibc())
+
+    def __init__(self, fileName, pollInterval=DEFAULT_POLL_INTERVAL):
+        import ctypes
+        libc = self.getLibc()
+        if not libc:
+            raise MiningError("inotify is not available")
+        self.fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise MiningError("inotify_init1 failed: %s" % os.strerror(ctypes.get_errno()))
+        # directory is watched, so creation of the new file after rotation is reported
+        directory = os.path.dirname(os.path.abspath(fileName))
+        mask = (self.IN_MODIFY | self.IN_ATTRIB | self.IN_CLOSE_WRITE | self.IN_MOVED_FROM |
+                self.IN_MOVED_TO | self.IN_CREATE | self.IN_DELETE)
+        if libc.inotify_add_watch(self.fd, directory, mask) < 0:
+            error = os.strerror(ctypes.get_errno())
+            os.close(self.fd)
+            raise MiningError("Failed to watch '%s': %s" % (directory, error))
+
+    def wait(self, timeout):
+        readable = select.select([self.fd], [], [], min(timeout, MAX_WAIT))[0]
+        if readable:
+            # events are not parsed, any change causes read attempt
+            try:
+                while os.read(self.fd, 65536):
+                    pass
+            except OSError, e:
+                if e.errno != errno.EAGAIN:
+                    raise
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+def createWatcher(backend, fileName, pollInterval=DEFAULT_POLL_INTERVAL):
+    if backend not in BACKENDS:
+        raise MiningError("Unknown follow backend '%s', expected one of: %s" % (backend, ", ".join(BACKENDS)))
+    if backend == "inotify" or (backend == "auto" and InotifyWatcher.isAvailable()):
+        return InotifyWatcher(fileName, pollInterval)
+    return PollingWatcher(fileName, pollInterval)
+
+class LagMeter(object):
+    def __init__(self):
+        self.count = 0
+        self.lagSum = 0.
+        self.maxLag = 0.
+        self.lastLag = None
+        self.readLagSum = 0.
+        self.maxReadLag = 0.
+
+    def add(self, lineTime, readTime, now):
+        self.count += 1
+        if lineTime is not None:
+            lag = now - lineTime
+            self.lagSum += lag
+            self.maxLag = max(self.maxLag, lag)
+            self.lastLag = lag
+        if readTime is not None:
+            readLag = now - readTime
+            self.readLagSum += readLag
+            self.maxReadLag = max(self.maxReadLag, readLag)
+
+    def getMetrics(self):
+        return {
+            "records": self.count,
+            "lastLag": self.lastLag,
+            "meanLag": self.lagSum / self.count if self.count else None,
+            "maxLag": self.maxLag,
+            "meanReadLag": self.readLagSum / self.count if self.count else None,
+            "maxReadLag": self.maxReadLag,
+        }
+
+class FollowReader(object):
+    # Iterates over lines appended to the file, fromStart - read existing content first,
+    # idleTimeout - stop iteration if nothing was appended for that many seconds (None - follow forever)
+    def __init__(self, fileName, backend="auto", fromStart=False, pollInterval=DEFAULT_POLL_INTERVAL, idleTimeout=None, readSize=READ_SIZE):
+        if not fileName:
+            raise MiningError("Follow mode requires file name")
+        self.name = fileName
+        self.idleTimeout = idleTimeout
+        self.readSize = readSize
+        self.watcher = createWatcher(backend, fileName, pollInterval)
+        self.fd = None
+        self.fileId = None
+        self.position = 0
+        self.lines = []
+        self.index = 0
+        self.partial = ""
+        self.readTime = None       # time current lines were read
+        self.lastDataTime = time.time()
+        self.stopped = False
+        self.rotations = 0
+        self.truncations = 0
+        self.reads = 0
+        self.bytesRead = 0
+        self.linesRead = 0
+        self.lagMeter = LagMeter()
+        self.open(fromStart)
+
+    def open(self, fromStart):
+        try:
+            fd = os.open(self.name, os.O_RDONLY)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            return False
+        st = os.fstat(fd)
+        self.fd = fd
+        self.fileId = (st.st_dev, st.st_ino)
+        self.position = 0 if fromStart else st.st_size
+        os.lseek(fd, self.position, os.SEEK_SET)
+        return True
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        while self.index >= len(self.lines):
+            if self.stopped:
+                raise StopIteration
+            if not self.read():
+                now = time.time()
+                if self.idleTimeout is not None:
+                    idle = now - self.lastDataTime
+                    if idle >= self.idleTimeout:
+                        raise StopIteration
+                    self.watcher.wait(self.idleTimeout - idle)
+                else:
+                    self.watcher.wait(MAX_WAIT)
+        line = self.lines[self.index]
+        self.index += 1
+        self.linesRead += 1
+        return line
+
+    # reads next chunk of the file, returns False if there is nothing to read
+    def read(self):
+        if self.fd is None and not self.open(True):
+            return False
+        data = os.read(self.fd, self.readSize)
+        if not data:
+            return self.checkRotation()
+        self.reads += 1
+        self.bytesRead += len(data)
+        self.position += len(data)
+        self.readTime = self.lastDataTime = time.time()
+        data = self.partial + data
+        end = data.rfind("\n")
+        if end < 0:
+            self.partial = data
+            return False
+        self.partial = data[end+1:]
+        self.lines = data[:end].split("\n")
+        self.index = 0
+        return True
+
+    # called at the end of file, returns True if file should be read again
+    def checkRotation(self):
+        try:
+            st = os.stat(self.name)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            # renamed, new file is not created yet
+            return False
+        if (st.st_dev, st.st_ino) != self.fileId:
+            if os.fstat(self.fd).st_size > self.position:
+                # written to the old file after end of file was read
+                return True
+            os.close(self.fd)
+            self.fd = None
+            self.rotations += 1
+            self.open(True)
+            if self.partial:
+                # last line of the old file without new line
+                self.lines = [self.partial]
+                self.index = 0
+                self.partial = ""
+            return True
+        if st.st_size < self.position:
+            self.truncations += 1
+            os.lseek(self.fd, 0, os.SEEK_SET)
+            self.position = 0
+            self.partial = ""
+            return True
+        return False
+
+    # updates lag metrics with the line that was returned last
+    def recordParsed(self, line):
+        self.lagMeter.add(getLineTime(line), self.readTime, time.time())
+
+    def getMetrics(self):
+        metrics = self.lagMeter.getMetrics()
+        metrics.update({
+            "reads": self.reads,
+            "bytesRead": self.bytesRead,
+            "linesRead": self.linesRead,
+            "rotations": self.rotations,
+            "truncations": self.truncations,
+        })
+        return metrics
+
+    def stop(self):
+        self.stopped = True
+
+    def close(self):
+        self.stopped = True
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        self.watcher.close()
+
+def test():
+    import m.ut_utils as ut
+    import tempfile
+    import shutil
+    import threading
+    ut.START_TEST("httpd_log_follow")
+    def lineOf(i):
+        return '10.0.0.%d - - [%s +0000] "GET /path/%d HTTP/1.1" 200 %d' % (i%256, time.strftime("%d/%b/%Y:%H:%M:%S", time.gmtime()), i, i)
+    def append(fileName, text):
+        f = open(fileName, "ab")
+        f.write(text)
+        f.close()
+    def waitFor(condition):
+        deadline = time.time() + 10
+        while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+    def writer(fileName, reader, lines):
+        for i in range(0, 50, 10):
+            append(fileName, "".join(line + "\n" for line in lines[i:i+10]))
+            time.sleep(0.01)
+        # line split between writes
+        append(fileName, lines[50][:20])
+        time.sleep(0.05)
+        append(fileName, lines[50][20:] + "\n")
+        waitFor(lambda: reader.linesRead == 51)
+        # rename rotation
+        os.rename(fileName, fileName + ".1")
+        append(fileName + ".1", lines[51] + "\n")
+        append(fileName, "".join(line + "\n" for line in lines[52:100]))
+        waitFor(lambda: reader.linesRead == 100)
+        # copytruncate rotation
+        shutil.copy(fileName, fileName + ".2")
+        open(fileName, "wb").close()
+        waitFor(lambda: reader.truncations == 1)
+        append(fileName, "".join(line + "\n" for line in lines[100:150]))
+    backends = ["poll"] + (["inotify"] if InotifyWatcher.isAvailable() else [])
+    for backend in backends:
+        directory = tempfile.mkdtemp()
+        fileName = os.path.join(directory, "access.log")
+        try:
+            append(fileName, "old line\n")
+            lines = [lineOf(i) for i in range(150)]
+            reader = FollowReader(fileName, backend, pollInterval=0.01, idleTimeout=1.0)
+            thread = threading.Thread(target=writer, args=(fileName, reader, lines))
+            thread.start()
+            result = list(reader)
+            thread.join()
+            ut.EXPECT_EQ(lines, "result", msg=backend)
+            ut.EXPECT_EQ(1, "reader.rotations", msg=backend)
+            ut.EXPECT_EQ(1, "reader.truncations", msg=backend)
+            ut.EXPECT_EQ(True, "reader.reads < len(lines)", msg=backend)
+            reader.close()
+            # stream with follow mode
+            from httpd_log_stream import iNCSALogStream
+            stream = iNCSALogStream(open(fileName), follow="start", followBackend=backend, idleTimeout=0.5)
+            ut.EXPECT_EQ(range(100, 150), "[r.numbytes for r, in stream]", msg=backend)
+            metrics = stream.followReader.getMetrics()
+            ut.EXPECT_EQ(50, "metrics['records']")
+            ut.EXPECT_EQ(True, "0 <= metrics['maxReadLag'] < 1 and metrics['maxLag'] < 60")
+            ut.EXPECT_EQ(None, "stream.followReader.fd")
+            # abandoned stream releases the file and the watcher
+            stream = iNCSALogStream(open(fileName), follow="start", followBackend=backend)
+            stream.next()
+            stream.close()
+            ut.EXPECT_EQ((None, None), "(stream.followReader.fd, getattr(stream.followReader.watcher, 'fd', None))")
+        finally:
+            shutil.rmtree(directory)
+    ut.END_TEST()
@@ -4,31 +4,72 @@
 import string
 import re
 import time
+import logging
 from m.loggers import toolsLog
+from m.common import MiningError
+
+# process wide cache of format objects, formats are not changed after construction and may be shared by streams
+MAX_CACHED_FORMATS = 256
+_cachedFormats = {}
+
+def parseFieldList(fields):
+    if isinstance(fields, basestring):
+        fields = [f.strip() for f in fields.split(",") if f.strip()]
+    return fields
 
 class LogFormat(string.Template):
     #delimeter = "$"
     #idpattern = "[_a-z][_a-z0-9]*"
     fieldPatterns = {} # defines pattern for each known field in format "(?P<id>.*)"
-    def __init__(self, format):
+    # fields is collection (or comma separated string) of field names read by the query,
+    # other directives are matched by non-capturing patterns, None means all fields
+    def __init__(self, format, fields=None):
         string.Template.__init__(self, format)
+        fields = parseFieldList(fields)
+        self.requiredFields = None if fields is None else set(fields)
         self._matchRef = []
         self.regexpStr = None
         self.regexp = None
+        # checked once, so setup of the format doesn't pay for disabled logging
+        self.logEnabled = toolsLog.isEnabledFor(logging.INFO)
+
+    # returns format string for the format name (predefined formats)
+    @classmethod
+    def resolveFormat(cls, format):
+        return format
+
+    # returns shared format object for these arguments, created once per process
+    @classmethod
+    def getCached(cls, format, fields=None):
+        fields = parseFieldList(fields)
+        key = (cls, cls.resolveFormat(format), None if fields is None else frozenset(fields))
+        formatObj = _cachedFormats.get(key)
+        if formatObj is None:
+            if len(_cachedFormats) >= MAX_CACHED_FORMATS:
+                _cachedFormats.clear()
+            formatObj = _cachedFormats[key] = cls(format, fields)
+        return formatObj
     
     def addReference(self, groupName, collection, index):
         self._matchRef.append( (groupName, collection, index) )
     
     def createMatch(self):
         self.regexpStr = self.substitute(self)
-        toolsLog.info("created regexp '%s'", self.regexpStr)
+        if self.logEnabled:
+            toolsLog.info("created regexp '%s'", self.regexpStr)
         self.regexp = re.compile(self.regexpStr)
         for groupName, collection, index in self._matchRef:
             collection[index] = self.regexp.groupindex[groupName]
 
     def __getitem__(self, field):
         self.registerFieldReferences(field)
-        return self.getPattern(field, "(.*)")
+        return self.getDirectivePattern(field)
+    # returns regular expression substituted for the field directive
+    def getDirectivePattern(self, field):
+        pattern = self.getPattern(field, "(.*)")
+        if self.requiredFields is not None:
+            pattern = removeCaptures(pattern, self.isGroupRequired)
+        return pattern
     def get(self, field, default=None):
         self.registerFieldReferences(field)
         return self.getPattern(field, default)
@@ -38,10 +79,73 @@ class LogFormat(string.Template):
     # It adds references to all named groups that appear in the field substitution
     def registerFieldReferences(self, field):
         raise NotImplemented()
+    # can be overridden by child to map requested fields to group names
+    def isGroupRequired(self, groupName):
+        return self.requiredFields is None or groupName in self.requiredFields
     # can be overridden by child to use different field-to-pattern substitution mechanism 
     def getPattern(self, field, default):
         return self.__class__.fieldPatterns.get(field, default)
 
+# Converts capturing groups of the pattern to non-capturing ones,
+# named groups for which keepGroup(name) returns True are preserved.
+# Matched text doesn't change, only less groups are filled by regular expression engine
+def removeCaptures(pattern, keepGroup):
+    result = []
+    i = 0
+    inClass = False
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "\\":
+            result.append(pattern[i:i+2])
+            i += 2
+            continue
+        if inClass:
+            if c == "]":
+                inClass = False
+        elif c == "[":
+            inClass = True
+            if pattern[i+1:i+2] == "^":
+                result.append(c)
+                i += 1
+                c = "^"
+            if pattern[i+1:i+2] == "]":
+                result.append(c)
+                i += 1
+                c = "]"
+        elif c == "(":
+            if pattern.startswith("(?P<", i):
+                end = pattern.index(">", i)
+                if not keepGroup(pattern[i+4:end]):
+                    result.append("(?:")
+                    i = end + 1
+                    continue
+            elif not pattern.startswith("(?", i):
+                result.append("(?:")
+                i += 1
+                continue
+        result.append(c)
+        i += 1
+    return "".join(result)
+
+# Lightweight replacement of the regular expression match object,
+# spans is flat sequence of (start, end) pairs relative to the string for all groups starting at offset
+class SpanMatch(object):
+    __slots__ = ("string", "spans", "offset")
+    def __init__(self, string, spans, offset):
+        self.string = string
+        self.spans = spans
+        self.offset = offset
+
+    def group(self, groupId, *groupIds):
+        if groupIds:
+            # tuple of groups like re match object
+            return tuple(self.group(g) for g in (groupId,) + groupIds)
+        index = self.offset + 2*groupId
+        start = self.spans[index]
+        if start < 0:
+            return None
+        return self.string[start:self.spans[index+1]]
+
 class FieldNotDefinedException(Exception):
     def __init__(self, fieldName=""):
         Exception.__init__(self)
@@ -0,0 +1,277 @@
+#
+# Copyright Michael Groys, 2014
+#
+# Streaming percentiles of record values (durationUsec, duration, sentBytes, numbytes) by mergeable histograms.
+# Log-linear histogram: values below 2^subBits have their own buckets, every larger power of 2 range
+# is split to 2^(subBits-1) equal buckets, so relative error of the percentile is below 2^-subBits
+# (0.4% for default subBits=8) for any value range. Non-negative integer values up to 2^64 need at most
+# 2^subBits * 33 buckets, only non-empty buckets are stored.
+# Histograms with the same subBits are merged by adding bucket counts, so histograms of parallel workers
+# or of separate files are combined without loss, they are saved as json.
+# HistogramAggregator keeps histogram per key of the record, like urlPath, status class or time bucket,
+# number of keys is bounded by maxKeys, values of other keys are added to OTHER_KEY histogram.
+#
+import json
+from operator import attrgetter
+from m.common import MiningError
+
+DEFAULT_SUB_BITS = 8
+DEFAULT_MAX_KEYS = 10000
+OTHER_KEY = "__other__"
+HISTOGRAM_VERSION = 1
+# floating point values are converted to integers by these scales
+DEFAULT_SCALES = {"duration": 1000000}
+
+class LogLinearHistogram(object):
+    def __init__(self, subBits=DEFAULT_SUB_BITS, scale=1):
+        if not 1 <= subBits <= 16:
+            raise MiningError("Histogram subBits should be between 1 and 16, got %s" % subBits)
+        self.subBits = subBits
+        self.linearLimit = 1 << subBits
+        self.halfSub = 1 << (subBits - 1)
+        self.scale = scale
+        self.buckets = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def getIndex(self, value):
+        if value < self.linearLimit:
+            return value
+        shift = value.bit_length() - self.subBits
+        return self.linearLimit + (shift - 1) * self.halfSub + (value >> shift) - self.halfSub
+
+    # returns [lower, upper) value range of the bucket
+    def getRange(self, index):
+        if index < self.linearLimit:
+            return index, index + 1
+        index -= self.linearLimit
+        shift = index // self.halfSub + 1
+        sub = index % self.halfSub + self.halfSub
+        return sub << shift, (sub + 1) << shift
+
+    def add(self, value, count=1):
+        if self.scale != 1:
+            value = int(value * self.scale + 0.5)
+        if value < self.linearLimit:
+            if value < 0:
+                raise MiningError("Histogram values should be non-negative, got %s" % value)
+            index = value
+        else:
+            shift = value.bit_length() - self.subBits
+            index = self.linearLimit + (shift - 1) * self.halfSub + (value >> shift) - self.halfSub
+        buckets = self.buckets
+        buckets[index] = buckets.get(index, 0) + count
+        self.count += count
+        self.total += value * count
+        if value < self.min or self.min is None:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        if other.subBits != self.subBits or other.scale != self.scale:
+            raise MiningError("Can't merge histograms with different subBits or scale")
+        buckets = self.buckets
+        for index, count in other.buckets.iteritems():
+            buckets[index] = buckets.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        return self
+
+    # value at quantile q (0..1), midpoint of the bucket limited by min and max values
+    def getPercentile(self, q):
+        return self.getPercentiles([q])[0]
+
+    def getPercentiles(self, quantiles):
+        if not self.count:
+            return [None] * len(quantiles)
+        order = sorted(range(len(quantiles)), key=lambda i: quantiles[i])
+        results = [None] * len(quantiles)
+        indexes = sorted(self.buckets)
+        position = 0
+        seen = 0
+        for i in order:
+            rank = max(1, min(self.count, int(round(quantiles[i] * self.count + 0.5 - 1e-9))))
+            while seen + self.buckets[indexes[position]] < rank:
+                seen += self.buckets[indexes[position]]
+                position += 1
+            lower, upper = self.getRange(indexes[position])
+            value = min(max((lower + upper - 1) / 2., self.min), self.max)
+            results[i] = value / self.scale if self.scale != 1 else value
+        return results
+
+    def getMean(self):
+        if not self.count:
+            return None
+        return float(self.total) / self.count / self.scale
+
+    def toDict(self):
+        return {"version": HISTOGRAM_VERSION, "subBits": self.subBits, "scale": self.scale, "count": self.count,
+                "total": self.total, "min": self.min, "max": self.max, "buckets": sorted(self.buckets.iteritems())}
+
+    @classmethod
+    def fromDict(cls, data):
+        if data.get("version") != HISTOGRAM_VERSION:
+            raise MiningError("Unsupported histogram version %s" % data.get("version"))
+        histogram = cls(data["subBits"], data["scale"])
+        histogram.buckets = dict((int(index), count) for index, count in data["buckets"])
+        histogram.count = data["count"]
+        histogram.total = data["total"]
+        histogram.min = data["min"]
+        histogram.max = data["max"]
+        return histogram
+
+def _statusClass(record):
+    return "%dxx" % (record.status // 100)
+
+def _getKeyFunction(key, timeBucket):
+    if key == "statusClass":
+        return _statusClass
+    if key == "timeBucket":
+        if not timeBucket:
+            raise MiningError("timeBucket key requires timeBucket seconds")
+        return lambda record: int(record.gmtime) // timeBucket * timeBucket
+    if callable(key):
+        return key
+    return attrgetter(key)
+
+class HistogramAggregator(object):
+    # value - record field, keys - record fields or "statusClass" ("2xx") or "timeBucket" (start of timeBucket seconds
+    # interval of gmtime) or functions of record, scale - multiplier that converts values to integers
+    def __init__(self, value="durationUsec", keys=(), timeBucket=None, subBits=DEFAULT_SUB_BITS, scale=None, maxKeys=DEFAULT_MAX_KEYS):
+        if isinstance(keys, basestring):
+            keys = [k.strip() for k in keys.split(",") if k.strip()]
+        self.value = value
+        self.keys = list(keys)
+        self.timeBucket = timeBucket
+        self.subBits = subBits
+        self.scale = scale if scale is not None else DEFAULT_SCALES.get(value, 1)
+        self.maxKeys = maxKeys
+        self.getValue = attrgetter(value)
+        keyFunctions = [_getKeyFunction(key, timeBucket) for key in self.keys]
+        if not keyFunctions:
+            self.getKey = lambda record: ()
+        elif len(keyFunctions) == 1:
+            keyFunction = keyFunctions[0]
+            self.getKey = lambda record: (keyFunction(record),)
+        else:
+            self.getKey = lambda record: tuple(f(record) for f in keyFunctions)
+        self.histograms = {}
+
+    def getHistogram(self, key):
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            if len(self.histograms) >= self.maxKeys and key != (OTHER_KEY,):
+                return self.getHistogram((OTHER_KEY,))
+            histogram = self.histograms[key] = LogLinearHistogram(self.subBits, self.scale)
+        return histogram
+
+    def add(self, record):
+        value = self.getValue(record)
+        if value is not None:
+            self.getHistogram(self.getKey(record)).add(value)
+
+    # adds all records of the stream (iterator of record tuples)
+    def addStream(self, stream):
+        for recordTuple in stream:
+            self.add(recordTuple[0])
+        return self
+
+    def merge(self, other):
+        for key, histogram in other.histograms.iteritems():
+            self.getHistogram(key).merge(histogram)
+        return self
+
+    # returns {key: [percentiles]}
+    def getPercentiles(self, quantiles=(0.5, 0.9, 0.99)):
+        return dict((key, histogram.getPercentiles(quantiles)) for key, histogram in self.histograms.iteritems())
+
+    def toDict(self):
+        return {"value": self.value, "keys": [k for k in self.keys if isinstance(k, basestring)], "timeBucket": self.timeBucket,
+                "subBits": self.subBits, "scale": self.scale, "maxKeys": self.maxKeys,
+                "histograms": [[list(key), histogram.toDict()] for key, histogram in self.histograms.iteritems()]}
+
+    @classmethod
+    def fromDict(cls, data):
+        aggregator = cls(data["value"], data["keys"], data["timeBucket"], data["subBits"], data["scale"], data["maxKeys"])
+        for key, histogram in data["histograms"]:
+            aggregator.histograms[tuple(key)] = LogLinearHistogram.fromDict(histogram)
+        return aggregator
+
+    def save(self, fileName):
+        f = open(fileName, "w")
+        try:
+            json.dump(self.toDict(), f)
+        finally:
+            f.close()
+
+    @classmethod
+    def load(cls, fileName):
+        f = open(fileName)
+        try:
+            return cls.fromDict(json.load(f))
+        finally:
+            f.close()
+
+def test():
+    import m.ut_utils as ut
+    import os
+    import random
+    import tempfile
+    import StringIO
+    ut.START_TEST("httpd_log_histogram")
+    rnd = random.Random(19)
+    values = [int(rnd.lognormvariate(10, 2)) for i in range(50000)] + [0, 1, 2**40]
+    histogram = LogLinearHistogram()
+    for value in values:
+        histogram.add(value)
+    values.sort()
+    for q in [0.001, 0.1, 0.5, 0.9, 0.99, 0.999]:
+        exact = values[int(round(q * len(values) + 0.5 - 1e-9)) - 1]
+        ut.EXPECT_EQ(True, "abs(histogram.getPercentile(q) - exact) <= exact / 256. + 0.5", msg="q=%s" % q)
+    ut.EXPECT_EQ([0, 2**40], "histogram.getPercentiles([0, 1])")
+    ut.EXPECT_EQ(len(values), "histogram.count")
+    ut.EXPECT_EQ(True, "len(histogram.buckets) < 2**DEFAULT_SUB_BITS * 33")
+    for value in [0, 255, 256, 257, 1000, 2**20 + 5, 2**63]:
+        lower, upper = histogram.getRange(histogram.getIndex(value))
+        ut.EXPECT_EQ(True, "lower <= value < upper", msg=str(value))
+    # merged halves are equal to the whole
+    first = LogLinearHistogram()
+    second = LogLinearHistogram()
+    for i, value in enumerate(values):
+        (first if i % 2 else second).add(value)
+    merged = LogLinearHistogram.fromDict(json.loads(json.dumps(first.toDict()))).merge(second)
+    ut.EXPECT_EQ(histogram.buckets, "merged.buckets")
+    ut.EXPECT_EQ(histogram.getPercentiles([0.5, 0.99]), "merged.getPercentiles([0.5, 0.99])")
+    # aggregation of stream records
+    from httpd_log_stream import iApacheLogStream
+    lines = []
+    for i in range(4000):
+        status = 200 if i % 4 else 500
+        lines.append('10.0.0.1 - - [10/Oct/2000:13:%02d:36 +0000] "GET /api/%d HTTP/1.1" %d 100 %d' % (i // 100, i % 2, status, 1000 + i))
+    format = '%h %l %u %t "%r" %>s %b %D'
+    aggregator = HistogramAggregator("duration", "urlPath,statusClass")
+    aggregator.addStream(iApacheLogStream(StringIO.StringIO("\n".join(lines)), format))
+    ut.EXPECT_EQ(set([("/api/0", "5xx"), ("/api/0", "2xx"), ("/api/1", "2xx")]), "set(aggregator.histograms)")
+    ut.EXPECT_EQ(2000, "aggregator.histograms[('/api/1', '2xx')].count")
+    percentiles = aggregator.getPercentiles([0.5])
+    ut.EXPECT_EQ(True, "abs(percentiles[('/api/1', '2xx')][0] - 0.003) < 0.003 / 200")
+    fd, fileName = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    try:
+        byTime = HistogramAggregator("durationUsec", "timeBucket", timeBucket=600, maxKeys=3)
+        byTime.addStream(iApacheLogStream(StringIO.StringIO("\n".join(lines[:2000])), format))
+        byTime.save(fileName)
+        loaded = HistogramAggregator.load(fileName)
+        loaded.addStream(iApacheLogStream(StringIO.StringIO("\n".join(lines[2000:])), format))
+        ut.EXPECT_EQ(4, "len(loaded.histograms)")
+        ut.EXPECT_EQ(True, "(OTHER_KEY,) in loaded.histograms")
+        ut.EXPECT_EQ(4000, "sum(h.count for h in loaded.histograms.values())")
+    finally:
+        os.unlink(fileName)
+    ut.END_TEST()
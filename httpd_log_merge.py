@@ -0,0 +1,251 @@
+#
+# Copyright Michael Groys, 2014
+#
+# Time ordered merge of many log files (e.g. logs of all servers and virtual hosts).
+# Every source is parsed by its own stream (each may have different format), streams are merged by heap
+# holding single record of every source.
+# Lines are ordered by time decoded directly from the line (see httpd_log_timeindex.getLineTime), not by parsing.
+# Apache writes lines at request completion, so lines of the single file may be out of order:
+# every source reorders its lines inside window of seconds, a line is released when the source reached line
+# that is window seconds later, or when maxBuffered lines are pending, so memory is bounded per source.
+# Lines later than window (lateLines) are released immediately and break the order.
+# Lines without time get the latest time seen in the source.
+#
+import os
+import heapq
+import httpd_log_stream
+import httpd_log_readahead
+from httpd_log_timeindex import getLineTime, DEFAULT_TOLERANCE
+from m.common import MiningError
+from m._runtime import isVerbose
+
+DEFAULT_WINDOW = DEFAULT_TOLERANCE
+DEFAULT_MAX_BUFFERED = 100000
+
+class ReorderedLines(object):
+    # Iterates over lines of file handler ordered by time inside window of seconds,
+    # lastTime is time of the line returned last
+    def __init__(self, fileHandler, window=DEFAULT_WINDOW, maxBuffered=DEFAULT_MAX_BUFFERED):
+        self.fileHandler = fileHandler
+        self.name = getattr(fileHandler, "name", None)
+        self.window = window
+        self.maxBuffered = maxBuffered
+        self.heap = []
+        self.seq = 0
+        self.maxTime = None
+        self.lastTime = None
+        self.releasedTime = None   # time of the last released line
+        self.lateLines = 0
+        self.finished = False
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        heap = self.heap
+        while not self.finished:
+            if heap and (len(heap) > self.maxBuffered or heap[0][0] <= self.maxTime - self.window):
+                break
+            try:
+                line = self.fileHandler.next()
+            except StopIteration:
+                self.finished = True
+                break
+            t = getLineTime(line)
+            if t is None:
+                t = self.maxTime if self.maxTime is not None else 0
+            if self.maxTime is None or t > self.maxTime:
+                self.maxTime = t
+            if self.releasedTime is not None and t < self.releasedTime:
+                self.lateLines += 1
+                t = self.releasedTime
+            heapq.heappush(heap, (t, self.seq, line))
+            self.seq += 1
+        if not heap:
+            raise StopIteration
+        self.lastTime, seq, line = heapq.heappop(heap)
+        self.releasedTime = self.lastTime
+        return line
+
+def _openSource(fileName):
+    if httpd_log_readahead.isCompressed(fileName):
+        return httpd_log_readahead.ReadAheadReader(fileName)
+    return open(fileName, "rb")
+
+# Reads sources from list file: one source per line, fileName[<TAB>format[<TAB>tag]],
+# empty lines and lines starting with # are skipped
+def readSourceList(fileHandler):
+    sources = []
+    for line in fileHandler:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        sources.append(tuple(part.strip() for part in line.split("\t")))
+    return sources
+
+class iMergedLogStream(object):
+    # sources - file handler of the list file (see readSourceList), or list of file names or (fileName, format) or
+    # (fileName, format, tag) tuples, format is Apache log format (default is format parameter), tag is value of
+    # tagName variable of records of this source (default is file name without directory), other parameters are
+    # passed to stream of every source (see httpd_log_stream)
+    # Returns apache_log record and its source tag
+    def __init__(self, sources, format="common", fields=None, where=None,
+                 window=DEFAULT_WINDOW, maxBuffered=DEFAULT_MAX_BUFFERED, tagName="log_source"):
+        if isinstance(sources, basestring):
+            sources = [sources]
+        elif not isinstance(sources, (list, tuple)):
+            sources = readSourceList(sources)
+        if not sources:
+            raise MiningError("Merged log requires at least one source")
+        self.tagName = tagName
+        self.streams = []
+        self.lines = []
+        self.tags = []
+        self.heap = []
+        self.reported = False
+        for source in sources:
+            if isinstance(source, basestring):
+                source = (source,)
+            fileName = source[0]
+            sourceFormat = source[1] if len(source) > 1 and source[1] else format
+            tag = source[2] if len(source) > 2 else os.path.basename(fileName)
+            lines = ReorderedLines(_openSource(fileName), window, maxBuffered)
+            stream = httpd_log_stream.iApacheLogStream(lines, sourceFormat, fields, where, readAhead=None)
+            self.streams.append(stream)
+            self.lines.append(lines)
+            self.tags.append(tag)
+            self.advance(len(self.streams) - 1)
+
+    # pushes next record of the source to the heap
+    def advance(self, index):
+        try:
+            record = self.streams[index].nextRecord()
+        except StopIteration:
+            self.closeSource(index)
+            return
+        heapq.heappush(self.heap, (self.lines[index].lastTime, index, record))
+
+    def closeSource(self, index):
+        fileHandler = self.lines[index].fileHandler
+        if hasattr(fileHandler, "close"):
+            fileHandler.close()
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if not self.heap:
+            self.reportCounters()
+            raise StopIteration
+        t, index, record = self.heap[0]
+        try:
+            nextRecord = self.streams[index].nextRecord()
+            heapq.heapreplace(self.heap, (self.lines[index].lastTime, index, nextRecord))
+        except StopIteration:
+            heapq.heappop(self.heap)
+            self.closeSource(index)
+        return (record, self.tags[index])
+
+    # closes all sources, merge abandoned before the end should be closed
+    def close(self):
+        for index in range(len(self.streams)):
+            self.closeSource(index)
+        self.heap = []
+        self.reportCounters()
+
+    def getLateLines(self):
+        return sum(lines.lateLines for lines in self.lines)
+
+    # prints counters once, when the merge is exhausted or closed
+    def reportCounters(self):
+        if self.reported:
+            return
+        self.reported = True
+        for stream, tag in zip(self.streams, self.tags):
+            if stream.failed and isVerbose():
+                print "%s: failed to match %d out of %d records" % (tag, stream.failed, stream.total)
+        lateLines = self.getLateLines()
+        if lateLines and isVerbose():
+            print "%d lines were later than reorder window" % lateLines
+
+    def getVariableNames(self):
+        return ["apache_log", self.tagName]
+
+def test():
+    import m.ut_utils as ut
+    import time
+    import random
+    import calendar
+    import tempfile
+    import shutil
+    import gzip
+    ut.START_TEST("httpd_log_merge")
+    rnd = random.Random(14)
+    start = calendar.timegm((2014, 1, 1, 0, 0, 0))
+    directory = tempfile.mkdtemp()
+    formats = ["common", "combined", "%h %>s %b %t \"%r\""]
+    expected = []
+    sources = []
+    try:
+        for n, format in enumerate(formats):
+            entries = []
+            for i in range(3000):
+                t = start + i*3 + n - rnd.randint(0, 20)
+                localtime = time.strftime("%d/%b/%Y:%H:%M:%S +0000", time.gmtime(t))
+                if format == "common":
+                    line = '10.0.%d.1 - - [%s] "GET /%d HTTP/1.1" 200 %d' % (n, localtime, i, i)
+                elif format == "combined":
+                    line = '10.0.%d.1 - - [%s] "GET /%d HTTP/1.1" 200 %d "-" "agent"' % (n, localtime, i, i)
+                else:
+                    line = '10.0.%d.1 200 %d [%s] "GET /%d HTTP/1.1"' % (n, i, localtime, i)
+                entries.append((t, line))
+            fileName = os.path.join(directory, "access%d.log" % n)
+            if n == 2:
+                fileName += ".gz"
+                f = gzip.open(fileName, "wb")
+            else:
+                f = open(fileName, "wb")
+            f.write("".join(line + "\n" for t, line in entries))
+            f.close()
+            sources.append((fileName, format))
+            expected += [(t, "access%d" % n, line) for t, line in entries]
+        expected.sort(key=lambda e: e[0])
+        merged = iMergedLogStream(sources, window=30, fields=["numbytes", "gmtime"])
+        result = [(record.gmtime, tag.split(".")[0], record.line) for record, tag in merged]
+        ut.EXPECT_EQ(len(expected), "len(result)")
+        ut.EXPECT_EQ([t for t, tag, line in expected], "[t for t, tag, line in result]")
+        ut.EXPECT_EQ(sorted(expected), "sorted(result)")
+        ut.EXPECT_EQ(0, "merged.getLateLines()")
+        ut.EXPECT_EQ(True, "merged.reported")
+        ut.EXPECT_EQ(["apache_log", "log_source"], "merged.getVariableNames()")
+        # small window: order is broken only by late lines
+        merged = iMergedLogStream([(fileName, format, "first") for fileName, format in sources[:1]], window=5, maxBuffered=10)
+        records = [record for record, tag in merged]
+        ut.EXPECT_EQ(3000, "len(records)")
+        ut.EXPECT_EQ(True, "merged.getLateLines() > 0")
+        # list file of sources, as passed by the framework
+        listName = os.path.join(directory, "sources.txt")
+        f = open(listName, "wb")
+        f.write("# merged logs\n\n")
+        f.write("".join("%s\t%s\n" % source for source in sources))
+        f.close()
+        f = open(listName, "rb")
+        ut.EXPECT_EQ([(fileName, format) for fileName, format in sources], "readSourceList(f)")
+        f.close()
+        f = open(listName, "rb")
+        merged = iMergedLogStream(f, window=30, fields=["gmtime"])
+        f.close()
+        ut.EXPECT_EQ([t for t, tag, line in expected], "[record.gmtime for record, tag in merged]")
+        ut.EXPECT_EQ(["access0.log", "access1.log", "access2.log.gz"], "merged.tags")
+        # predicates are applied to every source
+        merged = iMergedLogStream(sources, where="numbytes < 10")
+        ut.EXPECT_EQ(30, "len([tag for record, tag in merged])")
+        # abandoned merge stops read-ahead of compressed sources
+        merged = iMergedLogStream(sources)
+        merged.next()
+        merged.close()
+        ut.EXPECT_EQ(False, "merged.lines[2].fileHandler.worker.is_alive()")
+        ut.EXPECT_EQ([], "list(merged)")
+    finally:
+        shutil.rmtree(directory)
+    ut.END_TEST()
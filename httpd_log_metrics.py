@@ -0,0 +1,177 @@
+#
+# Copyright Michael Groys, 2014
+#
+# Metrics of input streams and quarantine of lines that failed to match.
+# Metrics are collected only when requested (stream uses separate loop), they count lines, bytes, matched and failed
+# lines and split parsing time to reading lines (io), matching the format regular expression (match),
+# creating records and checking predicates (record). Timing takes 3 clock reads per line, about 10% of parsing time of "common" format.
+# Snapshot of counters and rates since the previous one is taken every interval seconds, time is checked
+# once per CHECK_LINES lines.
+# Quarantine sink writes failed lines to file, every sample-th failed line (1 - all of them), until maxBytes are written,
+# lines are written only when match fails, so the main path is not affected.
+#
+import time
+import collections
+from m.common import MiningError
+
+CHECK_LINES = 1024
+MAX_SNAPSHOTS = 1000
+DEFAULT_QUARANTINE_MAX_BYTES = 16*1024*1024
+
+class StreamMetrics(object):
+    # interval - seconds between snapshots (None - no snapshots), callback(snapshot) is called for every snapshot
+    def __init__(self, interval=None, callback=None):
+        self.interval = interval
+        self.callback = callback
+        self.lines = 0
+        self.bytes = 0
+        self.matched = 0
+        self.failed = 0
+        self.ioTime = 0.
+        self.matchTime = 0.
+        self.recordTime = 0.
+        self.startTime = time.time()
+        self.nextCheck = CHECK_LINES
+        self.snapshots = collections.deque(maxlen=MAX_SNAPSHOTS)
+        self.lastSnapshot = self.getCounters(self.startTime)
+
+    def getCounters(self, now=None):
+        now = time.time() if now is None else now
+        return {
+            "time": now,
+            "elapsed": now - self.startTime,
+            "lines": self.lines,
+            "bytes": self.bytes,
+            "matched": self.matched,
+            "failed": self.failed,
+            "ioTime": self.ioTime,
+            "matchTime": self.matchTime,
+            "recordTime": self.recordTime,
+        }
+
+    # called by the stream when lines reached nextCheck
+    def check(self):
+        self.nextCheck = self.lines + CHECK_LINES
+        if self.interval is not None:
+            now = time.time()
+            if now - self.lastSnapshot["time"] >= self.interval:
+                self.takeSnapshot(now)
+
+    def takeSnapshot(self, now=None):
+        counters = self.getCounters(now)
+        previous = self.lastSnapshot
+        period = counters["time"] - previous["time"]
+        lines = counters["lines"] - previous["lines"]
+        snapshot = dict(counters)
+        snapshot["period"] = period
+        snapshot["linesPerSec"] = lines / period if period > 0 else 0.
+        snapshot["bytesPerSec"] = (counters["bytes"] - previous["bytes"]) / period if period > 0 else 0.
+        snapshot["failureRate"] = float(counters["failed"] - previous["failed"]) / lines if lines else 0.
+        self.snapshots.append(snapshot)
+        self.lastSnapshot = counters
+        if self.callback:
+            self.callback(snapshot)
+        return snapshot
+
+    def getMetrics(self):
+        metrics = self.getCounters()
+        elapsed = metrics["elapsed"]
+        metrics["linesPerSec"] = self.lines / elapsed if elapsed > 0 else 0.
+        metrics["bytesPerSec"] = self.bytes / elapsed if elapsed > 0 else 0.
+        metrics["failureRate"] = float(self.failed) / self.lines if self.lines else 0.
+        return metrics
+
+    def __str__(self):
+        return ("%(lines)d lines (%(bytes)d bytes), matched %(matched)d, failed %(failed)d (%(failureRate).2f%%), "
+                "%(linesPerSec).0f lines/sec, io %(ioTime).2f sec, match %(matchTime).2f sec, record %(recordTime).2f sec" %
+                dict(self.getMetrics(), failureRate=100. * self.getMetrics()["failureRate"]))
+
+class QuarantineSink(object):
+    # writes every sample-th failed line to fileName (or file object) until maxBytes are written
+    def __init__(self, fileName, sample=1, maxBytes=DEFAULT_QUARANTINE_MAX_BYTES):
+        if sample < 1:
+            raise MiningError("Quarantine sample should be positive, got %s" % sample)
+        if isinstance(fileName, basestring):
+            self.fileHandler = open(fileName, "ab")
+            self.ownFile = True
+        else:
+            self.fileHandler = fileName
+            self.ownFile = False
+        self.sample = int(sample)
+        self.maxBytes = maxBytes
+        self.seen = 0        # failed lines passed to the sink
+        self.written = 0     # lines written
+        self.bytesWritten = 0
+        self.dropped = 0     # sampled lines not written because of size cap
+
+    def add(self, line):
+        self.seen += 1
+        if self.seen % self.sample:
+            return
+        size = len(line) + 1
+        if self.bytesWritten + size > self.maxBytes:
+            self.dropped += 1
+            return
+        self.fileHandler.write(line + "\n")
+        self.written += 1
+        self.bytesWritten += size
+
+    def close(self):
+        if self.ownFile:
+            self.fileHandler.close()
+        else:
+            self.fileHandler.flush()
+
+def test():
+    import m.ut_utils as ut
+    import os
+    import tempfile
+    import StringIO
+    from httpd_log_stream import iNCSALogStream
+    ut.START_TEST("httpd_log_metrics")
+    good = '10.0.0.1 - - [10/Oct/2000:13:55:36 +0000] "GET /path/%d HTTP/1.1" 200 %d'
+    lines = []
+    for i in range(5000):
+        lines.append(good % (i, i) if i % 10 else "bad line %d" % i)
+    data = "\n".join(lines) + "\n"
+    fd, fileName = tempfile.mkstemp(suffix=".log")
+    os.close(fd)
+    try:
+        snapshots = []
+        stream = iNCSALogStream(StringIO.StringIO(data), metrics=0, quarantine=fileName,
+                                quarantineSample=2, quarantineMaxBytes=1000)
+        stream.metrics.callback = snapshots.append
+        records = [r for r, in stream]
+        ut.EXPECT_EQ(4500, "len(records)")
+        metrics = stream.metrics.getMetrics()
+        ut.EXPECT_EQ(5000, "metrics['lines']")
+        ut.EXPECT_EQ(len(data), "metrics['bytes']")
+        ut.EXPECT_EQ(500, "metrics['failed']")
+        ut.EXPECT_EQ(4500, "metrics['matched']")
+        ut.EXPECT_EQ(0.1, "metrics['failureRate']")
+        ut.EXPECT_EQ(True, "metrics['matchTime'] > 0 and metrics['ioTime'] > 0 and metrics['recordTime'] > 0")
+        ut.EXPECT_EQ(5000, "stream.total")
+        ut.EXPECT_EQ(500, "stream.failed")
+        # snapshots are taken once per CHECK_LINES
+        ut.EXPECT_EQ(True, "len(snapshots) >= 3")
+        ut.EXPECT_EQ(True, "all(0 <= s['failureRate'] <= 0.2 for s in snapshots)")
+        quarantined = open(fileName).read().splitlines()
+        ut.EXPECT_EQ(["bad line %d" % i for i in range(10, 5000, 20)][:len(quarantined)], "quarantined")
+        ut.EXPECT_EQ(True, "sum(len(line) + 1 for line in quarantined) <= 1000")
+        ut.EXPECT_EQ(250, "stream.quarantine.written + stream.quarantine.dropped")
+        # without metrics total counts all lines as well
+        stream = iNCSALogStream(StringIO.StringIO(data))
+        ut.EXPECT_EQ(4500, "len([r for r, in stream])")
+        ut.EXPECT_EQ(5000, "stream.total")
+        ut.EXPECT_EQ(None, "stream.metrics")
+        # parallel and cached parsing don't collect them
+        for kwargs in [{"metrics": True, "workers": 2}, {"quarantine": fileName, "cache": True}]:
+            try:
+                iNCSALogStream(open(fileName), **kwargs)
+                error = None
+            except MiningError, e:
+                error = e
+            ut.EXPECT_EQ(True, "error is not None", msg=str(kwargs))
+    finally:
+        os.unlink(fileName)
+    ut.END_TEST()
@@ -0,0 +1,264 @@
+#
+# Copyright Michael Groys, 2014
+#
+# Buffered output of log lines.
+# Lines are collected to buffer of about bufferSize bytes that is written by single call
+# (number of lines in buffer is adjusted by average line length to avoid per line length accounting),
+# compression is chosen by file extension: .gz, .bz2, .zst (requires zstandard module).
+# Uncompressed file is written by print to file object with buffer of bufferSize bytes:
+# C level buffering costs less than any per line python code.
+# With background=True buffers are compressed and written by separate thread, zlib and bz2 release GIL
+# while compressing, so compression overlaps parsing of the input.
+# Lines to stdout are written one by one, so interactive output isn't delayed.
+#
+import sys
+import zlib
+import threading
+import Queue
+from m.common import MiningError
+
+DEFAULT_BUFFER_SIZE = 1024*1024
+DEFAULT_COMPRESS_LEVEL = 6
+INITIAL_FLUSH_LINES = 1024
+# buffers queued to background thread
+MAX_PENDING_BUFFERS = 4
+
+class PlainCompressor(object):
+    def compress(self, data):
+        return data
+    def flush(self):
+        return ""
+
+def createCompressor(fileName, level=None):
+    if level is None:
+        level = DEFAULT_COMPRESS_LEVEL
+    if fileName.endswith(".gz"):
+        # gzip header and trailer
+        return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    elif fileName.endswith(".bz2"):
+        import bz2
+        return bz2.BZ2Compressor(max(1, min(level, 9)))
+    elif fileName.endswith(".zst"):
+        try:
+            import zstandard
+        except ImportError:
+            raise MiningError("zstandard module is required to write '%s'" % fileName)
+        return zstandard.ZstdCompressor(level=level).compressobj()
+    return PlainCompressor()
+
+class FileSink(object):
+    # compresses and writes buffers to the file handler
+    def __init__(self, fileHandler, compressor):
+        self.fileHandler = fileHandler
+        self.compressor = compressor
+        self.bytesWritten = 0    # bytes written to the file (after compression)
+
+    def write(self, data):
+        data = self.compressor.compress(data)
+        if data:
+            self.fileHandler.write(data)
+            self.bytesWritten += len(data)
+
+    def close(self):
+        data = self.compressor.flush()
+        if data:
+            self.fileHandler.write(data)
+            self.bytesWritten += len(data)
+        self.fileHandler.flush()
+
+class BackgroundSink(object):
+    # passes buffers to the sink in separate thread, errors of the thread are raised by next write or close
+    def __init__(self, sink, maxPending=MAX_PENDING_BUFFERS):
+        self.sink = sink
+        self.queue = Queue.Queue(maxPending)
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name="httpd log writer")
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def bytesWritten(self):
+        return self.sink.bytesWritten
+
+    def run(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                break
+            if self.error:
+                continue
+            try:
+                self.sink.write(data)
+            except Exception:
+                self.error = sys.exc_info()
+
+    def raiseError(self):
+        if self.error:
+            error = self.error
+            self.error = None
+            raise error[0], error[1], error[2]
+
+    def write(self, data):
+        self.raiseError()
+        self.queue.put(data)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.raiseError()
+        self.sink.close()
+
+class LineWriter(object):
+    def __init__(self, fileName, bufferSize=DEFAULT_BUFFER_SIZE, compressLevel=None, background=False):
+        self.fileName = fileName
+        self.direct = False     # lines are printed to fileHandler
+        if fileName == "stdout":
+            self.fileHandler = sys.stdout
+            compressor = PlainCompressor()
+        else:
+            compressor = createCompressor(fileName, compressLevel)
+            if isinstance(compressor, PlainCompressor) and not background:
+                self.direct = True
+                self.fileHandler = open(fileName, "wb", bufferSize)
+            else:
+                self.fileHandler = open(fileName, "wb")
+        self.sink = FileSink(self.fileHandler, compressor)
+        if background:
+            self.sink = BackgroundSink(self.sink)
+        self.bufferSize = bufferSize
+        self.lines = []         # buffered lines, callers may append to it and call flush() when flushLines are buffered
+        # stdout is written by every line
+        self.lineBuffered = fileName == "stdout"
+        self.flushLines = 1 if self.lineBuffered else INITIAL_FLUSH_LINES
+        self.linesWritten = 0
+        self.bytesWritten = 0   # uncompressed bytes
+
+    def writeLine(self, line):
+        if self.direct:
+            print >>self.fileHandler, line
+            self.linesWritten += 1
+            return
+        self.lines.append(line)
+        if len(self.lines) >= self.flushLines:
+            self.flush()
+
+    def writeLines(self, lines):
+        if self.direct:
+            for line in lines:
+                self.writeLine(line)
+            return
+        self.lines.extend(lines)
+        if len(self.lines) >= self.flushLines:
+            self.flush()
+
+    def flush(self):
+        if self.direct:
+            self.bytesWritten = self.fileHandler.tell()
+            return
+        if not self.lines:
+            return
+        numLines = len(self.lines)
+        self.lines.append("")
+        data = "\n".join(self.lines)
+        self.lines = []
+        self.linesWritten += numLines
+        self.bytesWritten += len(data)
+        if not self.lineBuffered:
+            self.flushLines = max(1, self.bufferSize * numLines // len(data))
+        self.sink.write(data)
+
+    @property
+    def compressedBytesWritten(self):
+        if self.direct:
+            return self.bytesWritten
+        return self.sink.bytesWritten
+
+    def close(self):
+        try:
+            self.flush()
+            self.sink.close()
+        finally:
+            if self.fileHandler is not sys.stdout:
+                self.fileHandler.close()
+
+def test():
+    import m.ut_utils as ut
+    import os
+    import gzip
+    import bz2
+    import tempfile
+    ut.START_TEST("httpd_log_output")
+    lines = ['10.0.0.%d - - [10/Oct/2000:13:55:36 +0000] "GET /path/%d HTTP/1.1" 200 %d' % (i%256, i, i) for i in range(20000)]
+    expectedBytes = sum(len(line) + 1 for line in lines)
+    readers = {"": open, ".gz": gzip.open, ".bz2": bz2.BZ2File}
+    for extension, reader in readers.iteritems():
+        for background in [False, True]:
+            fd, fileName = tempfile.mkstemp(suffix=".log" + extension)
+            os.close(fd)
+            try:
+                writer = LineWriter(fileName, bufferSize=64*1024, background=background)
+                writer.writeLines(lines)
+                writer.close()
+                msg = "extension=%s background=%s" % (extension, background)
+                ut.EXPECT_EQ(lines, "reader(fileName, 'rb').read().split('\\n')[:-1]", msg=msg)
+                ut.EXPECT_EQ(len(lines), "writer.linesWritten", msg=msg)
+                ut.EXPECT_EQ(expectedBytes, "writer.bytesWritten", msg=msg)
+                ut.EXPECT_EQ(os.path.getsize(fileName), "writer.compressedBytesWritten", msg=msg)
+            finally:
+                os.unlink(fileName)
+    # output target
+    import StringIO
+    from httpd_log_stream import iNCSALogStream, oNCSALogStream
+    fd, fileName = tempfile.mkstemp(suffix=".log.gz")
+    os.close(fd)
+    try:
+        output = oNCSALogStream(fileName, ["ncsa_log"], background=True)
+        for record in iNCSALogStream(StringIO.StringIO("\n".join(lines[:100]) + "\n")):
+            output.save(record)
+        ut.EXPECT_EQ(100, "output.linesWritten")
+        ut.EXPECT_EQ(sum(len(line) + 1 for line in lines[:100]), "output.bytesWritten")
+        output.close()
+        ut.EXPECT_EQ(lines[:100], "gzip.open(fileName).read().split('\\n')[:-1]")
+    finally:
+        os.unlink(fileName)
+    fd, fileName = tempfile.mkstemp(suffix=".log")
+    os.close(fd)
+    os.unlink(fileName)
+    # errors of background thread are raised by the caller
+    writer = LineWriter(fileName, background=True)
+    writer.fileHandler.close()
+    writer.writeLine("line")
+    try:
+        writer.close()
+        error = None
+    except ValueError, e:
+        error = e
+    ut.EXPECT_EQ(True, "error is not None")
+    os.unlink(fileName)
+    # file is closed even if the sink failed
+    writer = LineWriter(fileName, background=True)
+    writer.sink.sink.compressor = None
+    writer.writeLine("line")
+    try:
+        writer.close()
+        error = None
+    except AttributeError, e:
+        error = e
+    ut.EXPECT_EQ(True, "error is not None")
+    ut.EXPECT_EQ(True, "writer.fileHandler.closed")
+    os.unlink(fileName)
+    # stdout is written by every line
+    stdout = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    try:
+        writer = LineWriter("stdout")
+        writer.writeLine(lines[0])
+        written = sys.stdout.getvalue()
+        writer.writeLines(lines[1:3])
+        writer.close()
+        output = sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+    ut.EXPECT_EQ(lines[0] + "\n", "written")
+    ut.EXPECT_EQ("".join(line + "\n" for line in lines[:3]), "output")
+    ut.END_TEST()
@@ -0,0 +1,271 @@
+#
+# Copyright Michael Groys, 2014
+#
+# Parallel parsing of single uncompressed log file.
+# File is split to byte ranges, every range owns the lines that start inside it.
+# Ranges are parsed in the process pool, every worker creates its own format object
+# and sends back matched lines as single string with flat array of group spans:
+# pickling tuples of group values costs more than the match itself.
+# At most PENDING_PER_WORKER chunks per worker are submitted ahead of the consumer, so memory of parsed chunks
+# is bounded when workers are faster than the consumer.
+#
+import os
+import array
+import itertools
+import collections
+import multiprocessing
+from m.common import MiningError
+from httpd_log_format import SpanMatch
+import httpd_log_filter
+import httpd_log_sample
+
+DEFAULT_CHUNK_SIZE = 32*1024*1024
+PENDING_PER_WORKER = 2
+# wait time for any chunk to complete in unordered mode
+POLL_INTERVAL = 0.01
+COMPRESSED_EXTENSIONS = (".gz", ".bz2", ".zst", ".xz", ".lzma", ".zip")
+
+# Returns lines starting inside [start, end) byte range of the file
+def readRange(fileName, start, end):
+    f = open(fileName, "rb")
+    try:
+        if start > 0:
+            f.seek(start-1)
+            if f.read(1) != "\n":
+                # line is owned by the previous range
+                f.readline()
+            start = f.tell()
+        if start >= end:
+            return []
+        data = f.read(end - start)
+        if data and not data.endswith("\n"):
+            data += f.readline()
+    finally:
+        f.close()
+    lines = data.split("\n")
+    if lines[-1] == "":
+        lines.pop()
+    return lines
+
+def splitFile(fileName, chunkSize):
+    size = os.path.getsize(fileName)
+    return [(start, min(start+chunkSize, size)) for start in xrange(0, size, chunkSize)]
+
+class ChunkResult(object):
+    def __init__(self):
+        self.text = ""    # matched lines joined by new line
+        self.spans = ""   # array of group spans (match.regs) of every line as string
+        self.numGroups = 0
+        self.failed = 0
+        self.total = 0
+        self.prefiltered = 0
+        self.parsed = 0
+        self.filtered = 0
+        self.sampledOut = 0
+
+# per process parser state, initialized by _initWorker
+_worker = None
+
+class ChunkParser(object):
+    def __init__(self, fileName, formatClass, formatArgs, recordClass, where, sampleArgs=None):
+        self.fileName = fileName
+        self.formatObj = formatClass(*formatArgs)
+        self.recordClass = recordClass
+        self.lineFilter = httpd_log_filter.LineFilter(self.formatObj, where) if where else None
+        self.sampler = httpd_log_sample.LineSampler(self.formatObj, *sampleArgs) if sampleArgs else None
+
+    def parse(self, byteRange):
+        result = ChunkResult()
+        match = self.formatObj.match
+        lineFilter = self.lineFilter
+        checkLine = self.sampler.checkLine if self.sampler else None
+        checkMatch = self.sampler.checkMatch if self.sampler else None
+        matched = []
+        regs = []
+        lines = readRange(self.fileName, byteRange[0], byteRange[1])
+        result.total = len(lines)
+        for line in lines:
+            if checkLine and not checkLine(line):
+                result.sampledOut += 1
+                continue
+            if lineFilter and not lineFilter.prefilter(line):
+                result.prefiltered += 1
+                continue
+            m = match(line)
+            if not m:
+                result.failed += 1
+                continue
+            if checkMatch and not checkMatch(m):
+                result.sampledOut += 1
+                continue
+            if lineFilter:
+                result.parsed += 1
+                if not lineFilter.check(self.recordClass(self.formatObj, line, m)):
+                    result.filtered += 1
+                    continue
+            matched.append(line)
+            regs.append(m.regs)
+        chain = itertools.chain.from_iterable
+        spans = array.array("i")
+        spans.fromlist(list(chain(chain(regs))))
+        result.text = "\n".join(matched)
+        result.spans = spans.tostring()
+        result.numGroups = self.formatObj.regexp.groups + 1
+        return result
+
+# Iterates over (line, match) of the parsed chunk
+def iterChunk(result):
+    spans = array.array("i")
+    spans.fromstring(result.spans)
+    if not spans:
+        return
+    step = 2*result.numGroups
+    offset = 0
+    for line in result.text.split("\n"):
+        yield line, SpanMatch(line, spans, offset)
+        offset += step
+
+def _initWorker(*args):
+    global _worker
+    _worker = ChunkParser(*args)
+
+def _parseChunk(byteRange):
+    return _worker.parse(byteRange)
+
+class ParallelParser(object):
+    # Iterates over (line, match) of the file, parsed by formatClass(*formatArgs) in worker processes.
+    # If ordered is False, chunks are returned in order of completion
+    # sampleArgs - (fraction, key, seed) of httpd_log_sample.LineSampler, lines are sampled by workers
+    def __init__(self, fileName, formatClass, formatArgs, recordClass, workers=None, chunkSize=DEFAULT_CHUNK_SIZE, ordered=True, where=None,
+                 sampleArgs=None):
+        if not fileName or not os.path.isfile(fileName):
+            raise MiningError("Parallel parsing requires regular file, got '%s'" % fileName)
+        if fileName.endswith(COMPRESSED_EXTENSIONS):
+            raise MiningError("Parallel parsing is not supported for compressed file '%s'" % fileName)
+        self.workers = int(workers) if workers else multiprocessing.cpu_count()
+        self.chunkSize = int(chunkSize)
+        if self.chunkSize <= 0:
+            raise MiningError("Chunk size should be positive")
+        self.failed = 0
+        self.total = 0
+        self.prefiltered = 0
+        self.parsed = 0
+        self.filtered = 0
+        self.sampledOut = 0
+        self.pool = multiprocessing.Pool(self.workers, _initWorker, (fileName, formatClass, formatArgs, recordClass, where, sampleArgs))
+        self.ranges = iter(splitFile(fileName, self.chunkSize))
+        self.ordered = ordered
+        self.maxPending = PENDING_PER_WORKER * self.workers
+        self.pending = collections.deque()  # AsyncResult of submitted chunks in order of ranges
+        self.current = iter([])
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        while True:
+            try:
+                return self.current.next()
+            except StopIteration:
+                pass
+            try:
+                result = self.nextResult()
+            except StopIteration:
+                self.close()
+                raise
+            except:
+                self.terminate()
+                raise
+            self.failed += result.failed
+            self.total += result.total
+            self.prefiltered += result.prefiltered
+            self.parsed += result.parsed
+            self.filtered += result.filtered
+            self.sampledOut += result.sampledOut
+            self.current = iterChunk(result)
+
+    # returns ChunkResult of the next chunk, in order of ranges or of completion
+    def nextResult(self):
+        if self.pool is None:
+            raise StopIteration
+        pending = self.pending
+        while len(pending) < self.maxPending:
+            byteRange = next(self.ranges, None)
+            if byteRange is None:
+                break
+            pending.append(self.pool.apply_async(_parseChunk, (byteRange,)))
+        if not pending:
+            raise StopIteration
+        if self.ordered:
+            return pending.popleft().get()
+        while True:
+            for asyncResult in pending:
+                if asyncResult.ready():
+                    pending.remove(asyncResult)
+                    return asyncResult.get()
+            pending[0].wait(POLL_INTERVAL)
+
+    # waits for workers when all chunks are parsed, stops them if parsing is abandoned
+    def close(self):
+        if self.pool:
+            if self.pending or next(self.ranges, None) is not None:
+                self.terminate()
+                return
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def terminate(self):
+        if self.pool:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+            self.pending.clear()
+            self.current = iter([])
+
+def test():
+    import m.ut_utils as ut
+    import tempfile
+    from apache_log import ApacheLogFormat, ApacheLogRecord
+    ut.START_TEST("httpd_log_parallel")
+    lines = []
+    for i in range(200):
+        if i % 17 == 3:
+            lines.append("garbage %d" % i)
+        else:
+            lines.append('10.0.0.%d - - [10/Oct/2000:13:55:%02d +0000] "GET /path/%d HTTP/1.1" %d %d "-" "agent %d"' % (i%256, i%60, i, 200 + i%4*100, i, i))
+    fd, fileName = tempfile.mkstemp(suffix=".log")
+    os.write(fd, "\n".join(lines))
+    os.close(fd)
+    try:
+        alf = ApacheLogFormat("combined")
+        groups = range(alf.regexp.groups + 1)
+        expected = [(line, [alf.match(line).group(g) for g in groups]) for line in lines if alf.match(line)]
+        for chunkSize in [1, 97, 1000, 100000]:
+            parser = ParallelParser(fileName, ApacheLogFormat, ("combined",), ApacheLogRecord, workers=3, chunkSize=chunkSize)
+            result = [(line, [m.group(g) for g in groups]) for line, m in parser]
+            ut.EXPECT_EQ(expected, "result", msg="chunkSize=%d" % chunkSize)
+            ut.EXPECT_EQ(len(lines), "parser.total")
+            ut.EXPECT_EQ(len(lines) - len(expected), "parser.failed")
+        parser = ParallelParser(fileName, ApacheLogFormat, ("combined",), ApacheLogRecord, workers=2, chunkSize=500, ordered=False, where="status>=400")
+        result = sorted((line, [m.group(g) for g in groups]) for line, m in parser)
+        expected = sorted(m for m in expected if int(m[1][alf.fieldToGroupId[ApacheLogFormat.FLD_STATUS]]) >= 400)
+        ut.EXPECT_EQ(expected, "result")
+        ut.EXPECT_EQ(len(expected), "parser.parsed - parser.filtered")
+        # chunks are submitted by bounded window, abandoned parser stops its workers
+        parser = ParallelParser(fileName, ApacheLogFormat, ("combined",), ApacheLogRecord, workers=2, chunkSize=97)
+        parser.next()
+        ut.EXPECT_EQ(True, "0 < len(parser.pending) <= 4")
+        pool = parser.pool
+        parser.close()
+        ut.EXPECT_EQ(None, "parser.pool")
+        ut.EXPECT_EQ([], "[p for p in pool._pool if p.is_alive()]")
+        ut.EXPECT_EQ(None, "next(parser, None)")
+        from httpd_log_stream import iApacheLogStream
+        stream = iApacheLogStream(open(fileName), "combined", workers=2, chunkSize=97)
+        stream.next()
+        stream.close()
+        ut.EXPECT_EQ(None, "stream.parallelParser.pool")
+    finally:
+        os.unlink(fileName)
+    ut.END_TEST()
@@ -0,0 +1,279 @@
+#
+# Copyright Michael Groys, 2014
+#
+# Read-ahead decompression of compressed log files.
+# File is decompressed by zlib/bz2 decompressor objects in background thread (both release GIL while
+# decompressing) or in separate process, into bounded queue of blocks of complete lines,
+# so decompression of the next blocks overlaps parsing of the current one.
+# Multi-member gzip and multi-stream bz2 files (concatenated archives) are supported.
+# Wait counters show the bottleneck: if the decompressor waits for free queue slot, the parser is slower,
+# if the parser waits for the next block, decompression is slower.
+#
+import sys
+import time
+import zlib
+import Queue
+import threading
+from m.common import MiningError
+
+COMPRESSED_EXTENSIONS = (".gz", ".bz2")
+DEFAULT_BLOCK_SIZE = 1024*1024
+DEFAULT_MAX_BLOCKS = 8
+READ_SIZE = 256*1024
+# seconds close() waits for the decompressor to stop, daemon thread that is still decompressing is left behind
+CLOSE_TIMEOUT = 1.0
+MODES = ("thread", "process")
+
+def isCompressed(fileName):
+    return bool(fileName) and fileName.endswith(COMPRESSED_EXTENSIONS)
+
+def _createDecompressor(fileName):
+    if fileName.endswith(".gz"):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif fileName.endswith(".bz2"):
+        import bz2
+        return bz2.BZ2Decompressor()
+    raise MiningError("Unknown compression of '%s'" % fileName)
+
+# Iterates over decompressed data of the file
+def iterDecompressed(fileName, readSize=READ_SIZE):
+    f = open(fileName, "rb")
+    try:
+        decompressor = _createDecompressor(fileName)
+        while True:
+            raw = f.read(readSize)
+            if not raw:
+                break
+            while raw:
+                data = decompressor.decompress(raw)
+                if data:
+                    yield data
+                raw = decompressor.unused_data
+                if raw:
+                    # next member of concatenated archive
+                    if not raw.strip("\0"):
+                        break
+                    decompressor = _createDecompressor(fileName)
+        if hasattr(decompressor, "flush"):
+            data = decompressor.flush()
+            if data:
+                yield data
+    finally:
+        f.close()
+
+# Iterates over blocks of complete lines (without the last new line) of at least blockSize bytes
+def iterBlocks(fileName, blockSize=DEFAULT_BLOCK_SIZE):
+    pending = []
+    pendingSize = 0
+    for data in iterDecompressed(fileName):
+        pending.append(data)
+        pendingSize += len(data)
+        if pendingSize >= blockSize:
+            data = "".join(pending)
+            # decompressed chunk may be much larger than block (e.g. whole bz2 block)
+            start = 0
+            while len(data) - start >= blockSize:
+                end = data.find("\n", start + blockSize - 1)
+                if end < 0:
+                    break
+                yield data[start:end]
+                start = end + 1
+            pending = [data[start:]]
+            pendingSize = len(pending[0])
+    data = "".join(pending)
+    if data.endswith("\n"):
+        data = data[:-1]
+    if data:
+        yield data
+
+class WaitCounter(object):
+    def __init__(self):
+        self.waits = 0
+        self.waitTime = 0.
+
+# puts item to the queue, measures time it was blocked
+def _put(queue, item, counter, stopped=None):
+    try:
+        queue.put_nowait(item)
+        return
+    except Queue.Full:
+        pass
+    start = time.time()
+    counter.waits += 1
+    while True:
+        try:
+            queue.put(item, True, 0.1)
+            break
+        except Queue.Full:
+            if stopped and stopped.is_set():
+                break
+    counter.waitTime += time.time() - start
+
+def _produce(fileName, blockSize, queue, counter, stopped=None):
+    try:
+        for block in iterBlocks(fileName, blockSize):
+            if stopped and stopped.is_set():
+                return
+            _put(queue, block, counter, stopped)
+        _put(queue, ("end", counter.waits, counter.waitTime), counter, stopped)
+    except Exception, e:
+        _put(queue, ("error", "%s: %s" % (e.__class__.__name__, e)), counter, stopped)
+
+def _produceInProcess(fileName, blockSize, queue):
+    _produce(fileName, blockSize, queue, WaitCounter())
+
+class ReadAheadReader(object):
+    # Iterates over lines of compressed file decompressed by background thread or process (mode)
+    def __init__(self, fileName, mode="thread", blockSize=DEFAULT_BLOCK_SIZE, maxBlocks=DEFAULT_MAX_BLOCKS):
+        if mode not in MODES:
+            raise MiningError("Unknown read-ahead mode '%s', expected one of: %s" % (mode, ", ".join(MODES)))
+        if not isCompressed(fileName):
+            raise MiningError("Read-ahead decompression requires compressed file, got '%s'" % fileName)
+        self.name = fileName
+        self.mode = mode
+        self.lines = iter([])
+        self.finished = False
+        self.blocks = 0
+        self.bytes = 0
+        self.decompressorCounter = WaitCounter()  # decompressor waits for the parser
+        self.parserCounter = WaitCounter()        # parser waits for the decompressor
+        self.stopped = threading.Event()
+        if mode == "process":
+            import multiprocessing
+            self.queue = multiprocessing.Queue(maxBlocks)
+            self.worker = multiprocessing.Process(target=_produceInProcess, args=(fileName, blockSize, self.queue))
+        else:
+            self.queue = Queue.Queue(maxBlocks)
+            self.worker = threading.Thread(target=_produce, args=(fileName, blockSize, self.queue, self.decompressorCounter, self.stopped))
+        self.worker.daemon = True
+        self.worker.start()
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        try:
+            return self.lines.next()
+        except StopIteration:
+            pass
+        while True:
+            if self.finished:
+                raise StopIteration
+            block = self.getBlock()
+            if isinstance(block, tuple):
+                if block[0] == "error":
+                    self.finished = True
+                    self.close()
+                    raise MiningError("Failed to decompress '%s': %s" % (self.name, block[1]))
+                self.finished = True
+                self.decompressorCounter.waits = block[1]
+                self.decompressorCounter.waitTime = block[2]
+                self.close()
+                raise StopIteration
+            self.blocks += 1
+            self.bytes += len(block) + 1
+            self.lines = iter(block.split("\n"))
+            return self.lines.next()
+
+    def getBlock(self):
+        try:
+            return self.queue.get_nowait()
+        except Queue.Empty:
+            pass
+        start = time.time()
+        self.parserCounter.waits += 1
+        block = self.queue.get()
+        self.parserCounter.waitTime += time.time() - start
+        return block
+
+    # "parser" if decompression is faster than parsing, "decompressor" otherwise
+    def getBottleneck(self):
+        if self.decompressorCounter.waitTime > self.parserCounter.waitTime:
+            return "parser"
+        return "decompressor"
+
+    def getCounters(self):
+        return {
+            "blocks": self.blocks,
+            "bytes": self.bytes,
+            "decompressorWaits": self.decompressorCounter.waits,
+            "decompressorWaitTime": self.decompressorCounter.waitTime,
+            "parserWaits": self.parserCounter.waits,
+            "parserWaitTime": self.parserCounter.waitTime,
+            "bottleneck": self.getBottleneck(),
+        }
+
+    # stops the decompressor, reader stopped before the end of data should be closed too
+    def close(self):
+        self.finished = True
+        self.lines = iter([])
+        self.stopped.set()
+        if self.mode == "process" and self.worker.is_alive():
+            self.worker.terminate()
+        self.worker.join(CLOSE_TIMEOUT)
+
+def test():
+    import m.ut_utils as ut
+    import os
+    import gzip
+    import bz2
+    import tempfile
+    ut.START_TEST("httpd_log_readahead")
+    lines = ['10.0.0.%d - - [10/Oct/2000:13:55:36 +0000] "GET /path/%d HTTP/1.1" 200 %d' % (i%256, i, i) for i in range(30000)]
+    data = "\n".join(lines) + "\n"
+    files = []
+    try:
+        # concatenated gzip members
+        fd, fileName = tempfile.mkstemp(suffix=".log.gz")
+        os.close(fd)
+        for start, end in [(0, 10000), (10000, 30000)]:
+            f = gzip.open(fileName, "ab")
+            f.write(data[sum(len(line)+1 for line in lines[:start]):sum(len(line)+1 for line in lines[:end])])
+            f.close()
+        files.append(fileName)
+        fd, fileName = tempfile.mkstemp(suffix=".log.bz2")
+        os.write(fd, bz2.compress(data))
+        os.close(fd)
+        files.append(fileName)
+        for fileName in files:
+            for mode in MODES:
+                msg = "%s %s" % (fileName[-4:], mode)
+                reader = ReadAheadReader(fileName, mode, blockSize=64*1024, maxBlocks=2)
+                ut.EXPECT_EQ(lines, "list(reader)", msg=msg)
+                counters = reader.getCounters()
+                ut.EXPECT_EQ(len(data), "counters['bytes']", msg=msg)
+                ut.EXPECT_EQ(True, "counters['blocks'] > 1 and counters['bottleneck'] in ('parser', 'decompressor')", msg=msg)
+        # stream decompresses by itself and closes the original file
+        from httpd_log_stream import iNCSALogStream
+        original = open(files[0], "rb")
+        stream = iNCSALogStream(original, fields="numbytes", readAhead="thread")
+        ut.EXPECT_EQ(True, "original.closed")
+        ut.EXPECT_EQ(range(30000), "[r.numbytes for r, in stream]")
+        ut.EXPECT_EQ(True, "stream.readAhead.finished")
+        ut.EXPECT_EQ(None, "iNCSALogStream(open(files[0], 'rb')).readAhead")
+        # abandoned reader stops the decompressor
+        for mode in MODES:
+            stream = iNCSALogStream(open(files[1], "rb"), fields="numbytes", readAhead=mode)
+            stream.next()
+            stream.close()
+            ut.EXPECT_EQ(False, "stream.readAhead.worker.is_alive()", msg=mode)
+            ut.EXPECT_EQ([], "[r for r, in stream]", msg=mode)
+        # last line without new line, broken archive
+        fd, fileName = tempfile.mkstemp(suffix=".log.gz")
+        os.write(fd, zlib.compress("a\nb"))
+        os.close(fd)
+        files.append(fileName)
+        try:
+            list(ReadAheadReader(fileName))
+            error = None
+        except MiningError, e:
+            error = e
+        ut.EXPECT_EQ(True, "error is not None")
+        f = gzip.open(fileName, "wb")
+        f.write("a\nb")
+        f.close()
+        ut.EXPECT_EQ(["a", "b"], "list(ReadAheadReader(fileName))")
+    finally:
+        for fileName in files:
+            os.unlink(fileName)
+    ut.END_TEST()
@@ -0,0 +1,233 @@
+#
+# Copyright Michael Groys, 2014
+#
+# Rendering of parsed records in another Apache log format.
+# Target format is split to literals and directives by the same template pattern that parses it,
+# every directive is rendered from the group of the source format that holds the same field
+# (ApacheLogFormat.fieldReferences), with fixed literals of the directive pattern around it, like "[...]" of %t.
+# Renderer is compiled once per source format to a function that formats the template with match groups,
+# so rendering costs about the same as writing the original line.
+# Directives that are not available in the source are derived from other fields when possible
+# (%D from %T, %r from %m %U%q %H), otherwise rendered as "-" (or "0" if pattern doesn't accept "-").
+#
+import re
+from m.common import MiningError
+from ncsa_log import NCSALogFormat
+from apache_log import ApacheLogFormat
+from httpd_log_template import getOuterGroup
+from httpd_log_format import FieldNotDefinedException
+
+# conversions of group value for the directive, when the field is captured by other directive of the source
+CONVERSIONS = {
+    "B": '("0" if %(value)s == "-" else %(value)s)',
+    "b": '("-" if %(value)s == "0" else %(value)s)',
+}
+
+# directive -> (required source directives fields, function of record)
+def _usecFromSec(record):
+    return str(record.durationSec * 1000000)
+
+def _secFromUsec(record):
+    return str(record.durationUsec // 1000000)
+
+def _requestFromParts(record):
+    return "%s %s%s %s" % (record.method, record.urlPath, record.queryString, record.protocol)
+
+DERIVATIONS = {
+    "D": ([ApacheLogFormat.FLD_DURATION_SEC], _usecFromSec),
+    "T": ([ApacheLogFormat.FLD_DURATION_USEC], _secFromUsec),
+    "r": ([NCSALogFormat.FLD_METHOD, NCSALogFormat.FLD_URL_PATH, NCSALogFormat.FLD_QUERY_STRING, NCSALogFormat.FLD_PROTOCOL], _requestFromParts),
+}
+
+def getMissingValue(pattern, prefix, suffix):
+    for value in ["-", "0"]:
+        if re.match("(?:%s)$" % pattern, prefix + value + suffix):
+            return value
+    return "-"
+
+# returns attribute of the record or None, materialized and cached records raise FieldNotDefinedException
+# for attributes they don't hold
+def _getRecordAttr(record, name):
+    try:
+        return getattr(record, name, None)
+    except FieldNotDefinedException:
+        return None
+
+def _getGroupId(sourceFormat, fieldId):
+    groups = sourceFormat.fieldToGroupId
+    return groups[fieldId] if fieldId < len(groups) else None
+
+class RenderTemplate(object):
+    def __init__(self, formatStr):
+        self.formatStr = ApacheLogFormat.predefinedFormats.get(formatStr, formatStr)
+        # validates the format
+        self.targetFormat = ApacheLogFormat(self.formatStr)
+        self.items = self.parseTemplate()
+        # source format -> compiled render function
+        self.renderFunctions = {}
+
+    # returns list of literals and directive names
+    def parseTemplate(self):
+        formatObj = self.targetFormat
+        items = []
+        literal = ""
+        pos = 0
+        for mo in formatObj.pattern.finditer(formatObj.template):
+            literal += formatObj.template[pos:mo.start()]
+            pos = mo.end()
+            if mo.group("escaped") is not None:
+                literal += formatObj.delimiter
+                continue
+            field = mo.group("named") or mo.group("braced")
+            if field is None:
+                raise MiningError("Invalid directive at position %d of format '%s'" % (mo.start(), self.formatStr))
+            items.append((literal, field))
+            literal = ""
+        items.append((literal + formatObj.template[pos:], None))
+        return items
+
+    # returns (prefix, groupId, conversion, suffix) of the directive, conversion is expression template
+    # of the group value, or function of the record if groupId is None, directive is not available if both are None
+    def compileDirective(self, directive, sourceFormat):
+        pattern = self.targetFormat.getPattern(directive, None)
+        if pattern is None:
+            return "", None, None, "-"
+        outerGroup = getOuterGroup(pattern)
+        prefix, suffix = (outerGroup[0], outerGroup[2]) if outerGroup else ("", "")
+        groupId = None
+        conversion = None
+        refs = ApacheLogFormat.fieldReferences.get(directive)
+        if refs:
+            groupId = _getGroupId(sourceFormat, refs[0][1])
+            if groupId is not None and sourceFormat.regexp.groupindex.get(refs[0][0]) != groupId:
+                conversion = CONVERSIONS.get(directive)
+        elif directive.startswith("{") and directive.endswith("}i"):
+            groupId = getattr(sourceFormat, "inputHdrFields", {}).get(directive[1:-2])
+        elif directive.startswith("{") and directive.endswith("}o"):
+            groupId = getattr(sourceFormat, "outputHdrFields", {}).get(directive[1:-2])
+        if groupId is not None:
+            return prefix, groupId, conversion, suffix
+        if directive in DERIVATIONS:
+            fieldIds, derive = DERIVATIONS[directive]
+            if all(_getGroupId(sourceFormat, fieldId) is not None for fieldId in fieldIds):
+                return prefix, None, derive, suffix
+        return "", None, None, prefix + getMissingValue(pattern, prefix, suffix) + suffix
+
+    # compiles function(record) that renders records parsed by sourceFormat:
+    # all groups are read by single match.group() call and formatted by single % operation
+    def compile(self, sourceFormat):
+        constants = []
+        template = []
+        groupIds = []
+        exprs = []
+        for literal, directive in self.items:
+            template.append(literal.replace("%", "%%"))
+            if directive is None:
+                continue
+            prefix, groupId, function, suffix = self.compileDirective(directive, sourceFormat)
+            if groupId is None and function is None:
+                template.append(suffix.replace("%", "%%"))
+                continue
+            template.append(prefix.replace("%", "%%") + "%s" + suffix.replace("%", "%%"))
+            if groupId is not None:
+                expr = "g[%d]" % len(groupIds)
+                groupIds.append(groupId)
+                if function:
+                    expr = function % {"value": expr}
+            else:
+                constants.append(function)
+                expr = "c%d(record)" % (len(constants) - 1)
+            exprs.append(expr)
+        namespace = dict(("c%d" % i, c) for i, c in enumerate(constants))
+        template = "".join(template)
+        lines = ["def render(record):"]
+        if len(groupIds) == 1:
+            lines.append("    g = (record._match.group(%d),)" % groupIds[0])
+        elif groupIds:
+            lines.append("    g = record._match.group(%s)" % ", ".join(map(str, groupIds)))
+        if exprs == ["g[%d]" % i for i in range(len(groupIds))] and len(groupIds) > 1:
+            lines.append("    return %r %% g" % template)
+        else:
+            lines.append("    return %r %% (%s)" % (template, "".join(e + ", " for e in exprs)))
+        exec "\n".join(lines) + "\n" in namespace
+        return namespace["render"]
+
+    def render(self, record):
+        sourceFormat = _getRecordAttr(record, "_format")
+        if sourceFormat is None or _getRecordAttr(record, "_match") is None:
+            raise MiningError("Only parsed records can be rendered in format '%s'" % self.formatStr)
+        renderFunction = self.renderFunctions.get(sourceFormat)
+        if renderFunction is None:
+            renderFunction = self.renderFunctions[sourceFormat] = self.compile(sourceFormat)
+        return renderFunction(record)
+
+def test():
+    import m.ut_utils as ut
+    from apache_log import ApacheLogRecord, FieldNotDefinedException
+    ut.START_TEST("httpd_log_render")
+    lines = [
+        '127.0.0.1 - frank [10/Oct/2000:13:55:36 -0700] "GET /apache_pb.gif?a=1&b=%20 HTTP/1.0" 200 2326 "http://www.example.com/start.html" "Mozilla/4.08 [en] (Win98; I ;Nav)"',
+        '10.0.0.1 - - [01/Jan/2014:00:00:01 +0200] "POST http://host.com/api HTTP/1.1" 503 - "-" "curl/7.0"',
+    ]
+    combined = ApacheLogFormat("combined")
+    records = [ApacheLogRecord(combined, line) for line in lines]
+    # same format renders original line
+    template = RenderTemplate("combined")
+    ut.EXPECT_EQ(lines, "[template.render(r) for r in records]")
+    fields = ["gmtime", "gmtoffset", "remoteHost", "status", "numbytes", "urlPath", "queryString", "method", "protocol", "userAgent", "referer"]
+    for targetStr in ["%t %h %>s %D %U", "%h %t %m %U%q %H %>s %B %T \"%{User-agent}i\" \"%{Referer}i\" 100%% %{X-Missing}i",
+                      "%h %l %u %t \"%r\" %>s %b"]:
+        template = RenderTemplate(targetStr)
+        target = ApacheLogFormat(targetStr)
+        for record in records:
+            rendered = template.render(record)
+            parsed = ApacheLogRecord(target, rendered)
+            ut.EXPECT_EQ(True, "parsed._match is not None", msg=rendered)
+            for field in fields:
+                try:
+                    value = getattr(parsed, field)
+                except FieldNotDefinedException:
+                    continue
+                ut.EXPECT_EQ(getattr(record, field), "value", msg="%s: %s" % (targetStr, field))
+    ut.EXPECT_EQ('[10/Oct/2000:13:55:36 -0700] 127.0.0.1 200 0 /apache_pb.gif', "RenderTemplate('%t %h %>s %D %U').render(records[0])")
+    ut.EXPECT_EQ('10.0.0.1 0 - 100%', "RenderTemplate('%h %B %{X-Missing}i 100%%').render(records[1])")
+    # records of several source formats are rendered by their own compiled functions
+    template = RenderTemplate("%h %>s")
+    parts = ApacheLogFormat("%>s %h")
+    mixed = [records[0], ApacheLogRecord(parts, "404 1.2.3.4"), records[1]]
+    ut.EXPECT_EQ(["127.0.0.1 200", "1.2.3.4 404", "10.0.0.1 503"], "[template.render(r) for r in mixed]")
+    ut.EXPECT_EQ(2, "len(template.renderFunctions)")
+    # materialized records don't hold the match
+    from httpd_log_record import getMaterializedRecordClass
+    materialized = getMaterializedRecordClass(ApacheLogRecord, ["status"]).fromRecord(records[0])
+    try:
+        template.render(materialized)
+        error = None
+    except MiningError as error:
+        pass
+    ut.EXPECT_EQ(True, "error is not None")
+    # records of parallel parser hold span arrays instead of match objects
+    import array
+    from httpd_log_format import SpanMatch
+    match = combined.match(lines[1])
+    spanRecord = ApacheLogRecord(combined, lines[1], SpanMatch(lines[1], array.array("i", sum(match.regs, ())), 0))
+    ut.EXPECT_EQ(lines[1], "RenderTemplate('combined').render(spanRecord)")
+    # output target
+    import os
+    import tempfile
+    from httpd_log_stream import oApacheLogStream
+    fd, fileName = tempfile.mkstemp(suffix=".log")
+    os.close(fd)
+    try:
+        output = oApacheLogStream(fileName, ["apache_log"], format="%h %>s %U")
+        for record in records:
+            output.save((record,))
+        output.close()
+        ut.EXPECT_EQ("127.0.0.1 200 /apache_pb.gif\n10.0.0.1 503 /api\n", "open(fileName).read()")
+    finally:
+        os.unlink(fileName)
+    # request is composed from parts
+    parts = ApacheLogFormat("%h %m %U%q %H %T")
+    record = ApacheLogRecord(parts, "1.2.3.4 GET /a?b=1 HTTP/1.1 2")
+    ut.EXPECT_EQ('1.2.3.4 "GET /a?b=1 HTTP/1.1" 2000000', "RenderTemplate('%h \"%r\" %D').render(record)")
+    ut.END_TEST()
@@ -0,0 +1,133 @@
+#
+# Copyright Michael Groys, 2014
+#
+# Deterministic sampling of input stream lines.
+# Line is kept if crc32 hash (salted by seed) of the sampled value is below fraction of the hash range, so the sample
+# is the same in every run and in every worker process:
+#   uniform (key is None) - value is the raw line, decision is made before regular expression match
+#   by key (record field like remoteIp or urlPath) - all lines with the same key value are kept or dropped together,
+#       so sessions and per key aggregates stay whole; if the field starts the line (like %h) its value is cut from
+#       the raw line before match, otherwise it is read from the match group (record is not created for dropped lines)
+# Records of sampled streams have sampleWeight class attribute (1/fraction, 1 for not sampled records),
+# aggregates are scaled back by summing weights instead of counting.
+#
+import zlib
+from m.common import MiningError
+from httpd_log_filter import FormatLayout
+
+HASH_RANGE = 1 << 32
+
+class LineSampler(object):
+    def __init__(self, formatObj, fraction, key=None, seed=0):
+        try:
+            fraction = float(fraction)
+        except (TypeError, ValueError):
+            raise MiningError("Invalid sample fraction '%s'" % fraction)
+        if not 0 < fraction <= 1:
+            raise MiningError("Sample fraction should be in (0, 1], got %s" % fraction)
+        self.fraction = fraction
+        self.weight = 1 / fraction
+        self.key = key
+        self.seed = seed
+        self.threshold = int(fraction * HASH_RANGE)
+        # line -> keep, one of them is set for sampling before match, matchObj -> keep otherwise
+        self.checkLine = None
+        self.checkMatch = None
+        if key is None:
+            self.checkLine = self.checkValue
+            return
+        known, layout = FormatLayout(formatObj).getLayout(key)
+        if not known:
+            raise MiningError("Sample key '%s' is not present in log format" % key)
+        if layout and layout.atLineStart and layout.after:
+            self.keyStart = len(layout.before)
+            self.keyEnd = layout.after[0]
+            self.checkLine = self.checkLineKey
+        else:
+            names = formatObj.__class__.fieldAliases.get(key, []) + [key]
+            self.groups = [formatObj.regexp.groupindex[n] for n in names if n in formatObj.regexp.groupindex]
+            if not self.groups:
+                # key group isn't captured, like when the key is not in projected fields
+                raise MiningError("Sample key '%s' is not captured by log format" % key)
+            self.checkMatch = self.checkMatchKey
+
+    def checkValue(self, value):
+        return zlib.crc32(value, self.seed) & 0xffffffff < self.threshold
+
+    def checkLineKey(self, line):
+        end = line.find(self.keyEnd, self.keyStart)
+        return zlib.crc32(line[self.keyStart:end] if end >= 0 else line, self.seed) & 0xffffffff < self.threshold
+
+    def checkMatchKey(self, matchObj):
+        for group in self.groups:
+            value = matchObj.group(group)
+            if value is not None:
+                return zlib.crc32(value, self.seed) & 0xffffffff < self.threshold
+        return zlib.crc32("", self.seed) & 0xffffffff < self.threshold
+
+    # returns subclass of record class that carries the sample weight
+    def getRecordClass(self, recordClass):
+        return type("Sampled" + recordClass.__name__, (recordClass,), {"sampleWeight": self.weight})
+
+    def getMaterializedClass(self, materializedClass):
+        return type(materializedClass.__name__, (materializedClass,), {"__slots__": (), "sampleWeight": self.weight})
+
+def test():
+    import m.ut_utils as ut
+    import os
+    import tempfile
+    import StringIO
+    from httpd_log_stream import iApacheLogStream
+    ut.START_TEST("httpd_log_sample")
+    lines = []
+    for i in range(20000):
+        lines.append('10.0.%d.%d - - [10/Oct/2000:13:55:36 +0000] "GET /page/%d HTTP/1.1" 200 %d "-" "agent"' % (i % 50, i % 200, i % 100, i))
+    data = "\n".join(lines)
+    def read(**kwargs):
+        stream = iApacheLogStream(StringIO.StringIO(data), "combined", **kwargs)
+        return stream, [r for r, in stream]
+    stream, records = read(sample=0.1)
+    ut.EXPECT_EQ(True, "1700 < len(records) < 2300", msg=str(len(records)))
+    ut.EXPECT_EQ(20000 - len(records), "stream.sampledOut")
+    ut.EXPECT_EQ(20000, "stream.total")
+    ut.EXPECT_EQ(10.0, "records[0].sampleWeight")
+    ut.EXPECT_EQ([r.line for r in records], "[r.line for r in read(sample=0.1)[1]]")
+    ut.EXPECT_EQ(True, "[r.line for r in records] != [r.line for r in read(sample=0.1, sampleSeed=1)[1]]")
+    # whole keys are kept, key at line start is checked on the raw line
+    stream, records = read(sample=0.2, sampleKey="remoteHost")
+    ut.EXPECT_EQ(True, "stream.sampler.checkLine is not None")
+    hosts = set(r.remoteHost for r in records)
+    ut.EXPECT_EQ(100 * len(hosts), "len(records)")
+    ut.EXPECT_EQ(True, "10 < len(hosts) < 70", msg=str(len(hosts)))
+    stream, records = read(sample=0.3, sampleKey="urlPath", materialize="urlPath")
+    ut.EXPECT_EQ(True, "stream.sampler.checkMatch is not None")
+    paths = set(r.urlPath for r in records)
+    ut.EXPECT_EQ(200 * len(paths), "len(records)")
+    ut.EXPECT_EQ(True, "abs(records[0].sampleWeight - 1 / 0.3) < 1e-9")
+    # scaled count estimates the total
+    stream, records = read(sample=0.5, where="status==200")
+    ut.EXPECT_EQ(True, "abs(sum(r.sampleWeight for r in records) - 20000) < 1000")
+    ut.EXPECT_EQ(1, "read()[1][0].sampleWeight")
+    # sample key is captured when other fields are projected
+    stream, records = read(sample=0.3, sampleKey="urlPath", fields="status")
+    ut.EXPECT_EQ([r.line for r in read(sample=0.3, sampleKey="urlPath")[1]], "[r.line for r in records]")
+    ut.EXPECT_EQ(True, "4000 < len(records) < 8000", msg=str(len(records)))
+    from apache_log import ApacheLogFormat
+    try:
+        LineSampler(ApacheLogFormat("combined", fields=["status"]), 0.3, "urlPath")
+        error = None
+    except MiningError, e:
+        error = e
+    ut.EXPECT_EQ(True, "error is not None")
+    # workers of parallel parsing keep the same lines
+    fd, fileName = tempfile.mkstemp(suffix=".log")
+    os.write(fd, data + "\n")
+    os.close(fd)
+    try:
+        serial = [r.line for r, in iApacheLogStream(open(fileName), "combined", sample=0.1, sampleKey="urlPath")]
+        stream = iApacheLogStream(open(fileName), "combined", sample=0.1, sampleKey="urlPath", workers=2, chunkSize=100000)
+        ut.EXPECT_EQ(serial, "[r.line for r, in stream]")
+        ut.EXPECT_EQ(20000 - len(serial), "stream.sampledOut")
+    finally:
+        os.unlink(fileName)
+    ut.END_TEST()
@@ -0,0 +1,205 @@
+#
+# Copyright Michael Groys, 2014
+#
+# Streaming sessionization of httpd records: records of the same visitor (remoteHost and userAgent by default)
+# belong to the same session until visitor is inactive for timeout seconds.
+# Time of the record is its gmtime (decoded without strptime, see httpd_log_time).
+# Only active sessions are kept, every one has single entry in expiry heap ordered by the session deadline
+# (last request + timeout), entries are updated lazily when they reach the top of the heap.
+# Lines may be out of order by maxLateness seconds: session is closed when the latest seen time passed its deadline
+# by maxLateness, late record of the active session updates its start and entry url.
+# When more than maxSessions are active, session with the earliest deadline is closed before its time (forced).
+# Closed sessions are returned as Session objects with slots (no per-instance dict), ordered by closing time.
+#
+import heapq
+from operator import attrgetter
+from m.common import MiningError
+
+DEFAULT_KEYS = ("remoteHost", "userAgent")
+DEFAULT_TIMEOUT = 1800
+DEFAULT_MAX_LATENESS = 60
+DEFAULT_MAX_SESSIONS = 100000
+
+class Session(object):
+    __slots__ = ("key", "start", "end", "requests", "bytes", "entry", "exit")
+
+    def __init__(self, key, t, bytes, url):
+        self.key = key
+        self.start = t
+        self.end = t
+        self.requests = 1
+        self.bytes = bytes
+        self.entry = url
+        self.exit = url
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+    def toTuple(self):
+        return (self.key, self.start, self.end, self.requests, self.bytes, self.entry, self.exit)
+
+    def __repr__(self):
+        return "Session(%r, start=%s, duration=%s, requests=%d, bytes=%d, entry=%r, exit=%r)" % (
+            self.key, self.start, self.duration, self.requests, self.bytes, self.entry, self.exit)
+
+class Sessionizer(object):
+    # keys - record fields (list or comma separated) that identify the visitor, bytesField and urlField - record fields
+    # of session bytes and entry/exit urls
+    def __init__(self, keys=DEFAULT_KEYS, timeout=DEFAULT_TIMEOUT, maxLateness=DEFAULT_MAX_LATENESS,
+                 maxSessions=DEFAULT_MAX_SESSIONS, bytesField="numbytes", urlField="urlPath"):
+        if isinstance(keys, basestring):
+            keys = [k.strip() for k in keys.split(",") if k.strip()]
+        if not keys:
+            raise MiningError("Session keys are not specified")
+        if maxSessions < 1:
+            raise MiningError("maxSessions should be positive, got %s" % maxSessions)
+        self.keys = list(keys)
+        self.getKey = attrgetter(*self.keys)
+        self.getBytes = attrgetter(bytesField)
+        self.getUrl = attrgetter(urlField)
+        self.timeout = timeout
+        self.maxLateness = maxLateness
+        self.maxSessions = maxSessions
+        self.active = {}
+        self.heap = []    # (deadline, key), single entry per active session
+        self.maxTime = None
+        self.records = 0
+        self.closed = 0
+        self.forced = 0   # sessions closed because of maxSessions
+
+    # adds record, returns list of sessions closed by its time
+    def add(self, record):
+        return self.addAt(record.gmtime, record)
+
+    def addAt(self, t, record):
+        self.records += 1
+        key = self.getKey(record)
+        session = self.active.get(key)
+        closed = []
+        if session is not None and t - session.end > self.timeout:
+            # previous session expired but was not closed yet because of lateness window
+            self.close(session, closed)
+            session = None
+        if session is None:
+            session = self.active[key] = Session(key, t, self.getBytes(record), self.getUrl(record))
+            heapq.heappush(self.heap, (t + self.timeout, key))
+            if len(self.active) > self.maxSessions:
+                self.forceClose(closed)
+        else:
+            session.requests += 1
+            session.bytes += self.getBytes(record)
+            if t >= session.end:
+                session.end = t
+                session.exit = self.getUrl(record)
+            elif t < session.start:
+                session.start = t
+                session.entry = self.getUrl(record)
+        if self.maxTime is None or t > self.maxTime:
+            self.maxTime = t
+            self.expire(t - self.maxLateness, closed)
+        return closed
+
+    def close(self, session, closed):
+        del self.active[session.key]
+        closed.append(session)
+        self.closed += 1
+
+    # closes sessions with deadline before time t
+    def expire(self, t, closed):
+        heap = self.heap
+        active = self.active
+        while heap and heap[0][0] < t:
+            deadline, key = heap[0]
+            session = active.get(key)
+            if session is None:
+                # entry of session closed before its deadline
+                heapq.heappop(heap)
+            elif session.end + self.timeout > deadline:
+                heapq.heapreplace(heap, (session.end + self.timeout, key))
+            else:
+                heapq.heappop(heap)
+                self.close(session, closed)
+
+    def forceClose(self, closed):
+        heap = self.heap
+        active = self.active
+        while heap:
+            deadline, key = heapq.heappop(heap)
+            session = active.get(key)
+            if session is None:
+                continue
+            if session.end + self.timeout > deadline:
+                heapq.heappush(heap, (session.end + self.timeout, key))
+                continue
+            self.close(session, closed)
+            self.forced += 1
+            return
+
+    # closes all active sessions, returns them ordered by deadline
+    def flush(self):
+        closed = sorted(self.active.itervalues(), key=lambda session: (session.end, session.start))
+        self.active = {}
+        self.heap = []
+        self.closed += len(closed)
+        return closed
+
+def iSessionStream(stream, **kwargs):
+    # Returns closed sessions of the stream of record tuples, arguments are passed to Sessionizer
+    sessionizer = Sessionizer(**kwargs)
+    for recordTuple in stream:
+        for session in sessionizer.add(recordTuple[0]):
+            yield session
+    for session in sessionizer.flush():
+        yield session
+
+def test():
+    import m.ut_utils as ut
+    import StringIO
+    import calendar
+    import time
+    from httpd_log_stream import iApacheLogStream
+    ut.START_TEST("httpd_log_session")
+    format = "combined"
+    start = calendar.timegm((2014, 1, 1, 0, 0, 0))
+    def line(t, host, url, size=100, agent="UA"):
+        when = time.strftime("%d/%b/%Y:%H:%M:%S +0000", time.gmtime(start + t))
+        return '%s - - [%s] "GET %s HTTP/1.1" 200 %d "-" "%s"' % (host, when, url, size, agent)
+    lines = [
+        line(0, "10.0.0.1", "/a"),
+        line(10, "10.0.0.2", "/x"),
+        line(100, "10.0.0.1", "/b", 200),
+        line(90, "10.0.0.1", "/late"),          # out of order inside maxLateness
+        line(120, "10.0.0.1", "/c", agent="Other"),
+        line(2000, "10.0.0.2", "/y"),           # closes sessions inactive for timeout
+        line(4000, "10.0.0.1", "/d"),
+    ]
+    sessions = list(iSessionStream(iApacheLogStream(StringIO.StringIO("\n".join(lines)), format)))
+    ut.EXPECT_EQ(5, "len(sessions)")
+    ut.EXPECT_EQ([("10.0.0.2", "UA"), ("10.0.0.1", "UA"), ("10.0.0.1", "Other"), ("10.0.0.2", "UA"), ("10.0.0.1", "UA")], "[s.key for s in sessions]")
+    ut.EXPECT_EQ([1, 3, 1, 1, 1], "[s.requests for s in sessions]")
+    first = sessions[1]
+    ut.EXPECT_EQ(("10.0.0.1", "UA"), "first.key")
+    ut.EXPECT_EQ((start, start + 100), "(first.start, first.end)")
+    ut.EXPECT_EQ(3, "first.requests")
+    ut.EXPECT_EQ(400, "first.bytes")
+    ut.EXPECT_EQ(("/a", "/b"), "(first.entry, first.exit)")
+    # late record updates entry url
+    sessionizer = Sessionizer(timeout=60, maxLateness=30)
+    stream = iApacheLogStream(StringIO.StringIO("\n".join([line(50, "h", "/second"), line(40, "h", "/first"), line(200, "z", "/z")])), format)
+    closed = [sessionizer.add(r) for r, in stream]
+    ut.EXPECT_EQ([[], [], ["/first"]], "[[s.entry for s in c] for c in closed]")
+    ut.EXPECT_EQ(10, "closed[2][0].duration")
+    # number of active sessions is bounded
+    sessionizer = Sessionizer("remoteHost", maxSessions=100)
+    lines = [line(i, "10.0.%d.%d" % (i // 256, i % 256), "/") for i in range(1000)]
+    count = 0
+    for r, in iApacheLogStream(StringIO.StringIO("\n".join(lines)), format):
+        count += len(sessionizer.add(r))
+        ut.EXPECT_EQ(True, "len(sessionizer.active) <= 100 and len(sessionizer.heap) <= 101")
+    ut.EXPECT_EQ(900, "count")
+    ut.EXPECT_EQ(900, "sessionizer.forced")
+    ut.EXPECT_EQ(100, "len(sessionizer.flush())")
+    ut.EXPECT_EQ(1000, "sessionizer.closed")
+    ut.EXPECT_EQ(False, "hasattr(sessions[0], '__dict__')")
+    ut.END_TEST()
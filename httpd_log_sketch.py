@@ -0,0 +1,416 @@
+#
+# Copyright Michael Groys, 2014
+#
+# Fixed memory sketches of record fields: top-K (heavy hitters) and distinct counts.
+#   SpaceSaving - keeps capacity counters, item that is not counted replaces the item with minimal count,
+#       counts are overestimated by at most error (reported per item), items with frequency above N/capacity are kept
+#   CountMinSketch - depth x width counters, estimate exceeds true count by at most e*N/width with probability 1 - e^-depth,
+#       CountMinTopK keeps k items with highest estimates
+#   HyperLogLog - 2^p registers (bytes), distinct count standard error is 1.04/sqrt(2^p) (0.8% for default p=14)
+# Items are hashed by first 8 bytes of md5 of string (repr of other values), the hash doesn't depend on the process,
+# so sketches are mergeable between processes and machines.
+# SketchAggregator keeps sketch of record field (or tuple of fields) per time window of gmtime.
+#
+import json
+import heapq
+import struct
+import hashlib
+import array
+import base64
+from operator import attrgetter
+from m.common import MiningError
+
+SKETCH_VERSION = 2
+DEFAULT_CAPACITY = 1000
+DEFAULT_WIDTH = 2048
+DEFAULT_DEPTH = 4
+DEFAULT_P = 14
+DEFAULT_MAX_WINDOWS = 1000
+
+def hash64(item):
+    if not isinstance(item, str):
+        item = item.encode("utf-8") if isinstance(item, unicode) else repr(item)
+    return struct.unpack("<Q", hashlib.md5(item).digest()[:8])[0]
+
+def _checkVersion(data):
+    if data.get("version") != SKETCH_VERSION:
+        raise MiningError("Unsupported sketch version %s" % data.get("version"))
+
+class SpaceSaving(object):
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.heap = []     # (count, item), single entry per item, counts are updated lazily
+        self.total = 0
+
+    def add(self, item, count=1):
+        self.total += count
+        counts = self.counts
+        if item in counts:
+            counts[item] += count
+            return
+        if len(counts) < self.capacity:
+            counts[item] = count
+            self.errors[item] = 0
+            heapq.heappush(self.heap, (count, item))
+            return
+        heap = self.heap
+        while True:
+            minCount, victim = heap[0]
+            current = counts[victim]
+            if current == minCount:
+                break
+            heapq.heapreplace(heap, (current, victim))
+        del counts[victim]
+        del self.errors[victim]
+        counts[item] = minCount + count
+        self.errors[item] = minCount
+        heapq.heapreplace(heap, (minCount + count, item))
+
+    def getMinCount(self):
+        if len(self.counts) < self.capacity:
+            return 0
+        return min(self.counts.itervalues())
+
+    # returns [(item, count, error)] of k items with highest counts
+    def top(self, k=10):
+        items = heapq.nlargest(k, self.counts.iteritems(), key=lambda entry: entry[1])
+        return [(item, count, self.errors[item]) for item, count in items]
+
+    def merge(self, other):
+        if other.capacity != self.capacity:
+            raise MiningError("Can't merge top-K sketches with different capacity")
+        # item missing in full sketch could have count up to its minimal count
+        selfMin = self.getMinCount()
+        otherMin = other.getMinCount()
+        counts = {}
+        errors = {}
+        for item in set(self.counts) | set(other.counts):
+            counts[item] = self.counts.get(item, selfMin) + other.counts.get(item, otherMin)
+            errors[item] = self.errors.get(item, selfMin) + other.errors.get(item, otherMin)
+        kept = heapq.nlargest(self.capacity, counts.iteritems(), key=lambda entry: entry[1])
+        self.counts = dict(kept)
+        self.errors = dict((item, errors[item]) for item, count in kept)
+        self.heap = [(count, item) for item, count in kept]
+        heapq.heapify(self.heap)
+        self.total += other.total
+        return self
+
+    def toDict(self):
+        return {"type": "SpaceSaving", "version": SKETCH_VERSION, "capacity": self.capacity,
+                "total": self.total, "items": [[item, count, self.errors[item]] for item, count in self.counts.iteritems()]}
+
+    @classmethod
+    def fromDict(cls, data):
+        _checkVersion(data)
+        sketch = cls(data["capacity"])
+        for item, count, error in data["items"]:
+            item = _restoreItem(item)
+            sketch.counts[item] = count
+            sketch.errors[item] = error
+            sketch.heap.append((count, item))
+        heapq.heapify(sketch.heap)
+        sketch.total = data["total"]
+        return sketch
+
+def _restoreItem(item):
+    # json returns unicode strings and lists instead of tuples
+    if isinstance(item, unicode):
+        try:
+            return str(item)
+        except UnicodeEncodeError:
+            return item
+    if isinstance(item, list):
+        return tuple(_restoreItem(i) for i in item)
+    return item
+
+class CountMinSketch(object):
+    def __init__(self, width=DEFAULT_WIDTH, depth=DEFAULT_DEPTH):
+        self.width = width
+        self.depth = depth
+        self.rows = [array.array("l", [0]) * width for i in range(depth)]
+        self.total = 0
+
+    # column of every row by double hashing of 64 bit hash
+    def getColumns(self, item):
+        h = hash64(item)
+        h1 = h & 0xffffffff
+        h2 = (h >> 32) | 1
+        width = self.width
+        return [(h1 + i * h2) % width for i in range(self.depth)]
+
+    # adds count and returns estimate of the item count
+    def add(self, item, count=1):
+        self.total += count
+        estimate = None
+        for row, column in zip(self.rows, self.getColumns(item)):
+            value = row[column] + count
+            row[column] = value
+            if estimate is None or value < estimate:
+                estimate = value
+        return estimate
+
+    def estimate(self, item):
+        return min(row[column] for row, column in zip(self.rows, self.getColumns(item)))
+
+    def merge(self, other):
+        if other.width != self.width or other.depth != self.depth:
+            raise MiningError("Can't merge count-min sketches with different dimensions")
+        for row, otherRow in zip(self.rows, other.rows):
+            for i in xrange(self.width):
+                row[i] += otherRow[i]
+        self.total += other.total
+        return self
+
+    def toDict(self):
+        return {"type": "CountMinSketch", "version": SKETCH_VERSION, "width": self.width,
+                "depth": self.depth, "total": self.total, "rows": [row.tolist() for row in self.rows]}
+
+    @classmethod
+    def fromDict(cls, data):
+        _checkVersion(data)
+        sketch = cls(data["width"], data["depth"])
+        sketch.rows = [array.array("l", row) for row in data["rows"]]
+        sketch.total = data["total"]
+        return sketch
+
+class CountMinTopK(object):
+    # k items with highest count-min estimates
+    def __init__(self, k=10, width=DEFAULT_WIDTH, depth=DEFAULT_DEPTH):
+        self.k = k
+        self.sketch = CountMinSketch(width, depth)
+        self.candidates = {}
+        self.minCandidate = 0
+
+    def add(self, item, count=1):
+        estimate = self.sketch.add(item, count)
+        candidates = self.candidates
+        if item in candidates:
+            candidates[item] = estimate
+        elif len(candidates) < self.k:
+            candidates[item] = estimate
+            self.minCandidate = min(candidates.itervalues())
+        elif estimate > self.minCandidate:
+            del candidates[min(candidates, key=candidates.get)]
+            candidates[item] = estimate
+            self.minCandidate = min(candidates.itervalues())
+
+    # returns [(item, estimate)] sorted by estimate
+    def top(self, k=None):
+        return sorted(self.candidates.iteritems(), key=lambda entry: -entry[1])[:k or self.k]
+
+    def merge(self, other):
+        self.sketch.merge(other.sketch)
+        items = set(self.candidates) | set(other.candidates)
+        estimates = [(item, self.sketch.estimate(item)) for item in items]
+        self.candidates = dict(heapq.nlargest(self.k, estimates, key=lambda entry: entry[1]))
+        self.minCandidate = min(self.candidates.itervalues()) if self.candidates else 0
+        return self
+
+    def toDict(self):
+        return {"type": "CountMinTopK", "version": SKETCH_VERSION, "k": self.k,
+                "sketch": self.sketch.toDict(), "candidates": [[item, estimate] for item, estimate in self.candidates.iteritems()]}
+
+    @classmethod
+    def fromDict(cls, data):
+        _checkVersion(data)
+        topK = cls(data["k"])
+        topK.sketch = CountMinSketch.fromDict(data["sketch"])
+        topK.candidates = dict((_restoreItem(item), estimate) for item, estimate in data["candidates"])
+        topK.minCandidate = min(topK.candidates.itervalues()) if topK.candidates else 0
+        return topK
+
+class HyperLogLog(object):
+    def __init__(self, p=DEFAULT_P):
+        if not 4 <= p <= 18:
+            raise MiningError("HyperLogLog precision should be between 4 and 18, got %s" % p)
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(self.m)
+        self.rankBits = 64 - p
+        self.rankMask = (1 << self.rankBits) - 1
+
+    def add(self, item):
+        h = hash64(item)
+        index = h >> self.rankBits
+        rank = self.rankBits - (h & self.rankMask).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        import math
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count("\x00")
+        if estimate <= 2.5 * m and zeros:
+            # linear counting for small cardinalities
+            return m * math.log(float(m) / zeros)
+        return estimate
+
+    def merge(self, other):
+        if other.p != self.p:
+            raise MiningError("Can't merge HyperLogLog sketches with different precision")
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+        return self
+
+    def toDict(self):
+        return {"type": "HyperLogLog", "version": SKETCH_VERSION, "p": self.p,
+                "registers": base64.b64encode(str(self.registers))}
+
+    @classmethod
+    def fromDict(cls, data):
+        _checkVersion(data)
+        sketch = cls(data["p"])
+        sketch.registers = bytearray(base64.b64decode(data["registers"]))
+        return sketch
+
+SKETCH_CLASSES = {"SpaceSaving": SpaceSaving, "CountMinSketch": CountMinSketch, "CountMinTopK": CountMinTopK, "HyperLogLog": HyperLogLog}
+
+def sketchFromDict(data):
+    cls = SKETCH_CLASSES.get(data.get("type"))
+    if cls is None:
+        raise MiningError("Unknown sketch type %s" % data.get("type"))
+    return cls.fromDict(data)
+
+class SketchAggregator(object):
+    # field - record field name or list of them (sketch item is tuple of values), createSketch - function without arguments
+    # that returns new sketch, window - seconds of gmtime windows (None - single sketch for all records),
+    # only maxWindows latest windows are kept
+    def __init__(self, field, createSketch, window=None, maxWindows=DEFAULT_MAX_WINDOWS):
+        if isinstance(field, basestring):
+            field = [f.strip() for f in field.split(",") if f.strip()]
+        self.fields = list(field)
+        self.getItem = attrgetter(*self.fields)
+        self.createSketch = createSketch
+        self.window = window
+        self.maxWindows = maxWindows
+        self.sketches = {}
+
+    def getSketch(self, window):
+        sketch = self.sketches.get(window)
+        if sketch is None:
+            sketch = self.sketches[window] = self.createSketch()
+            if len(self.sketches) > self.maxWindows:
+                del self.sketches[min(self.sketches)]
+        return sketch
+
+    def add(self, record):
+        window = int(record.gmtime) // self.window * self.window if self.window else None
+        self.getSketch(window).add(self.getItem(record))
+
+    def addStream(self, stream):
+        for recordTuple in stream:
+            self.add(recordTuple[0])
+        return self
+
+    def merge(self, other):
+        for window, sketch in other.sketches.iteritems():
+            self.getSketch(window).merge(sketch)
+        return self
+
+    def toDict(self):
+        return {"fields": self.fields, "window": self.window, "maxWindows": self.maxWindows,
+                "sketches": [[window, sketch.toDict()] for window, sketch in sorted(self.sketches.iteritems())]}
+
+    def save(self, fileName):
+        f = open(fileName, "w")
+        try:
+            json.dump(self.toDict(), f)
+        finally:
+            f.close()
+
+    @classmethod
+    def fromDict(cls, data, createSketch):
+        aggregator = cls(data["fields"], createSketch, data["window"], data["maxWindows"])
+        for window, sketch in data["sketches"]:
+            aggregator.sketches[window] = sketchFromDict(sketch)
+        return aggregator
+
+    @classmethod
+    def load(cls, fileName, createSketch):
+        f = open(fileName)
+        try:
+            return cls.fromDict(json.load(f), createSketch)
+        finally:
+            f.close()
+
+def test():
+    import m.ut_utils as ut
+    import os
+    import random
+    import tempfile
+    import StringIO
+    ut.START_TEST("httpd_log_sketch")
+    rnd = random.Random(20)
+    # zipf like stream: 20 heavy clients and long tail
+    items = []
+    for i in range(20):
+        items += ["10.0.0.%d" % i] * (2000 - i * 50)
+    items += ["172.16.%d.%d" % (rnd.randint(0, 255), rnd.randint(0, 255)) for i in range(30000)]
+    rnd.shuffle(items)
+    exact = {}
+    for item in items:
+        exact[item] = exact.get(item, 0) + 1
+    heavy = sorted(exact, key=lambda item: -exact[item])[:10]
+    spaceSaving = SpaceSaving(200)
+    topK = CountMinTopK(10)
+    hll = HyperLogLog()
+    for item in items:
+        spaceSaving.add(item)
+        topK.add(item)
+        hll.add(item)
+    ut.EXPECT_EQ(heavy, "[item for item, count, error in spaceSaving.top(10)]")
+    ut.EXPECT_EQ([True] * 10, "[count - error <= exact[item] <= count for item, count, error in spaceSaving.top(10)]")
+    ut.EXPECT_EQ(200, "len(spaceSaving.counts)")
+    ut.EXPECT_EQ(heavy, "[item for item, estimate in topK.top()]")
+    ut.EXPECT_EQ([True] * 10, "[exact[item] <= estimate <= exact[item] + 2.72 * len(items) / DEFAULT_WIDTH for item, estimate in topK.top()]")
+    ut.EXPECT_EQ(True, "abs(hll.count() - len(exact)) < 0.03 * len(exact)", msg="%s %s" % (hll.count(), len(exact)))
+    small = HyperLogLog()
+    for i in range(100):
+        small.add(i % 50)
+    ut.EXPECT_EQ(50, "int(round(small.count()))")
+    # merge of halves
+    halves = [(SpaceSaving(200), CountMinTopK(10), HyperLogLog()) for i in range(2)]
+    for i, item in enumerate(items):
+        for sketch in halves[i % 2]:
+            sketch.add(item)
+    merged = [sketchFromDict(json.loads(json.dumps(sketch.toDict()))) for sketch in halves[0]]
+    for sketch, other in zip(merged, halves[1]):
+        sketch.merge(other)
+    ut.EXPECT_EQ(heavy, "[item for item, count, error in merged[0].top(10)]")
+    ut.EXPECT_EQ([True] * 10, "[count - error <= exact[item] <= count for item, count, error in merged[0].top(10)]")
+    ut.EXPECT_EQ(topK.top(), "merged[1].top()")
+    ut.EXPECT_EQ(hll.registers, "merged[2].registers")
+    # hash doesn't depend on the process, sketches of other versions are rejected
+    ut.EXPECT_EQ(7451892132592160025, "hash64('10.0.0.1')")
+    ut.EXPECT_EQ(hash64("10.0.0.1"), "hash64(u'10.0.0.1')")
+    data = merged[2].toDict()
+    data["version"] = 1
+    try:
+        sketchFromDict(data)
+        error = None
+    except MiningError as error:
+        pass
+    ut.EXPECT_EQ(True, "error is not None")
+    # aggregation of records by time windows
+    from httpd_log_stream import iNCSALogStream
+    lines = ['10.0.%d.%d - - [10/Oct/2000:13:%02d:36 +0000] "GET /%d HTTP/1.1" 200 1' % (i % 3, i % 100, i // 100, i % 7) for i in range(3000)]
+    aggregator = SketchAggregator("remoteHost", HyperLogLog, window=600)
+    aggregator.addStream(iNCSALogStream(StringIO.StringIO("\n".join(lines))))
+    ut.EXPECT_EQ(3, "len(aggregator.sketches)")
+    ut.EXPECT_EQ([True] * 3, "[abs(s.count() - 300) < 10 for w, s in sorted(aggregator.sketches.items())]")
+    pairs = SketchAggregator("remoteHost,urlPath", lambda: SpaceSaving(50))
+    pairs.addStream(iNCSALogStream(StringIO.StringIO("\n".join(lines))))
+    fd, fileName = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    try:
+        pairs.save(fileName)
+        loaded = SketchAggregator.load(fileName, lambda: SpaceSaving(50))
+        ut.EXPECT_EQ(pairs.sketches[None].counts, "loaded.sketches[None].counts")
+        ut.EXPECT_EQ(pairs.sketches[None].errors, "loaded.sketches[None].errors")
+        ut.EXPECT_EQ(True, "isinstance(loaded.sketches[None].top(1)[0][0], tuple)")
+    finally:
+        os.unlink(fileName)
+    ut.END_TEST()
@@ -1,74 +1,501 @@
 import ncsa_log
 import apache_log
+import httpd_log_filter
+import httpd_log_record
+import httpd_log_timeindex
+import httpd_log_output
+import httpd_log_render
+import httpd_log_readahead
+import httpd_log_metrics
+import httpd_log_url
+import httpd_log_intern
+import httpd_log_sample
+import time
 import sys
 from m.common import MiningError
 from m._runtime import isVerbose
 
 from m.io_targets.log_stream import iRaw
 
+# parsed Url objects are cached by the url string (see httpd_log_url)
 def parseUrlFromLog(rec):
-    from http_parsers import Url
-    return Url(rec.url)
+    return httpd_log_url.urlCache.get(rec.url)
+
+def _fieldList(fields):
+    if isinstance(fields, basestring):
+        return [f.strip() for f in fields.split(",") if f.strip()]
+    return list(fields)
+
+# adds fields read by predicates and sample key to projected fields, materialized fields are projected by default,
+# code fields of interned fields (see httpd_log_intern) are replaced by their fields
+def getRequiredFields(fields, where, materialize=None, intern=None, sampleKey=None):
+    if fields is None:
+        if not materialize:
+            return None
+        fields = [f for f in _fieldList(materialize) if f != "line"]
+    if intern:
+        codeFields = set(field + "Code" for field, mode in httpd_log_intern.parseInternFields(intern) if mode == httpd_log_intern.CODE)
+        fields = [f[:-len("Code")] if f in codeFields else f for f in _fieldList(fields)]
+    if sampleKey:
+        fields = _fieldList(fields) + [sampleKey]
+    if not where:
+        return fields
+    return _fieldList(fields) + [predicate.field for predicate in httpd_log_filter.parsePredicates(where)]
 
 class iHttpdLogStream(iRaw):
-    def __init__(self, formatObj, recordClass, varName, fileHandler):
+    # workers > 1 enables parallel parsing of the file in process pool (see httpd_log_parallel),
+    # formatArgs are used to create format object in every worker
+    # materialize - list of record fields, if given records are converted to compact objects holding only these fields
+    # cache - True or cache directory, records are read from persistent columnar cache of the file (see httpd_log_cache)
+    # since, until - time window of the query, reading starts near the first line at or after since and stops
+    # after until (see httpd_log_timeindex), gmtime predicates of the window should be in where,
+    # tolerance - maximal delay of out of order lines in seconds, timeIndex - use sidecar index file instead of binary search
+    # follow - "end" (or True) or "start", lines appended to the file are read until idleTimeout seconds without new lines
+    # (forever if None), followBackend - "auto", "inotify" or "poll" (see httpd_log_follow)
+    # readAhead - "thread" or "process" that decompresses .gz/.bz2 file ahead of the parser (original file handler is closed),
+    # None (default) - read file handler as is
+    # (see httpd_log_readahead)
+    # metrics - True or snapshot interval in seconds, collects counters and time split of serial parsing (see httpd_log_metrics)
+    # quarantine - file name (or file object) that receives every quarantineSample-th failed line up to quarantineMaxBytes,
+    # metrics and quarantine are not available for cached and parallel parsing
+    # detector - httpd_log_detect.FormatDetector, format is detected again when many lines fail in serial parsing
+    # intern - True (default fields) or list of fields (field:code for integer codes) whose values are interned
+    # by the stream up to internMaxSize distinct values per field (see httpd_log_intern), records read from cache
+    # already share values of dictionary columns and are not interned, codes are not available for them
+    # sample - fraction of lines kept by deterministic hash of the line or of sampleKey field (salted by sampleSeed),
+    # records have sampleWeight = 1/sample (see httpd_log_sample)
+    def __init__(self, formatObj, recordClass, varName, fileHandler, where=None,
+                 workers=1, chunkSize=None, ordered=True, formatArgs=None, materialize=None, cache=None,
+                 since=None, until=None, tolerance=httpd_log_timeindex.DEFAULT_TOLERANCE, timeIndex=False,
+                 follow=None, followBackend="auto", idleTimeout=None, readAhead=None,
+                 metrics=None, quarantine=None, quarantineSample=1, quarantineMaxBytes=httpd_log_metrics.DEFAULT_QUARANTINE_MAX_BYTES,
+                 detector=None, intern=None, internMaxSize=httpd_log_intern.DEFAULT_MAX_SIZE,
+                 sample=None, sampleKey=None, sampleSeed=0):
         self.formatObj = formatObj
+        self.formatArgs = formatArgs
+        self.where = where
         self.recordClass = recordClass
+        self.interner = None
+        if intern and cache:
+            if [field for field, mode in httpd_log_intern.parseInternFields(intern) if mode == httpd_log_intern.CODE]:
+                raise MiningError("Interned codes can't be combined with cache")
+        elif intern:
+            self.interner = httpd_log_intern.Interner(intern, internMaxSize)
+            self.recordClass = self.interner.getRecordClass(recordClass)
+        self.sampler = None
+        self.sampledOut = 0  # lines dropped by sampling
+        self.sampleArgs = None
+        if sample is not None:
+            if cache:
+                raise MiningError("Cached log can't be sampled")
+            self.sampleArgs = (sample, sampleKey, sampleSeed)
+            self.sampler = httpd_log_sample.LineSampler(formatObj, *self.sampleArgs)
+            self.recordClass = self.sampler.getRecordClass(self.recordClass)
+        if ((metrics is not None and metrics is not False) or quarantine) and (cache or (workers and int(workers) > 1)):
+            raise MiningError("Metrics and quarantine are collected by serial parsing, they can't be combined with cache or parallel parsing")
         self.varName = varName
         self.failed = 0
         self.total = 0
+        # where - predicates on record fields (see httpd_log_filter), lines that don't satisfy them are skipped
+        self.lineFilter = httpd_log_filter.LineFilter(formatObj, where) if where else None
+        self.prefiltered = 0 # lines rejected by raw line prefilter
+        self.parsed = 0      # lines matched by format regular expression
+        self.filtered = 0    # parsed lines rejected by predicates
+        self.failedLines = None # list that collects lines failed to match, if set
+        self.materializedClass = None
+        if materialize:
+            if self.interner:
+                # interned record class is created for every stream, its materialized class is not cached
+                self.materializedClass = httpd_log_record.createMaterializedRecordClass(self.recordClass, materialize)
+            else:
+                self.materializedClass = httpd_log_record.getMaterializedRecordClass(recordClass, materialize)
+            if self.sampler:
+                self.materializedClass = self.sampler.getMaterializedClass(self.materializedClass)
+        self.cacheReader = None
+        self.cachedRecords = None
+        if cache:
+            if workers and int(workers) > 1:
+                raise MiningError("Cached log can't be parsed in parallel")
+            import httpd_log_cache
+            fields = None
+            if formatObj.requiredFields is not None:
+                fields = httpd_log_cache.getStoredFields(recordClass, formatObj.requiredFields)
+            self.cacheReader = httpd_log_cache.openCache(cache, getattr(fileHandler, "name", None), formatObj.__class__,
+                                                         formatArgs or (formatObj.template,), recordClass, fields)
+            self.cachedRecords = self.cacheReader.iterRecords(recordClass, fields)
+        self.parallelParser = None
+        if workers and int(workers) > 1:
+            import httpd_log_parallel
+            self.parallelParser = httpd_log_parallel.ParallelParser(
+                getattr(fileHandler, "name", None), formatObj.__class__, formatArgs, recordClass,
+                workers, chunkSize or httpd_log_parallel.DEFAULT_CHUNK_SIZE, ordered, where, self.sampleArgs)
+        self.followReader = None
+        if follow:
+            if cache or self.parallelParser or since is not None:
+                raise MiningError("Follow mode can't be combined with cache, parallel parsing or time window start")
+            if follow not in (True, "start", "end"):
+                raise MiningError("Invalid follow mode '%s', expected 'start' or 'end'" % follow)
+            import httpd_log_follow
+            fileHandler = self.followReader = httpd_log_follow.FollowReader(getattr(fileHandler, "name", None), followBackend,
+                                                                            follow == "start", idleTimeout=idleTimeout)
+        self.startOffset = 0
+        self.readAhead = None
+        if not self.cachedRecords and not self.parallelParser:
+            fileName = getattr(fileHandler, "name", None)
+            if readAhead and not self.followReader and httpd_log_readahead.isCompressed(fileName):
+                # the file is read by the decompressor
+                if hasattr(fileHandler, "close"):
+                    fileHandler.close()
+                fileHandler = self.readAhead = httpd_log_readahead.ReadAheadReader(fileName, readAhead)
+            if since is not None and httpd_log_timeindex.isSeekable(fileName):
+                self.startOffset = httpd_log_timeindex.findStartOffset(fileName, since, tolerance, timeIndex)
+                fileHandler.seek(self.startOffset)
+            if until is not None:
+                fileHandler = httpd_log_timeindex.TimeWindowLines(fileHandler, until, tolerance)
+        self.detector = detector if not self.cachedRecords and not self.parallelParser else None
+        self.metrics = None
+        if metrics is not None and metrics is not False:
+            self.metrics = httpd_log_metrics.StreamMetrics(None if metrics is True else metrics)
+        self.quarantine = None
+        if quarantine:
+            self.quarantine = httpd_log_metrics.QuarantineSink(quarantine, quarantineSample, quarantineMaxBytes)
         iRaw.__init__(self, fileHandler)
     def next(self):
+        record = self.nextRecord()
+        if self.followReader:
+            self.followReader.recordParsed(record.line)
+        if self.materializedClass:
+            record = self.materializedClass.fromRecord(record)
+        return (record,)
+
+    # returns next record that satisfies predicates
+    def nextRecord(self):
+        if self.cachedRecords is not None:
+            return self.nextCachedRecord()
+        if self.parallelParser:
+            return self.nextParallelRecord()
+        if self.metrics:
+            return self.nextMeasuredRecord()
+        lineFilter = self.lineFilter
+        sampler = self.sampler
+        checkLine = sampler.checkLine if sampler else None
+        checkMatch = sampler.checkMatch if sampler else None
         try:
             while True:
                 line = iRaw.next(self)[0]
+                self.total += 1
+                if checkLine and not checkLine(line):
+                    self.sampledOut += 1
+                    continue
+                if lineFilter and not lineFilter.prefilter(line):
+                    self.prefiltered += 1
+                    continue
                 match = self.formatObj.match(line)
                 if match:
-                    return (self.recordClass(self.formatObj, line, match),)
-                else:
-                    self.failed += 1
+                    if checkMatch and not checkMatch(match):
+                        self.sampledOut += 1
+                        continue
+                    record = self.recordClass(self.formatObj, line, match)
+                    if lineFilter:
+                        self.parsed += 1
+                        if not lineFilter.check(record):
+                            self.filtered += 1
+                            continue
+                    return record
+                elif self.failLine(line):
+                    lineFilter = self.lineFilter
+                    if sampler:
+                        sampler = self.sampler
+                        checkLine = sampler.checkLine
+                        checkMatch = sampler.checkMatch
+        except StopIteration:
+            self.finish()
+            raise
+
+    # same as nextRecord() with metrics collection
+    def nextMeasuredRecord(self):
+        metrics = self.metrics
+        lineFilter = self.lineFilter
+        sampler = self.sampler
+        checkLine = sampler.checkLine if sampler else None
+        checkMatch = sampler.checkMatch if sampler else None
+        clock = time.time
+        try:
+            while True:
+                start = clock()
+                line = iRaw.next(self)[0]
+                matchStart = clock()
+                metrics.ioTime += matchStart - start
+                metrics.lines += 1
+                metrics.bytes += len(line) + 1
                 self.total += 1
+                if metrics.lines >= metrics.nextCheck:
+                    metrics.check()
+                if checkLine and not checkLine(line):
+                    self.sampledOut += 1
+                    continue
+                if lineFilter and not lineFilter.prefilter(line):
+                    self.prefiltered += 1
+                    continue
+                match = self.formatObj.match(line)
+                recordStart = clock()
+                metrics.matchTime += recordStart - matchStart
+                if match:
+                    metrics.matched += 1
+                    if checkMatch and not checkMatch(match):
+                        self.sampledOut += 1
+                        metrics.recordTime += clock() - recordStart
+                        continue
+                    record = self.recordClass(self.formatObj, line, match)
+                    if lineFilter:
+                        self.parsed += 1
+                        if not lineFilter.check(record):
+                            self.filtered += 1
+                            metrics.recordTime += clock() - recordStart
+                            continue
+                    metrics.recordTime += clock() - recordStart
+                    return record
+                else:
+                    metrics.failed += 1
+                    if self.failLine(line):
+                        lineFilter = self.lineFilter
+                        if sampler:
+                            sampler = self.sampler
+                            checkLine = sampler.checkLine
+                            checkMatch = sampler.checkMatch
         except StopIteration:
-            if self.failed and isVerbose():
-                print "Failed to match %d out of %d records" % (self.failed, self.total)
+            self.finish()
             raise
 
+    # returns True if format was changed
+    def failLine(self, line):
+        self.failed += 1
+        if self.failedLines is not None:
+            self.failedLines.append(line)
+        if self.quarantine:
+            self.quarantine.add(line)
+        if self.detector:
+            format = self.detector.addFailure(line, self.total)
+            if format:
+                return self.switchFormat(format)
+        return False
+
+    # parses following lines and failed lines of the detector burst by the new format
+    def switchFormat(self, format):
+        import httpd_log_detect
+        formatArgs = (format,) + tuple(self.formatArgs[1:])
+        formatObj = self.formatObj.__class__.getCached(*formatArgs)
+        try:
+            lineFilter = httpd_log_filter.LineFilter(formatObj, self.where) if self.where else None
+        except MiningError:
+            # predicates refer fields missing in the new format
+            self.detector.format = self.formatArgs[0]
+            return False
+        self.formatObj = formatObj
+        self.formatArgs = formatArgs
+        self.lineFilter = lineFilter
+        if self.sampler:
+            # sample key may be at other position of the new format
+            self.sampler = httpd_log_sample.LineSampler(formatObj, *self.sampleArgs)
+        lines = self.detector.takeBurst()
+        self.failed -= len(lines)
+        self.total -= len(lines)
+        if self.metrics:
+            self.metrics.failed -= len(lines)
+            self.metrics.lines -= len(lines)
+            self.metrics.bytes -= sum(len(line) + 1 for line in lines)
+        self.myFileHandler = httpd_log_detect.ReplayLines(self, lines)
+        if isVerbose():
+            print "Log format changed to '%s'" % format
+        return True
+
+    # called at the end of parsing
+    def finish(self):
+        if self.quarantine:
+            self.quarantine.close()
+        if self.followReader:
+            self.followReader.close()
+        if self.readAhead:
+            self.readAhead.close()
+        if self.cacheReader:
+            self.cacheReader.close()
+        self.reportCounters()
+
+    # stops background workers and decompressor and releases followed file of the stream,
+    # stream abandoned before the end should be closed
+    def close(self):
+        if self.parallelParser:
+            self.parallelParser.close()
+        if self.followReader:
+            self.followReader.close()
+        if self.readAhead:
+            self.readAhead.close()
+        if self.cacheReader:
+            self.cacheReader.close()
+
+    def nextParallelRecord(self):
+        parser = self.parallelParser
+        try:
+            line, match = parser.next()
+            return self.recordClass(self.formatObj, line, match)
+        except StopIteration:
+            self.failed = parser.failed
+            self.total = parser.total
+            self.prefiltered = parser.prefiltered
+            self.parsed = parser.parsed
+            self.filtered = parser.filtered
+            self.sampledOut = parser.sampledOut
+            self.finish()
+            raise
+
+    def nextCachedRecord(self):
+        lineFilter = self.lineFilter
+        try:
+            while True:
+                record = self.cachedRecords.next()
+                if lineFilter:
+                    self.parsed += 1
+                    if not lineFilter.check(record):
+                        self.filtered += 1
+                        continue
+                return record
+        except StopIteration:
+            self.failed = self.cacheReader.failed
+            self.total = self.cacheReader.total
+            self.finish()
+            raise
+
+    # number of lines failed to match so far
+    def getFailedCount(self):
+        if self.parallelParser:
+            return self.parallelParser.failed
+        return self.failed
+
+    # iterates over httpd_log_columns.ColumnBatch objects with numpy arrays of given record fields
+    def iterBatches(self, batchSize=65536, fields=None):
+        import httpd_log_columns
+        return httpd_log_columns.iterBatches(self, batchSize, fields)
+
+    def reportCounters(self):
+        if self.failed and isVerbose():
+            print "Failed to match %d out of %d records" % (self.failed, self.total)
+        if self.lineFilter and isVerbose():
+            print "Prefilter dropped %d lines, parsed %d lines, predicates dropped %d of them" % (self.prefiltered, self.parsed, self.filtered)
+        if self.sampler and isVerbose():
+            print "Sampling dropped %d of %d lines (fraction %s)" % (self.sampledOut, self.total, self.sampler.fraction)
+        if self.metrics and isVerbose():
+            print "Metrics: %s" % self.metrics
+        if self.quarantine and isVerbose():
+            print "Quarantined %d of %d failed lines (%d dropped by size limit)" % (self.quarantine.written, self.quarantine.seen, self.quarantine.dropped)
+        if self.readAhead and isVerbose():
+            counters = self.readAhead.getCounters()
+            print ("Read-ahead: %(blocks)d blocks, %(bytes)d bytes, decompressor waited %(decompressorWaitTime).2f sec, "
+                   "parser waited %(parserWaitTime).2f sec, bottleneck: %(bottleneck)s" % counters)
+        if isVerbose():
+            for name, stats in sorted(httpd_log_url.getCacheStats().iteritems()):
+                if stats["misses"]:
+                    print ("Parsed %(name)s cache: %(hits)d hits, %(misses)d misses (hit rate %(hitRate).2f), %(evictions)d evictions, "
+                           "%(size)d of %(maxSize)d entries" % dict(stats, name=name))
+
     def getVariableNames(self):
         return [self.varName]
 
 class oHttpdLogStream(object):
-    def __init__(self, httpdLogVarName, fileName, variableNames):
+    # lines are written by buffers of bufferSize bytes, file extension selects compression (see httpd_log_output),
+    # background - compress and write in separate thread
+    # format - Apache log format of written lines, records are rendered from their fields (see httpd_log_render)
+    def __init__(self, httpdLogVarName, fileName, variableNames, bufferSize=httpd_log_output.DEFAULT_BUFFER_SIZE,
+                 compressLevel=None, background=False, format=None):
         try:
             self.index = variableNames.index(httpdLogVarName)
         except ValueError:
             raise MiningError("'%s' variable is not available at output" % httpdLogVarName)
         self.myFileName = fileName
-        if fileName == "stdout":
-            self.myFileHandler = sys.stdout
-        else:
-            self.myFileHandler = open(fileName, "wb")
+        self.writer = httpd_log_output.LineWriter(fileName, bufferSize, compressLevel, background)
+        self.myFileHandler = self.writer.fileHandler
         self.myVars = variableNames
-    def save(self, record):
+        self.template = None
+        if format:
+            self.template = httpd_log_render.RenderTemplate(format)
+            self.save = self.saveRendered
+        elif self.writer.direct:
+            self.save = self.saveDirect
+    def saveRendered(self, record):
+        writer = self.writer
+        line = self.template.render(record[self.index])
+        if writer.direct:
+            print >>self.myFileHandler, line
+            writer.linesWritten += 1
+        else:
+            writer.lines.append(line)
+            if len(writer.lines) >= writer.flushLines:
+                writer.flush()
+    def saveDirect(self, record):
         print >>self.myFileHandler, record[self.index].line
+        self.writer.linesWritten += 1
+    def save(self, record):
+        writer = self.writer
+        writer.lines.append(record[self.index].line)
+        if len(writer.lines) >= writer.flushLines:
+            writer.flush()
+    @property
+    def linesWritten(self):
+        return self.writer.linesWritten + len(self.writer.lines)
+    @property
+    def bytesWritten(self):
+        if self.writer.direct:
+            return self.myFileHandler.tell()
+        return self.writer.bytesWritten + sum(len(line) + 1 for line in self.writer.lines)
     def close(self):
-        if self.myFileHandler != sys.stdout:
-            self.myFileHandler.close()
+        self.writer.close()
+        if isVerbose():
+            print "Wrote %d lines, %d bytes (%d bytes to file) to %s" % (self.writer.linesWritten, self.writer.bytesWritten,
+                                                                       self.writer.compressedBytesWritten, self.myFileName)
 
 class iNCSALogStream(iHttpdLogStream):
-    def __init__(self, fileHandler):
-        clf = ncsa_log.NCSALogFormat()
-        iHttpdLogStream.__init__(self, clf, ncsa_log.NCSALogRecord, "ncsa_log", fileHandler)
+    def __init__(self, fileHandler, fields=None, where=None, workers=1, chunkSize=None, ordered=True, materialize=None, cache=None,
+                 since=None, until=None, tolerance=httpd_log_timeindex.DEFAULT_TOLERANCE, timeIndex=False,
+                 follow=None, followBackend="auto", idleTimeout=None, readAhead=None,
+                 metrics=None, quarantine=None, quarantineSample=1, quarantineMaxBytes=httpd_log_metrics.DEFAULT_QUARANTINE_MAX_BYTES,
+                 intern=None, internMaxSize=httpd_log_intern.DEFAULT_MAX_SIZE, sample=None, sampleKey=None, sampleSeed=0):
+        where = httpd_log_timeindex.addTimeWindow(where, since, until)
+        formatArgs = (ncsa_log.NCSALogFormat.COMMON_FORMAT, getRequiredFields(fields, where, materialize, intern, sampleKey))
+        clf = ncsa_log.NCSALogFormat.getCached(*formatArgs)
+        iHttpdLogStream.__init__(self, clf, ncsa_log.NCSALogRecord, "ncsa_log", fileHandler, where,
+                                 workers, chunkSize, ordered, formatArgs, materialize, cache,
+                                 since, until, tolerance, timeIndex, follow, followBackend, idleTimeout, readAhead,
+                                 metrics, quarantine, quarantineSample, quarantineMaxBytes, None, intern, internMaxSize,
+                                 sample, sampleKey, sampleSeed)
 
 class oNCSALogStream(oHttpdLogStream):
-    def __init__(self, fileName, variableNames):
-        oHttpdLogStream.__init__(self, "ncsa_log", fileName, variableNames)
+    def __init__(self, fileName, variableNames, bufferSize=httpd_log_output.DEFAULT_BUFFER_SIZE, compressLevel=None, background=False, format=None):
+        oHttpdLogStream.__init__(self, "ncsa_log", fileName, variableNames, bufferSize, compressLevel, background, format)
 
 class iApacheLogStream(iHttpdLogStream):
-    def __init__(self, fileHandler, format="common"):
-        alf = apache_log.ApacheLogFormat(format)
-        iHttpdLogStream.__init__(self, alf, apache_log.ApacheLogRecord, "apache_log", fileHandler)
+    # format - Apache LogFormat string, predefined format name or "auto" - detect format by sample of the file and
+    # detect it again if many lines fail to match (see httpd_log_detect), detectionCache - directory of detected formats
+    # (True - default cache directory, None - don't cache)
+    def __init__(self, fileHandler, format="common", fields=None, where=None, workers=1, chunkSize=None, ordered=True, materialize=None, cache=None,
+                 since=None, until=None, tolerance=httpd_log_timeindex.DEFAULT_TOLERANCE, timeIndex=False,
+                 follow=None, followBackend="auto", idleTimeout=None, readAhead=None,
+                 metrics=None, quarantine=None, quarantineSample=1, quarantineMaxBytes=httpd_log_metrics.DEFAULT_QUARANTINE_MAX_BYTES,
+                 detectionCache=True, intern=None, internMaxSize=httpd_log_intern.DEFAULT_MAX_SIZE,
+                 sample=None, sampleKey=None, sampleSeed=0):
+        detector = None
+        if format == "auto":
+            import httpd_log_detect
+            fileHandler, format = httpd_log_detect.detectStreamFormat(fileHandler, detectionCache)
+            detector = httpd_log_detect.FormatDetector(format)
+        where = httpd_log_timeindex.addTimeWindow(where, since, until)
+        formatArgs = (format, getRequiredFields(fields, where, materialize, intern, sampleKey))
+        alf = apache_log.ApacheLogFormat.getCached(*formatArgs)
+        iHttpdLogStream.__init__(self, alf, apache_log.ApacheLogRecord, "apache_log", fileHandler, where,
+                                 workers, chunkSize, ordered, formatArgs, materialize, cache,
+                                 since, until, tolerance, timeIndex, follow, followBackend, idleTimeout, readAhead,
+                                 metrics, quarantine, quarantineSample, quarantineMaxBytes, detector, intern, internMaxSize,
+                                 sample, sampleKey, sampleSeed)
 
 class oApacheLogStream(oHttpdLogStream):
-    def __init__(self, fileName, variableNames):
-        oHttpdLogStream.__init__(self, "apache_log", fileName, variableNames)
+    def __init__(self, fileName, variableNames, bufferSize=httpd_log_output.DEFAULT_BUFFER_SIZE, compressLevel=None, background=False, format=None):
+        oHttpdLogStream.__init__(self, "apache_log", fileName, variableNames, bufferSize, compressLevel, background, format)
 
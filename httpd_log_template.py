@@ -0,0 +1,148 @@
+#
+# Copyright Michael Groys, 2014
+#
+# Analysis of LogFormat templates: split of the template to literal text and directives
+# and checks of characters that directive patterns can consume.
+# Used by field layouts of raw line prefilters (httpd_log_filter) and by rendering (httpd_log_render).
+#
+import sre_parse
+import sre_constants
+
+WHITESPACE = " \t\n\r\f\v"
+REGEX_SPECIAL_CHARS = set(".^$*+?{}[]\\|()")
+
+def _categoryMatches(category, char):
+    if category == sre_constants.CATEGORY_DIGIT:
+        return char.isdigit()
+    elif category == sre_constants.CATEGORY_NOT_DIGIT:
+        return not char.isdigit()
+    elif category == sre_constants.CATEGORY_SPACE:
+        return char in WHITESPACE
+    elif category == sre_constants.CATEGORY_NOT_SPACE:
+        return char not in WHITESPACE
+    elif category == sre_constants.CATEGORY_WORD:
+        return char.isalnum() or char == "_"
+    elif category == sre_constants.CATEGORY_NOT_WORD:
+        return not (char.isalnum() or char == "_")
+    return True
+
+def _setMatches(items, char):
+    code = ord(char)
+    negate = False
+    matches = False
+    for op, av in items:
+        if op == sre_constants.NEGATE:
+            negate = True
+        elif op == sre_constants.LITERAL:
+            matches = matches or av == code
+        elif op == sre_constants.RANGE:
+            matches = matches or av[0] <= code <= av[1]
+        elif op == sre_constants.CATEGORY:
+            matches = matches or _categoryMatches(av, char)
+        else:
+            return True
+    return matches != negate
+
+def _canMatchChar(subpattern, char, literalOnly):
+    # Conservatively checks whether regular expression can consume given character,
+    # if literalOnly is set checks only for explicit literals
+    for op, av in subpattern:
+        if op == sre_constants.LITERAL:
+            if av == ord(char):
+                return True
+        elif literalOnly and op in (sre_constants.NOT_LITERAL, sre_constants.ANY, sre_constants.IN):
+            pass
+        elif op == sre_constants.NOT_LITERAL:
+            if av != ord(char):
+                return True
+        elif op == sre_constants.ANY:
+            if char != "\n":
+                return True
+        elif op == sre_constants.IN:
+            if _setMatches(av, char):
+                return True
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            if _canMatchChar(av[2], char, literalOnly):
+                return True
+        elif op == sre_constants.SUBPATTERN:
+            if _canMatchChar(av[-1], char, literalOnly):
+                return True
+        elif op == sre_constants.BRANCH:
+            for branch in av[1]:
+                if _canMatchChar(branch, char, literalOnly):
+                    return True
+        elif op == sre_constants.AT:
+            pass
+        else:
+            return True
+    return False
+
+def getOuterGroup(pattern):
+    # Returns (prefix, groupName, suffix, groupSubpattern) if pattern is a named group surrounded by fixed literals
+    parsed = sre_parse.parse(pattern)
+    prefix = []
+    suffix = []
+    group = None
+    for op, av in parsed:
+        if op == sre_constants.LITERAL:
+            (suffix if group is not None else prefix).append(unichr(av) if av > 255 else chr(av))
+        elif op == sre_constants.SUBPATTERN and group is None and av[0] is not None:
+            group = av
+        else:
+            return None
+    if group is None:
+        return None
+    for name, index in parsed.pattern.groupdict.iteritems():
+        if index == group[0]:
+            return ("".join(prefix), name, "".join(suffix), group[-1])
+    return None
+
+class Directive(object):
+    def __init__(self, field, pattern):
+        self.field = field
+        self.pattern = pattern
+
+# Returns list of literal strings and Directive objects of the format template,
+# None if the template has directives without name or literals with regular expression special characters
+def parseTemplate(formatObj):
+    items = []
+    literal = ""
+    pos = 0
+    for mo in formatObj.pattern.finditer(formatObj.template):
+        literal += formatObj.template[pos:mo.start()]
+        pos = mo.end()
+        if mo.group("escaped") is not None:
+            literal += formatObj.delimiter
+            continue
+        field = mo.group("named") or mo.group("braced")
+        if field is None:
+            return None
+        if literal:
+            items.append(literal)
+            literal = ""
+        items.append(Directive(field, formatObj.getDirectivePattern(field)))
+    literal += formatObj.template[pos:]
+    if literal:
+        items.append(literal)
+    # literal text is part of regular expression, avoid any non trivial literals
+    for item in items:
+        if isinstance(item, basestring) and REGEX_SPECIAL_CHARS.intersection(item):
+            return None
+    return items
+
+def test():
+    import m.ut_utils as ut
+    from apache_log import ApacheLogFormat
+    ut.START_TEST("httpd_log_template")
+    alf = ApacheLogFormat("combined")
+    items = parseTemplate(alf)
+    ut.EXPECT_EQ(["h", " ", "l", " ", "u", " ", "t", ' "', "r", '" ', ">s", " ", "b", ' "', "{Referer}i", '" "', "{User-agent}i", '"'],
+                 "[item if isinstance(item, basestring) else item.field for item in items]")
+    ut.EXPECT_EQ(alf.getDirectivePattern("t"), "items[6].pattern")
+    ut.EXPECT_EQ(None, "parseTemplate(ApacheLogFormat('%h (%u) %>s'))")
+    prefix, name, suffix, subpattern = getOuterGroup(alf.getDirectivePattern("t"))
+    ut.EXPECT_EQ(("[", "time", "]"), "(prefix, name, suffix)")
+    ut.EXPECT_EQ(None, "getOuterGroup(alf.getDirectivePattern('h') + alf.getDirectivePattern('u'))")
+    ut.EXPECT_EQ([True, True, False], "[_canMatchChar(subpattern, c, False) for c in '1 ]']")
+    ut.EXPECT_EQ([True, False], "[_canMatchChar(sre_parse.parse(r'[^\\s]+|-'), c, True) for c in '-x']")
+    ut.END_TEST()
@@ -0,0 +1,147 @@
+#
+# Copyright Michael Groys, 2014
+#
+# Fast decoding of CLF time fields "dd/Mon/yyyy:HH:MM:SS" and "+zzzz".
+# Canonical timestamps are decoded by fixed positions, start of the hour is cached by "dd/Mon/yyyy:HH" prefix
+# and start of the minute by "dd/Mon/yyyy:HH:MM" prefix.
+# Anything else (one digit day, lower case month, leap seconds, invalid values) is decoded by time.strptime,
+# so results and raised exceptions are identical to strptime/timegm.
+#
+import time
+from calendar import timegm, monthrange
+
+CLF_TIME_FORMAT = "%d/%b/%Y:%H:%M:%S"
+MONTHS = {"Jan": 1, "Feb": 2, "Mar": 3, "Apr": 4, "May": 5, "Jun": 6,
+          "Jul": 7, "Aug": 8, "Sep": 9, "Oct": 10, "Nov": 11, "Dec": 12}
+MAX_CACHE_SIZE = 10000
+
+_hourCache = {}     # "dd/Mon/yyyy:HH" -> seconds since epoch
+_minuteCache = {}   # "dd/Mon/yyyy:HH:MM" -> seconds since epoch
+_offsetCache = {}   # "+zzzz" -> seconds
+_lastSeconds = [None, None] # last decoded localtime and its value, records of the same second are consecutive
+_lastStruct = [None, None]
+
+def _decodeHour(prefix):
+    if prefix[2] != "/" or prefix[6] != "/" or prefix[11] != ":":
+        return None
+    month = MONTHS.get(prefix[3:6])
+    if month is None:
+        return None
+    if not (prefix[0:2].isdigit() and prefix[7:11].isdigit() and prefix[12:14].isdigit()):
+        return None
+    day = int(prefix[0:2])
+    year = int(prefix[7:11])
+    hour = int(prefix[12:14])
+    # strptime validates day of month
+    if year < 1 or hour > 23 or not 1 <= day <= monthrange(year, month)[1]:
+        return None
+    seconds = timegm((year, month, day, hour, 0, 0))
+    if len(_hourCache) >= MAX_CACHE_SIZE:
+        _hourCache.clear()
+    _hourCache[prefix] = seconds
+    return seconds
+
+def _decodeMinute(prefix):
+    if prefix[14] != ":":
+        return None
+    hourStart = _hourCache.get(prefix[:14])
+    if hourStart is None:
+        hourStart = _decodeHour(prefix[:14])
+        if hourStart is None:
+            return None
+    minutes = prefix[15:17]
+    if not (minutes.isdigit() and minutes <= "59"):
+        return None
+    result = hourStart + int(minutes)*60
+    if len(_minuteCache) >= MAX_CACHE_SIZE:
+        _minuteCache.clear()
+    _minuteCache[prefix] = result
+    return result
+
+def _decodeSeconds(val):
+    # returns None if value is not in canonical format
+    if len(val) != 20 or val[17] != ":":
+        return None
+    minuteStart = _minuteCache.get(val[:17])
+    if minuteStart is None:
+        minuteStart = _decodeMinute(val[:17])
+        if minuteStart is None:
+            return None
+    seconds = val[18:20]
+    if not (seconds.isdigit() and seconds <= "59"):
+        return None
+    return minuteStart + int(seconds)
+
+# Same as timegm(time.strptime(val, CLF_TIME_FORMAT))
+def localtimeToSeconds(val):
+    if val == _lastSeconds[0]:
+        return _lastSeconds[1]
+    result = _decodeSeconds(val)
+    if result is None:
+        result = timegm(time.strptime(val, CLF_TIME_FORMAT))
+    _lastSeconds[0] = val
+    _lastSeconds[1] = result
+    return result
+
+# Same as time.strptime(val, CLF_TIME_FORMAT)
+def localtimeToStruct(val):
+    if val == _lastStruct[0]:
+        return _lastStruct[1]
+    seconds = _decodeSeconds(val)
+    if seconds is None:
+        result = time.strptime(val, CLF_TIME_FORMAT)
+    else:
+        result = time.struct_time(time.gmtime(seconds)[:8] + (-1,))
+    _lastStruct[0] = val
+    _lastStruct[1] = result
+    return result
+
+# Converts "+hhmm"/"-hhmm"/"hhmm" to seconds
+def gmtoffsetToSeconds(val):
+    result = _offsetCache.get(val)
+    if result is not None:
+        return result
+    offset = val
+    sign = 1
+    if offset[0] == "+":
+        offset = offset[1:]
+    elif offset[0] == "-":
+        offset = offset[1:]
+        sign = -1
+    result = sign * (int(offset[0:2],10)*3600 + int(offset[2:4],10)*60)
+    if len(_offsetCache) >= MAX_CACHE_SIZE:
+        _offsetCache.clear()
+    _offsetCache[val] = result
+    return result
+
+def test():
+    import m.ut_utils as ut
+    import random
+    ut.START_TEST("httpd_log_time")
+    def reference(val):
+        try:
+            st = time.strptime(val, CLF_TIME_FORMAT)
+            return st, timegm(st)
+        except ValueError:
+            return None
+    def decoded(val):
+        try:
+            return localtimeToStruct(val), localtimeToSeconds(val)
+        except ValueError:
+            return None
+    values = ["10/Oct/2000:13:55:36", "10/Oct/2000:13:55:37", "29/Feb/2000:00:00:00", "31/Feb/2001:23:59:59",
+              "01/Jan/1970:00:00:00", "31/Dec/1969:23:59:59", "1/Oct/2000:13:55:36", "10/oct/2000:13:55:36",
+              "10/OCT/2000:13:55:36", "10/Oct/2000:13:55:60", "10/Oct/2000:13:55:61", "10/Oct/2000:13:55:62",
+              "10/Oct/2000:24:00:00", "10/Oct/2000:23:60:00", "00/Oct/2000:13:55:36", "32/Oct/2000:13:55:36",
+              "10/Foo/2000:13:55:36", "10/Sept/2000:13:55:36", "010/Oct/2000:13:55:36", "10/Oct/2000:13:55:36"]
+    rnd = random.Random(5)
+    months = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+    for i in range(2000):
+        values.append("%02d/%s/%04d:%02d:%02d:%02d" % (rnd.randint(0, 32), rnd.choice(months), rnd.randint(1900, 2100),
+                                                      rnd.randint(0, 24), rnd.randint(0, 60), rnd.randint(0, 61)))
+    for val in values:
+        expected = reference(val)
+        ut.EXPECT_EQ(expected, "decoded(val)", msg=val)
+    for val, seconds in [("-0730", -(7*3600+30*60)), ("+0000", 0), ("0200", 7200), ("+1245", 12*3600+45*60), ("-0730", -27000)]:
+        ut.EXPECT_EQ(seconds, "gmtoffsetToSeconds(val)", msg=val)
+    ut.END_TEST()
@@ -0,0 +1,247 @@
+#
+# Copyright Michael Groys, 2014
+#
+# Time window queries on time ordered log files.
+# Apache writes the line when request is completed, while %t is the time request was received,
+# so time of the line may be smaller than time of preceding lines by up to the request duration,
+# tolerance is maximal such delay in seconds.
+# Reading starts from the last line with time before (start - tolerance): its position is found by
+# binary search over byte offsets that decodes only time of the first complete line after the probe,
+# or by sparse sidecar index of (offset, time) probes saved next to the log file.
+# Reading stops at the first line with time at or after (end + tolerance).
+# Lines inside this range are checked by "gmtime" predicates of the stream.
+#
+import os
+import array
+import bisect
+import struct
+import httpd_log_time
+from httpd_log_filter import parsePredicates, parseTime, Predicate
+from m.common import MiningError
+
+DEFAULT_TOLERANCE = 60
+INDEX_EXTENSION = ".tidx"
+INDEX_STEP = 1024*1024
+INDEX_VERSION = 1
+MIN_BISECT_RANGE = 64*1024
+MAX_PROBE_LINES = 100
+COMPRESSED_EXTENSIONS = (".gz", ".bz2", ".zst", ".xz", ".lzma", ".zip")
+
+# Returns gmtime of the first "[dd/Mon/yyyy:HH:MM:SS +zzzz]" in the line or None
+def getLineTime(line):
+    pos = line.find("[")
+    while pos >= 0:
+        if line[pos+27:pos+28] == "]" and line[pos+21:pos+22] == " " and line[pos+22:pos+23] in ("+", "-"):
+            try:
+                return httpd_log_time.localtimeToSeconds(line[pos+1:pos+21]) - httpd_log_time.gmtoffsetToSeconds(line[pos+22:pos+27])
+            except ValueError:
+                pass
+        pos = line.find("[", pos+1)
+    return None
+
+# "gmtime" predicates of the time window, where is extended by them
+def addTimeWindow(where, since=None, until=None):
+    if since is None and until is None:
+        return where
+    predicates = parsePredicates(where) if where else []
+    if since is not None:
+        predicates.append(Predicate("gmtime", ">=", parseTime(str(since))))
+    if until is not None:
+        predicates.append(Predicate("gmtime", "<", parseTime(str(until))))
+    return predicates
+
+# Returns (offset, time) of the first line starting at or after offset that has time,
+# (None, None) if there is no such line
+def probeTime(f, offset):
+    f.seek(max(offset-1, 0))
+    if offset > 0 and f.read(1) != "\n":
+        f.readline()
+    for i in xrange(MAX_PROBE_LINES):
+        lineOffset = f.tell()
+        line = f.readline()
+        if not line:
+            break
+        t = getLineTime(line)
+        if t is not None:
+            return lineOffset, t
+    return None, None
+
+# Returns offset of the last probed line with time before threshold or 0
+def bisectOffset(f, size, threshold):
+    lo = 0
+    hi = size
+    result = 0
+    while hi - lo > MIN_BISECT_RANGE:
+        mid = (lo + hi) // 2
+        lineOffset, t = probeTime(f, mid)
+        if lineOffset is None or t >= threshold:
+            hi = mid
+        else:
+            result = lineOffset
+            lo = mid
+    return result
+
+class TimeIndex(object):
+    # sparse index of (offset, time) of the first line after every step bytes
+    def __init__(self, size, mtime, offsets, times):
+        self.size = size
+        self.mtime = mtime
+        self.offsets = offsets
+        self.times = times
+
+    @classmethod
+    def build(cls, fileName, step=INDEX_STEP):
+        stat = os.stat(fileName)
+        offsets = array.array("l")
+        times = array.array("d")
+        f = open(fileName, "rb")
+        try:
+            for offset in xrange(0, stat.st_size, step):
+                lineOffset, t = probeTime(f, offset)
+                if lineOffset is None:
+                    continue
+                if not offsets or lineOffset > offsets[-1]:
+                    offsets.append(lineOffset)
+                    times.append(t)
+        finally:
+            f.close()
+        return cls(stat.st_size, stat.st_mtime, offsets, times)
+
+    @classmethod
+    def load(cls, indexFile):
+        f = open(indexFile, "rb")
+        try:
+            data = f.read()
+        finally:
+            f.close()
+        headerSize = struct.calcsize("<IQdQ")
+        if len(data) < headerSize:
+            raise ValueError("truncated time index")
+        version, size, mtime, count = struct.unpack("<IQdQ", data[:headerSize])
+        if version != INDEX_VERSION or len(data) != headerSize + count*16:
+            raise ValueError("invalid time index")
+        offsets = array.array("l")
+        times = array.array("d")
+        values = struct.unpack("<%dq%dd" % (count, count), data[headerSize:])
+        offsets.fromlist(list(values[:count]))
+        times.fromlist(list(values[count:]))
+        return cls(size, mtime, offsets, times)
+
+    def save(self, indexFile):
+        count = len(self.offsets)
+        data = struct.pack("<IQdQ", INDEX_VERSION, self.size, self.mtime, count)
+        data += struct.pack("<%dq%dd" % (count, count), *(self.offsets.tolist() + self.times.tolist()))
+        tmpFile = "%s.%d.tmp" % (indexFile, os.getpid())
+        f = open(tmpFile, "wb")
+        try:
+            f.write(data)
+        finally:
+            f.close()
+        os.rename(tmpFile, indexFile)
+
+    def isValid(self, fileName):
+        stat = os.stat(fileName)
+        return stat.st_size == self.size and stat.st_mtime == self.mtime
+
+    # offset of the last indexed line with time before threshold or 0
+    def findOffset(self, threshold):
+        i = bisect.bisect_left(self.times, threshold)
+        return self.offsets[i-1] if i > 0 else 0
+
+# Returns up to date time index of the file, index is rebuilt and saved if it is stale
+def getTimeIndex(fileName, step=INDEX_STEP):
+    indexFile = fileName + INDEX_EXTENSION
+    try:
+        index = TimeIndex.load(indexFile)
+        if index.isValid(fileName):
+            return index
+    except (IOError, ValueError, struct.error):
+        pass
+    index = TimeIndex.build(fileName, step)
+    try:
+        index.save(indexFile)
+    except (IOError, OSError):
+        # directory of the log is not writable, index is used only by this stream
+        pass
+    return index
+
+def isSeekable(fileName):
+    return bool(fileName) and os.path.isfile(fileName) and not fileName.endswith(COMPRESSED_EXTENSIONS)
+
+# Returns offset to start reading the file for time window starting at since
+def findStartOffset(fileName, since, tolerance=DEFAULT_TOLERANCE, useIndex=False):
+    threshold = parseTime(str(since)) - tolerance
+    if useIndex:
+        return getTimeIndex(fileName).findOffset(threshold)
+    f = open(fileName, "rb")
+    try:
+        return bisectOffset(f, os.fstat(f.fileno()).st_size, threshold)
+    finally:
+        f.close()
+
+class TimeWindowLines(object):
+    # Iterates over lines of the file handler until line with time at or after until + tolerance
+    def __init__(self, fileHandler, until, tolerance=DEFAULT_TOLERANCE):
+        self.fileHandler = fileHandler
+        self.stopTime = parseTime(str(until)) + tolerance
+        self.stopped = False
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self.stopped:
+            raise StopIteration
+        line = self.fileHandler.next()
+        t = getLineTime(line)
+        if t is not None and t >= self.stopTime:
+            self.stopped = True
+            raise StopIteration
+        return line
+
+    def __getattr__(self, name):
+        return getattr(self.fileHandler, name)
+
+def test():
+    import m.ut_utils as ut
+    import tempfile
+    import random
+    import time
+    import calendar
+    ut.START_TEST("httpd_log_timeindex")
+    ut.EXPECT_EQ(971186136, "getLineTime('1.2.3.4 - - [10/Oct/2000:13:55:36 +0000] \"GET / HTTP/1.0\" 200 1')")
+    ut.EXPECT_EQ(971211336, "getLineTime('[x] [10/Oct/2000:13:55:36 -0700] \"GET / HTTP/1.0\" 200 1')")
+    ut.EXPECT_EQ(None, "getLineTime('1.2.3.4 - - [10/Oct/2000:13:55:36] \"GET / HTTP/1.0\" 200 1')")
+    rnd = random.Random(9)
+    start = calendar.timegm((2000, 10, 10, 0, 0, 0))
+    lines = []
+    for i in range(20000):
+        # written at completion: up to 30 seconds earlier than previous lines
+        t = start + i*2 - rnd.randint(0, 30)
+        lines.append('10.0.0.%d - - [%s +0000] "GET /path/%d HTTP/1.1" 200 %d' % (i%256, time.strftime("%d/%b/%Y:%H:%M:%S", time.gmtime(t)), i, i))
+        if i % 1000 == 7:
+            lines.append("garbage %d" % i)
+    fd, fileName = tempfile.mkstemp(suffix=".log")
+    os.write(fd, "\n".join(lines) + "\n")
+    os.close(fd)
+    try:
+        from httpd_log_stream import iNCSALogStream
+        since = start + 20000
+        until = start + 22000
+        expected = [line for line in lines if getLineTime(line) is not None and since <= getLineTime(line) < until]
+        getTimeIndex(fileName, step=16*1024)
+        for useIndex in [False, True]:
+            offset = findStartOffset(fileName, since, 30, useIndex)
+            ut.EXPECT_EQ(True, "offset > 0", msg="useIndex=%s" % useIndex)
+            stream = iNCSALogStream(open(fileName), since=since, until="2000-10-10 06:06:40", tolerance=30, timeIndex=useIndex)
+            ut.EXPECT_EQ(expected, "[r.line for r, in stream]", msg="useIndex=%s" % useIndex)
+            ut.EXPECT_EQ(offset, "stream.startOffset")
+        ut.EXPECT_EQ(True, "os.path.exists(fileName + INDEX_EXTENSION)")
+        ut.EXPECT_EQ(True, "TimeIndex.load(fileName + INDEX_EXTENSION).isValid(fileName)")
+        stream = iNCSALogStream(open(fileName), since=0, until=start + 10)
+        ut.EXPECT_EQ([line for line in lines if getLineTime(line) is not None and getLineTime(line) < start + 10], "[r.line for r, in stream]")
+    finally:
+        os.unlink(fileName)
+        if os.path.exists(fileName + INDEX_EXTENSION):
+            os.unlink(fileName + INDEX_EXTENSION)
+    ut.END_TEST()
@@ -0,0 +1,136 @@
+#
+# Copyright Michael Groys, 2014
+#
+# Memoized parsing of urls and query strings of httpd records.
+# Few distinct urls cover most of the traffic, so parsed values are kept in bounded LRU caches keyed by the raw string:
+# dictionary of circular doubly linked list nodes [prev, next, key, value], hit moves the node to the front,
+# miss beyond maxSize reuses the least recently used node.
+# Parsed values are shared between records with the same url and should not be modified.
+# Hit, miss and eviction counters of the caches (getCacheStats) show whether maxSize fits the traffic.
+#
+import urlparse
+from m.common import MiningError
+
+DEFAULT_URL_CACHE_SIZE = 10000
+DEFAULT_QUERY_CACHE_SIZE = 10000
+
+PREV, NEXT, KEY, VALUE = 0, 1, 2, 3
+
+class LRUCache(object):
+    # returns function(key) values, keeps maxSize latest used of them
+    def __init__(self, function, maxSize):
+        if maxSize < 1:
+            raise MiningError("Cache size should be positive, got %s" % maxSize)
+        self.function = function
+        self.maxSize = maxSize
+        self.clear()
+
+    def clear(self):
+        self.nodes = {}
+        self.root = []
+        self.root[:] = [self.root, self.root, None, None]
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        node = self.nodes.get(key)
+        root = self.root
+        if node is not None:
+            self.hits += 1
+            prev, next = node[PREV], node[NEXT]
+            prev[NEXT] = next
+            next[PREV] = prev
+            last = root[PREV]
+            last[NEXT] = root[PREV] = node
+            node[PREV] = last
+            node[NEXT] = root
+            return node[VALUE]
+        self.misses += 1
+        value = self.function(key)
+        if len(self.nodes) >= self.maxSize:
+            # root becomes the new node, the oldest node becomes root
+            root[KEY] = key
+            root[VALUE] = value
+            self.nodes[key] = root
+            self.root = root[NEXT]
+            del self.nodes[self.root[KEY]]
+            self.root[KEY] = self.root[VALUE] = None
+            self.evictions += 1
+        else:
+            last = root[PREV]
+            node = [last, root, key, value]
+            last[NEXT] = root[PREV] = self.nodes[key] = node
+        return value
+
+    def resize(self, maxSize):
+        if maxSize < 1:
+            raise MiningError("Cache size should be positive, got %s" % maxSize)
+        self.maxSize = maxSize
+        self.clear()
+
+    def getStats(self):
+        requests = self.hits + self.misses
+        return {
+            "size": len(self.nodes),
+            "maxSize": self.maxSize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hitRate": float(self.hits) / requests if requests else 0.,
+        }
+
+_Url = None
+
+def parseUrl(url):
+    global _Url
+    if _Url is None:
+        from http_parsers import Url
+        _Url = Url
+    return _Url(url)
+
+# returns dictionary of query argument name to list of its values
+def parseQueryString(queryString):
+    if not queryString:
+        return {}
+    if queryString[0] == "?":
+        queryString = queryString[1:]
+    return urlparse.parse_qs(queryString, keep_blank_values=True)
+
+urlCache = LRUCache(parseUrl, DEFAULT_URL_CACHE_SIZE)
+queryCache = LRUCache(parseQueryString, DEFAULT_QUERY_CACHE_SIZE)
+
+# caches reported by getCacheStats, other modules add their caches
+caches = {"url": urlCache, "query": queryCache}
+
+def getCacheStats():
+    return dict((name, cache.getStats()) for name, cache in caches.iteritems())
+
+def test():
+    import m.ut_utils as ut
+    ut.START_TEST("httpd_log_url")
+    calls = []
+    def square(x):
+        calls.append(x)
+        return x * x
+    cache = LRUCache(square, 3)
+    ut.EXPECT_EQ([1, 4, 9, 1, 16], "[cache.get(x) for x in [1, 2, 3, 1, 4]]")
+    # 2 is the least recently used
+    ut.EXPECT_EQ([1, 3, 4], "sorted(cache.nodes)")
+    ut.EXPECT_EQ([4, 1], "[cache.get(2), cache.get(1)]")
+    ut.EXPECT_EQ([1, 2, 3, 4, 2], "calls")
+    ut.EXPECT_EQ([1, 2, 4], "sorted(cache.nodes)")
+    stats = cache.getStats()
+    ut.EXPECT_EQ((2, 5, 2, 3), "(stats['hits'], stats['misses'], stats['evictions'], stats['size'])")
+    # order of the list follows usage
+    ut.EXPECT_EQ([4, 2, 1], "[cache.root[NEXT][KEY], cache.root[NEXT][NEXT][KEY], cache.root[PREV][KEY]]")
+    ut.EXPECT_EQ({"q": ["val", "x y"], "e": [""]}, "parseQueryString('?q=val&q=x+y&e=')")
+    ut.EXPECT_EQ({}, "parseQueryString('')")
+    ut.EXPECT_EQ({}, "parseQueryString(None)")
+    from ncsa_log import getTestNCSARecord
+    record = getTestNCSARecord()
+    queryCache.clear()
+    ut.EXPECT_EQ({"q": ["val"]}, "record.queryArgs")
+    ut.EXPECT_EQ(True, "record.queryArgs is getTestNCSARecord().queryArgs")
+    ut.EXPECT_EQ((2, 1), "(getCacheStats()['query']['hits'], getCacheStats()['query']['misses'])")
+    ut.END_TEST()
@@ -2,6 +2,8 @@
 # Copyright Michael Groys, 2014
 #
 from httpd_log_format import *
+import httpd_log_time
+import httpd_log_url
 
 class NCSALogFormat(LogFormat):
     delimiter = "%"
@@ -46,18 +48,71 @@ class NCSALogFormat(LogFormat):
         "s": [("firstStatus", FLD_STATUS)],
         "b": [("bytes", FLD_NUMBYTES)],
     }
+
+    # record properties which read fields with different group names
+    fieldAliases = {
+        "fulltimeAsStr": ["time"],
+        "localtimeAsStr": ["localtime"],
+        "localtimeAsStruct": ["localtime"],
+        "gmtime": ["localtime", "gmtoffset"],
+        "gmtoffsetAsStr": ["gmtoffset"],
+        "method": ["requestMethod"],
+        "url": ["requestUrl"],
+        "protocol": ["requestProtocol"],
+        "statusAsStr": ["status"],
+        "numbytes": ["bytes"],
+        "numbytesAsStr": ["bytes"],
+        "urlPath": ["requestUrlPath"],
+        "urlRoot": ["requestUrlRoot"],
+        "queryString": ["requestQueryString"],
+        "queryArgs": ["requestQueryString"],
+    }
     
-    def __init__(self, formatStr = COMMON_FORMAT):
-        LogFormat.__init__(self, formatStr)
+    def __init__(self, formatStr = COMMON_FORMAT, fields=None):
+        LogFormat.__init__(self, formatStr, fields)
         self.fieldToGroupId = [None]*self.__class__.NUM_FIELDS
+        self.requiredFieldIds = None
+        if self.requiredFields is not None:
+            self.requiredFieldIds = self.resolveRequiredFields()
         self.createMatch()
-    
+
+    # converts required field names (group names or record properties) to set of field ids
+    def resolveRequiredFields(self):
+        groupToFieldId = {}
+        for refs in self.__class__.fieldReferences.itervalues():
+            for groupName, fldId in refs:
+                groupToFieldId[groupName] = fldId
+        fieldIds = set()
+        for name in list(self.requiredFields):
+            names = self.__class__.fieldAliases.get(name, []) + [name]
+            ids = [groupToFieldId[n] for n in names if n in groupToFieldId]
+            if not ids and not self.isCollectionField(name):
+                raise MiningError("Unknown httpd log field '%s'" % name)
+            fieldIds.update(ids)
+        return fieldIds
+
+    # can be overridden by child to allow arbitrary field names (like headers)
+    def isCollectionField(self, name):
+        return False
+
+    def isGroupRequired(self, groupName):
+        if self.requiredFieldIds is None:
+            return True
+        for refs in self.__class__.fieldReferences.itervalues():
+            for refGroupName, fldId in refs:
+                if refGroupName == groupName:
+                    return fldId in self.requiredFieldIds
+        return groupName in self.requiredFields
+
     def registerFieldReferences(self, field):
         refs = self.__class__.fieldReferences.get(field)
         if not refs:
             return
         for groupName, fldId in refs:
-            toolsLog.info("Adding for field '%s' group=%s id=%s", field, groupName, fldId)
+            if not self.isGroupRequired(groupName):
+                continue
+            if self.logEnabled:
+                toolsLog.info("Adding for field '%s' group=%s id=%s", field, groupName, fldId)
             self.addReference(groupName, self.fieldToGroupId, fldId)
 
     def getField(self, fieldId, matchObj):
@@ -78,6 +133,11 @@ class NCSALogFormat(LogFormat):
         return str(fieldId)
 
 class NCSALogRecord(object):
+    # properties computed from other field (source), not stored by columnar cache
+    derivedFields = {"queryArgs": "queryString"}
+    # records of sampled streams represent 1/fraction lines (see httpd_log_sample)
+    sampleWeight = 1
+
     def __init__(self, format, line, match=None):
         self._format = format
         self.line = line
@@ -100,26 +160,16 @@ class NCSALogRecord(object):
         return self._format.getField(NCSALogFormat.FLD_LOCALTIME, self._match)
     @property
     def localtimeAsStruct(self):
-        val = self.localtimeAsStr
-        return time.strptime(val, "%d/%b/%Y:%H:%M:%S")
+        return httpd_log_time.localtimeToStruct(self.localtimeAsStr)
     @property
     def gmtime(self):
-        from calendar import timegm
-        val = self.localtimeAsStruct
-        return timegm(val) - self.gmtoffset
+        return httpd_log_time.localtimeToSeconds(self.localtimeAsStr) - self.gmtoffset
     @property
     def gmtoffsetAsStr(self):
         return self._format.getField(NCSALogFormat.FLD_GMTOFFSET, self._match)
     @property
     def gmtoffset(self):
-        val = self.gmtoffsetAsStr
-        sign = 1
-        if val[0] == "+":
-            val = val[1:]
-        elif val[0] == "-":
-            val = val[1:]
-            sign = -1
-        return sign * (int(val[0:2],10)*3600 + int(val[2:4],10)*60) 
+        return httpd_log_time.gmtoffsetToSeconds(self.gmtoffsetAsStr)
     @property
     def request(self):
         return self._format.getField(NCSALogFormat.FLD_REQUEST, self._match)
@@ -161,6 +211,10 @@ class NCSALogRecord(object):
     @property
     def queryString(self):
         return self._format.getField(NCSALogFormat.FLD_QUERY_STRING, self._match)
+    @property
+    def queryArgs(self):
+        # decoded query string {name: [values]}, shared by records with the same query string
+        return httpd_log_url.queryCache.get(self.queryString)
 
     def __str__(self):
         return "[%s] %s \"%s\" -> %s %s" % (self.fulltimeAsStr, self.remoteHost, self.request, self.statusAsStr, self.numbytesAsStr)
@@ -186,4 +240,5 @@ def test():
     ut.EXPECT_EQ("/path/script.php", "record.urlPath")
     ut.EXPECT_EQ(None, "record.urlRoot")
     ut.EXPECT_EQ("?q=val", "record.queryString")
+    ut.EXPECT_EQ({"q": ["val"]}, "record.queryArgs")
     ut.END_TEST()
\ No newline at end of file
@@ -1,16 +1,16 @@
 import miner_globals
-from ncsa_log import getTestNCSARecord    
-from apache_log import getTestApacheRecord
+from httpd_log_record import LazyRecord
 
-# Completion symbols
-ncsa_log = getTestNCSARecord()
+# Completion symbols, test records are parsed on first use
+ncsa_log = LazyRecord("ncsa_log", "getTestNCSARecord")
 miner_globals.addCompletionSymbol('ncsa_log', ncsa_log)
-apache_log = getTestApacheRecord()
+apache_log = LazyRecord("apache_log", "getTestApacheRecord")
 miner_globals.addCompletionSymbol('apache_log', apache_log)
 
 # define targets
 miner_globals.addTargetToClassMapping("ncsa_log", "httpd_log_stream.iNCSALogStream", "httpd_log_stream.oNCSALogStream", "reads NCSA formatted web server logs")
 miner_globals.addTargetToClassMapping("apache_log", "httpd_log_stream.iApacheLogStream", "httpd_log_stream.oApacheLogStream", "reads apache formatted web server logs, allows custom formatting")
+miner_globals.addTargetToClassMapping("merged_apache_log", "httpd_log_merge.iMergedLogStream", None, "reads time ordered merge of apache formatted web server logs listed in the file, one per line")
 
 #parsers    
 miner_globals.addParserMapping("url", "ncsa_log", "httpd_log_stream.parseUrlFromLog")